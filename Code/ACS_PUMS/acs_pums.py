@@ -1,14 +1,27 @@
+import gzip
+import json
 import os
+import threading
 import urllib.request
 import zipfile
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
 from io import BytesIO
 
-from pandas import Series, DataFrame
+from Code.ACS_PUMS.household_array import (HouseholdArray, loadHouseholdArray, pumsFolder, stateFileStamps,
+                                          stateHouseholdArray)
+from Code.Geocorr.crosswalk_registry import (CrossWalk, allocateTotals, geographyColumn, getCrossWalk,
+                                             loadCrossWalkFile)
+from Code.output_writer import (OutputWriter, findOutputFile, isOutputFile, outputFile, outputFormat, output_formats,
+                                readFrame, writeFrame)
+from Code.pipeline_trace import submitTraced, traceStage, tracedStage
+from Code.USAC.tracker_series import loadTrackerSeries
+
+# The replicate weights of the PUMS household files, used for the standard errors
+replicate_weight_columns = ["WGTP" + str(i) for i in range(1, 81)]
 
 
 def downloadOldPumaNewPumaFile(data_dir: str):
@@ -20,6 +33,9 @@ def downloadOldPumaNewPumaFile(data_dir: str):
     :return: None, but saves the file to the data directory
     """
 
+    import requests
+    from bs4 import BeautifulSoup
+
     # Create the folder if it doesn't exist
     download_folder = data_dir + "GeoCorr/"
 
@@ -85,13 +101,16 @@ def downloadOldPumaNewPumaFile(data_dir: str):
     return download_folder + "puma_equivalency.csv"
 
 
-def crossWalkOldPumaNewPuma(all_eligibility_df: pd.DataFrame, crosswalk_file: str) -> pd.DataFrame:
+def crossWalkOldPumaNewPuma(all_eligibility_df: pd.DataFrame, crosswalk_file: str,
+                            exact_allocation: int = 0) -> pd.DataFrame:
     """
     This function will crosswalk the PUMS data from 2012 pumas to 2020 pumas. It does so by reading the crosswalk file
     and creating a dictionary with the 2012 puma codes as keys and the 2020 puma codes as values. It then iterates
     through the dictionary and multiplies the data by the afact. It then aggregates the data by the 2020 puma code.
     :param all_eligibility_df: The dataframe with the eligibility data
     :param crosswalk_file: The path to the crosswalk file
+    :param exact_allocation: Whether to round once per 2012 puma with the largest remainder method, so the totals of
+    the 2020 pumas add up to the totals of the 2012 pumas 0|1. See allocateTotals
     :return: A dataframe with the eligibility data crosswalked to 2020 pumas
     """
 
@@ -114,45 +133,49 @@ def crossWalkOldPumaNewPuma(all_eligibility_df: pd.DataFrame, crosswalk_file: st
     df_dict = df.set_index("puma22").T.to_dict("list")
     # dict: {puma12: [eligible]}
 
-    new_df = pd.DataFrame()
+    # Crosswalk the puma12 to puma22, keeping the fractions until every puma12 is rounded once
+    if exact_allocation == 1:
+        new_df = allocateCodeDict(df, dictionary, "puma22", "puma22")
 
-    # Crosswalk the puma12 to puma22
+    # Crosswalk the puma12 to puma22, rounding every piece
+    else:
+        new_df = pd.DataFrame()
 
-    # Iterate through the dictionary keys
-    for puma22 in dictionary.keys():
+        # Iterate through the dictionary keys
+        for puma22 in dictionary.keys():
 
-        # Iterate through the tuples in the dictionary
-        for tup in dictionary[puma22]:
-            # Initialize the new data list
-            new_data = []
-            # Get the puma12 and afact
-            puma12 = tup[0]
-            afact = tup[1]
+            # Iterate through the tuples in the dictionary
+            for tup in dictionary[puma22]:
+                # Initialize the new data list
+                new_data = []
+                # Get the puma12 and afact
+                puma12 = tup[0]
+                afact = tup[1]
 
-            # Check if the puma12 is in the df_dict
-            if puma12 in df_dict.keys():
-                # Get the data
-                data = df_dict[puma12]
+                # Check if the puma12 is in the df_dict
+                if puma12 in df_dict.keys():
+                    # Get the data
+                    data = df_dict[puma12]
 
-                # Add the puma22 to the new data list
-                new_data.append(puma22)
+                    # Add the puma22 to the new data list
+                    new_data.append(puma22)
 
-                # Iterate through the data and multiply it by the afact
-                for d in data:
-                    # Multiply the data by the afact and round it, then add it to the new data list
-                    new_data.append(int(round(d * afact)))
+                    # Iterate through the data and multiply it by the afact
+                    for d in data:
+                        # Multiply the data by the afact and round it, then add it to the new data list
+                        new_data.append(int(round(d * afact)))
 
-                # Create a dataframe with the new data
-                temp_df = pd.DataFrame([new_data], columns=columns)
+                    # Create a dataframe with the new data
+                    temp_df = pd.DataFrame([new_data], columns=columns)
 
-                # Add the dataframe to the new dataframe
-                new_df = pd.concat([new_df, temp_df], axis=0)
+                    # Add the dataframe to the new dataframe
+                    new_df = pd.concat([new_df, temp_df], axis=0)
 
-    # Aggregate the data by the puma
-    new_df = new_df.groupby(["puma22"]).sum()
+        # Aggregate the data by the puma
+        new_df = new_df.groupby(["puma22"]).sum()
 
-    # Reset the index
-    new_df.reset_index(inplace=True)
+        # Reset the index
+        new_df.reset_index(inplace=True)
 
     # Zero fill the code column
     new_df["puma22"] = new_df["puma22"].str.zfill(7)
@@ -174,7 +197,8 @@ def crossWalkOldPumaNewPuma(all_eligibility_df: pd.DataFrame, crosswalk_file: st
     return new_df
 
 
-def crosswalkPUMAData(df: pd.DataFrame, crosswalk_dict: dict, source_column: str, target_column: str) -> pd.DataFrame:
+def crosswalkPUMAData(df: pd.DataFrame, crosswalk_dict: dict, source_column: str, target_column: str,
+                      exact_allocation: int = 0) -> pd.DataFrame:
     """
     This function will crosswalk the pums data from puma to another geography. It does so by reading the crosswalk file
     and creating a dictionary with the puma codes as keys and the new geography codes as values. It then iterates
@@ -183,9 +207,15 @@ def crosswalkPUMAData(df: pd.DataFrame, crosswalk_dict: dict, source_column: str
     :param crosswalk_dict: The dictionary with the crosswalk data
     :param source_column: The column name for the source geography, which would be the puma column
     :param target_column: The column name for the target geography, which would be the new geography column
+    :param exact_allocation: Whether to round once per puma with the largest remainder method, so the totals of the new
+    geography add up to the totals of the pumas 0|1. See allocateTotals
     :return: A dataframe with the puma data crosswalked to the new geography
     """
 
+    # Keep the fractions until every puma is rounded once
+    if exact_allocation == 1:
+        return allocateCodeDict(df, crosswalk_dict, source_column, target_column)
+
     columns = df.columns.tolist()
 
     # Replace the code column with the new code column
@@ -257,102 +287,62 @@ def crosswalkPUMAData(df: pd.DataFrame, crosswalk_dict: dict, source_column: str
     return new_df
 
 
-def code_to_source_dict(crosswalk_file: str, source_col: str) \
-        -> tuple[dict[str, list[tuple[str, Series | Series | DataFrame]]], str | Any]:
+def allocateCodeDict(df: pd.DataFrame, crosswalk_dict: dict, source_column: str, target_column: str) -> pd.DataFrame:
     """
-    This function will create a dictionary with the target codes as keys and the source codes as values. It will also
-    return the column name for the target codes. It does so by reading the crosswalk file and finding the column with
-    the target codes. It then groups the source codes by the target codes, and creates a dictionary with the target
-    codes as keys and the source codes as values.
-    An example of the dictionary is:
-    {puma22: [(zcta1, afact1), (zcta2, afact2), ...]}
-    :param crosswalk_file: The path to the crosswalk file
-    :param source_col: the column name for the source codes
-    :return: a dictionary with the target codes as keys and the source codes as values, and the column name for the
-    target codes
+    This function will crosswalk the pums data with the largest remainder method of allocateTotals. It gives the same
+    dataframe as crosswalkPUMAData, but the total of every puma is rounded once and split between its pieces, instead
+    of rounding every piece.
+    :param df: The dataframe with the puma data, with one row per puma
+    :param crosswalk_dict: The dictionary with the target codes as keys and lists of (puma, afact) tuples as values
+    :param source_column: The column name for the source geography, which would be the puma column
+    :param target_column: The column name for the target geography
+    :return: A dataframe with the puma data crosswalked to the new geography, sorted by the target code
     """
 
-    code_col = ""
-
-    # Get the column name for the source geography
-    df_zeros = pd.read_csv(crosswalk_file)
-    for col in df_zeros.columns.tolist():
-        if source_col in col:
-            source_col = col
-            break
-
-    # Read the crosswalk file to get the column names
-    df_zeros = pd.read_csv(crosswalk_file, dtype={source_col: str})
+    # The row of every puma, with the puma codes written as seven digits
+    positions = {}
+    for i, puma in enumerate(df[source_column].astype(str).tolist()):
+        positions.setdefault(puma.split(".")[0].zfill(7), i)
 
-    # Read the column names
-    col_names = df_zeros.columns.tolist()
-    col_names.remove(source_col)
-
-    # Find the column with the target codes
-    for col in col_names:
-        if "zcta" in col:
-            code_col = col
-            break
-        elif "county" in col and "tract" not in col_names:
-            code_col = col
-            break
-        elif "metdiv" in col:
-            code_col = col
-            break
-        elif "puma" in col:
-            code_col = col
-            break
-        elif "tract" in col:
-            code_col = col
-            break
-        elif "cd" in col:
-            code_col = col
-            break
-        elif "sdbest" in col:
-            code_col = col
-            break
-        elif "sdelem" in col:
-            code_col = col
-            break
-        elif "sdsec" in col:
-            code_col = col
-            break
-        elif "sduni" in col:
-            code_col = col
-            break
-        elif "state" in col:
-            code_col = col
-            break
+    # Find the pieces of the crosswalk with a puma in the data
+    targets, sources, afacts = [], [], []
+    for key, value in crosswalk_dict.items():
+        for puma, afact in value:
+            position = positions.get(str(puma).split(".")[0].zfill(7))
+            if position is not None:
+                targets.append(key)
+                sources.append(position)
+                afacts.append(afact)
 
-    try:
-        df = pd.read_csv(crosswalk_file, dtype={source_col: str, code_col: str})
-    except:
-        df = pd.read_csv(crosswalk_file, dtype={source_col: str})
+    target_codes, target_idx = np.unique(np.array(targets, dtype=str), return_inverse=True)
 
-    # Group the source by code
-    cw_lists = df.groupby(code_col)[source_col].apply(list)
+    data_columns = df.columns.drop(source_column)
+    totals = allocateTotals(df[data_columns].to_numpy(dtype=np.float64), np.array(sources, dtype=np.intp),
+                            target_idx, np.array(afacts), len(target_codes), exact_allocation=1)
 
-    # Initialize the dictionary to store the data
-    code_zcta_dict = {}
+    new_df = pd.DataFrame(totals, columns=data_columns)
+    new_df.insert(0, target_column, target_codes.astype(object))
 
-    # Iterate through the target codes
-    for index, row in cw_lists.items():
-        data = []
-        for item in row:
-            # Find the afact on the crosswalk dataframe by the source code and the target code
-            afact = df.loc[(df[source_col] == item) & (df[code_col] == index), 'afact'].iloc[0]
+    return new_df
 
-            # Create a tuple with the source code and the afact
-            tup = (str(item), afact)
 
-            # Add the tuple to the list
-            data.append(tup)
+def code_to_source_dict(crosswalk_file: str, source_col: str) -> tuple[dict[str, list[tuple[str, float]]], str]:
+    """
+    This function will create a dictionary with the target codes as keys and the source codes as values. It will also
+    return the column name for the target codes. The crosswalk file is loaded through the crosswalk registry, so it is
+    only read and compiled once and every caller shares the same copy.
+    An example of the dictionary is:
+    {puma22: [(zcta1, afact1), (zcta2, afact2), ...]}
+    :param crosswalk_file: The path to the crosswalk file
+    :param source_col: the column name for the source codes
+    :return: a dictionary with the target codes as keys and the source codes as values, and the column name for the
+    target codes
+    """
 
-        # Add the list to the dictionary
-        code_zcta_dict[str(index)] = data
+    crosswalk = loadCrossWalkFile(crosswalk_file, source_col)
 
     # Return the dictionary and the column name for the target codes
-    return code_zcta_dict, code_col
+    return crosswalk.toSourceDict(), crosswalk.target_col
 
 
 def downloadPUMSFiles(data_directory: str):
@@ -363,6 +353,9 @@ def downloadPUMSFiles(data_directory: str):
     urllib to download the files. The files are saved to the PUMS folder in the data directory into state folders.
     """
 
+    import requests
+    from bs4 import BeautifulSoup
+
     # Path to the folder where the PUMS files will be saved
     pums_folder = data_directory + "ACS_PUMS"
 
@@ -435,19 +428,27 @@ def downloadPUMSFiles(data_directory: str):
     del response
 
 
-def create_state_sheet(df_person: pd.DataFrame, df_household: pd.DataFrame, output_file: str, state_code: str):
+def replicateWeightsFile(eligibility_file: str) -> str:
+    """
+    This function gets the path to the file with the replicate weights of a state, which is saved next to the
+    eligibility file of the state. It is compressed, and does not end with .csv so that it is not read as an
+    eligibility file.
+    :param eligibility_file: The path to the eligibility file of the state
+    :return: The path to the replicate weights file
     """
 
+    return eligibility_file[:-len("-eligibility.csv")] + "-replicate-weights.csv.gz"
+
+
+def collapseHouseholds(df_person: pd.DataFrame, df_household: pd.DataFrame, state_code: str) -> pd.DataFrame:
+    """
+    This function will merge the person and household records and collapse them into one row per household, with the
+    eligibility criteria for ACP, the PUMA code, the weight, and demographic information. Every person of a household
+    has to be in df_person.
     :param df_person: the person dataframe from the PUMS person zip file
     :param df_household: the household dataframe from the PUMS household zip file
-    :param output_file: the name of the file to save the data to
     :param state_code: the state code, used to create the full 7-digit puma code
-    :return: None, but saves the data to a csv file
-
-    This function will create a csv file containing the eligibility criteria for ACP for each SERIALNO in the PUMS data,
-    as well as the PUMA code, the weight, and demographic information. This will be used later to determine eligibility
-    depending on the projected criteria.
-
+    :return: A dataframe with one row per SERIALNO, with SERIALNO as the index
     """
 
     # Merge the two dataframes
@@ -576,28 +577,210 @@ def create_state_sheet(df_person: pd.DataFrame, df_household: pd.DataFrame, outp
     collapsed["PUMA_person"] = collapsed["PUMA_person"].str.zfill(5)
     collapsed["PUMA_person"] = state_code + collapsed["PUMA_person"]
 
+    # Delete variables that are no longer needed
+    del merged
+
+    return collapsed
+
+
+def create_state_sheet(df_person: pd.DataFrame, df_household: pd.DataFrame, output_file: str, state_code: str):
+    """
+
+    :param df_person: the person dataframe from the PUMS person zip file
+    :param df_household: the household dataframe from the PUMS household zip file
+    :param output_file: the name of the file to save the data to
+    :param state_code: the state code, used to create the full 7-digit puma code
+    :return: None, but saves the data to a csv file
+
+    This function will create a csv file containing the eligibility criteria for ACP for each SERIALNO in the PUMS data,
+    as well as the PUMA code, the weight, and demographic information. This will be used later to determine eligibility
+    depending on the projected criteria. The replicate weights WGTP1 to WGTP80 of every household are saved to the
+    file from replicateWeightsFile, to compute the standard errors.
+
+    """
+
+    collapsed = collapseHouseholds(df_person, df_household, state_code)
+
     # Save the data
     collapsed.to_csv(output_file)
 
+    # Save the replicate weights of the households that were kept
+    if set(replicate_weight_columns).issubset(df_household.columns):
+        replicate_df = df_household.loc[df_household["SERIALNO"].isin(collapsed.index),
+                                        ["SERIALNO"] + replicate_weight_columns]
+        replicate_df.to_csv(replicateWeightsFile(output_file), index=False)
+
     # Delete variables that are no longer needed
-    del merged
     del collapsed
 
 
-def everyStateEligibility(data_directory: str):
+# The columns of the PUMS files used by collapseHouseholds, read in the chunked mode
+person_columns = ["RT", "SERIALNO", "PUMA", "HINS4", "PAP", "SSIP", "POVPIP", "RACAIAN", "RACASN", "RACBLK", "RACNH",
+                  "RACPI", "RACWHT", "HISP", "AGEP", "DIS", "ENG", "VPS"]
+household_columns = ["RT", "SERIALNO", "PUMA", "FS", "WGTP"]
+
+# How many times the memory of the person records a chunk uses while it is merged and collapsed
+chunk_memory_factor = 4
+
+# The smallest number of person records in a chunk
+chunk_min_rows = 1000
+
+
+def _readZipCsv(zip_path: str, member: str, **kwargs):
+    """
+    This function reads a csv file inside a zip file with pandas. With chunksize, the chunks are read while the zip
+    file is open.
+    :param zip_path: The path to the zip file
+    :param member: The name of the csv file inside the zip file
+    :param kwargs: The arguments of pd.read_csv
+    :return: The dataframe, or the chunks of the dataframe if chunksize is given
+    """
+
+    with zipfile.ZipFile(zip_path, "r") as zip_file:
+        with zip_file.open(member) as file:
+            if "chunksize" in kwargs:
+                with pd.read_csv(file, **kwargs) as reader:
+                    yield from reader
+            else:
+                yield pd.read_csv(file, **kwargs)
+
+
+def _personChunks(person_files: list[tuple[str, str]], chunk_rows: int):
+    """
+    This function streams the person records of a state in chunks, without splitting a household across two chunks.
+    The person files are sorted by SERIALNO, so the rows of the last household of a chunk are kept and added to the
+    next chunk.
+    :param person_files: The (zip file, csv file) tuples of the person files
+    :param chunk_rows: The number of rows to read at a time
+    :return: The chunks, as dataframes
+    """
+
+    carry = None
+    last_serialno = None
+
+    for zip_path, member in person_files:
+        for chunk in _readZipCsv(zip_path, member, usecols=lambda col: col in person_columns,
+                                 dtype={"PUMA": str, "SERIALNO": str}, chunksize=chunk_rows):
+            serialnos = chunk["SERIALNO"]
+
+            # The households can only be kept together if the file is sorted by SERIALNO
+            if not serialnos.is_monotonic_increasing or (last_serialno is not None and
+                                                          serialnos.iloc[0] < last_serialno):
+                raise ValueError(f"{member} is not sorted by SERIALNO, it cannot be read in chunks")
+            last_serialno = serialnos.iloc[-1]
+
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+
+            # Keep the last household for the next chunk, since it may continue there
+            last_household = chunk["SERIALNO"] == last_serialno
+            carry = chunk[last_household]
+            chunk = chunk[~last_household]
+
+            if len(chunk) > 0:
+                yield chunk
+
+    if carry is not None and len(carry) > 0:
+        yield carry
+
+
+def createStateSheetChunked(person_files: list[tuple[str, str]], household_files: list[tuple[str, str]],
+                            output_file: str, state_code: str, memory_budget_mb: int):
+    """
+    This function creates the same files as create_state_sheet, but without holding every person record of the state in
+    memory. The households are read once into a lookup indexed by SERIALNO with only the columns that are used, and the
+    person records are streamed in chunks of whole households. Every chunk is merged with the lookup, collapsed, and
+    added to the output file. The replicate weights are then streamed from the household files in the same way, if the
+    household files have them.
+    :param person_files: The (zip file, csv file) tuples of the person files of the state
+    :param household_files: The (zip file, csv file) tuples of the household files of the state
+    :param output_file: the name of the file to save the data to
+    :param state_code: the state code, used to create the full 7-digit puma code
+    :param memory_budget_mb: The memory the household lookup and the chunks can use, in MB. A ValueError is raised if
+    the budget is too small for the lookup and a chunk of chunk_min_rows person records
+    :return: None, but saves the data to a csv file
+    """
+
+    if not person_files or not household_files:
+        raise ValueError(f"{output_file} needs both the person and the household files of the state")
+
+    # Read the household lookup, with only the columns that are used
+    household_df = pd.concat([df for zip_path, member in household_files
+                              for df in _readZipCsv(zip_path, member, usecols=household_columns,
+                                                    dtype={"PUMA": str, "SERIALNO": str})], ignore_index=True)
+    lookup = household_df.set_index("SERIALNO", drop=False)
+    del household_df
+
+    # Estimate the memory of a person record from the start of the first file
+    sample = next(_readZipCsv(*person_files[0], usecols=lambda col: col in person_columns,
+                              dtype={"PUMA": str, "SERIALNO": str}, nrows=1000))
+    row_bytes = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    lookup_bytes = lookup.memory_usage(deep=True).sum()
+    available = memory_budget_mb * 1024 ** 2 - lookup_bytes
+    chunk_rows = int(available / (row_bytes * chunk_memory_factor))
+
+    # Chunks that are too small would take too long, so the budget has to fit the smallest chunk
+    if chunk_rows < chunk_min_rows:
+        needed = (lookup_bytes + chunk_min_rows * row_bytes * chunk_memory_factor) / 1024 ** 2
+        raise ValueError(f"A memory budget of {memory_budget_mb} MB is too small for {output_file}: the household "
+                         f"lookup uses {lookup_bytes / 1024 ** 2:.0f} MB, and the budget has to be at least "
+                         f"{np.ceil(needed):.0f} MB")
+
+    kept = []
+    header = True
+
+    with open(output_file, "w", newline="") as file:
+        for chunk in _personChunks(person_files, chunk_rows):
+            households = lookup.loc[lookup.index.intersection(chunk["SERIALNO"].unique())]
+
+            collapsed = collapseHouseholds(chunk, households.reset_index(drop=True), state_code)
+            collapsed.to_csv(file, header=header)
+            header = False
+
+            kept.append(collapsed.index.to_numpy())
+
+    kept = pd.Index(np.concatenate(kept) if kept else [])
+    del lookup
+
+    # Like create_state_sheet, only save the replicate weights if the household files have them
+    household_header = {column for zip_path, member in household_files
+                        for df in _readZipCsv(zip_path, member, nrows=0) for column in df.columns}
+    if not set(replicate_weight_columns).issubset(household_header):
+        return
+
+    # Stream the replicate weights of the households that were kept
+    weight_columns = ["SERIALNO"] + replicate_weight_columns
+    with gzip.open(replicateWeightsFile(output_file), "wt", newline="") as file:
+        header = True
+        for zip_path, member in household_files:
+            for chunk in _readZipCsv(zip_path, member, usecols=lambda col: col in weight_columns,
+                                     dtype={"SERIALNO": str}, chunksize=chunk_rows):
+                chunk = chunk.loc[chunk["SERIALNO"].isin(kept)].reindex(columns=weight_columns)
+                chunk.to_csv(file, header=header, index=False)
+                header = False
+
+
+@tracedStage("everyStateEligibility")
+def everyStateEligibility(data_directory: str, vintage: str = None, memory_budget_mb: int = None,
+                          states: list[str] = None):
     """
     This function will determine eligibility for ACP for all states. It does so by iterating through all the states and
     calling the determineEligibility function for each state. It will save the data to a csv file in the state folder.
     :param data_directory: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param memory_budget_mb: If given, the person records are streamed in chunks that fit in this many MB with
+    createStateSheetChunked, instead of reading every file of the state at once
+    :param states: Only create the files of these states, by their folder in the state_data folder, such as "al", for
+    a state whose PUMS files were published again. If None, every state is used
     :return: None, but saves the data to csv files
     """
 
     # Path to the folder where the PUMS files are saved
-    data_dir = data_directory + "ACS_PUMS/"
+    data_dir = pumsFolder(data_directory, vintage)
     state_dir = data_dir + "state_data/"
 
     # Iterate through all folders in the ACS_PUMS folder
-    for state in os.listdir(state_dir):
+    for state in os.listdir(state_dir) if states is None else states:
         # Initialize the dataframes
         person_df = pd.DataFrame()
 
@@ -606,6 +789,36 @@ def everyStateEligibility(data_directory: str):
         # Create the file name
         end_file = state_dir + state + "/" + state + "-eligibility.csv"
 
+        # Stream the person records in chunks if there is a memory budget
+        if memory_budget_mb is not None:
+            person_files = []
+            household_files = []
+            for zip_folder in sorted(os.listdir(state_dir + state)):
+                if zip_folder.endswith(".zip"):
+                    folder_name = state_dir + state + "/" + zip_folder
+                    with zipfile.ZipFile(folder_name, 'r') as zip_file:
+                        for file in zip_file.namelist():
+                            if file.endswith("csv"):
+                                # Get the state code from the file name
+                                end = file.find(".csv")
+                                state_code = str(file[end - 2:end]).zfill(2)
+
+                                if file.startswith("psam_h"):
+                                    household_files.append((folder_name, file))
+                                elif file.startswith("psam_p"):
+                                    person_files.append((folder_name, file))
+
+            # Skip a state whose PUMS files were not downloaded
+            if not person_files or not household_files:
+                print(f"The PUMS files of {state} were not found, so its eligibility file is not created")
+                continue
+
+            with traceStage("collapse") as stage:
+                createStateSheetChunked(person_files, household_files, end_file, state_code, memory_budget_mb)
+                stage.addWrite(end_file)
+
+            continue
+
         # Iterate through all zipped files in the state folder
         for zip_folder in os.listdir(state_dir + state):
             # Only unzip the zip files
@@ -634,8 +847,16 @@ def everyStateEligibility(data_directory: str):
                                 person_df = pd.concat(
                                     [person_df, pd.read_csv(zip_file.open(file), dtype={"PUMA": str})])
 
+        # Skip a state whose PUMS files were not downloaded
+        if person_df.empty or household_df.empty:
+            print(f"The PUMS files of {state} were not found, so its eligibility file is not created")
+            continue
+
         # Call the function to determine eligibility
-        create_state_sheet(person_df, household_df, end_file, state_code)
+        with traceStage("collapse") as stage:
+            stage.addRows(rows_in=len(person_df))
+            create_state_sheet(person_df, household_df, end_file, state_code)
+            stage.addWrite(end_file)
 
     # Delete variables that are no longer needed
     del person_df
@@ -650,6 +871,9 @@ def downloadCoveredPopFile():
     :return: A dataframe with the covered population data
     """
 
+    import requests
+    from bs4 import BeautifulSoup
+
     # Website
     website = "https://www.census.gov/programs-surveys/community-resilience-estimates/partnerships/ntia/digital-equity.html"
 
@@ -710,178 +934,280 @@ def downloadCoveredPopFile():
         print("No link found.")
 
 
-def determine_eligibility(data_dir: str, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
-                          has_snap: int = 1, geography: str = "Public-use microdata area (PUMA)",
-                          aian: int = 0, asian: int = 0, black: int = 0, nhpi: int = 0, white: int = 0,
-                          hispanic: int = 0, veteran: int = 0, elderly: int = 0, disability: int = 0,
-                          eng_very_well: int = 0, end_folder: str = "Change_Eligibility/"):
+# The covered populations, as the start of their column names and the parameter that turns them on
+covered_populations = [
+    ("American Indian and Alaska Native", "aian"),
+    ("Asian", "asian"),
+    ("Black or African American", "black"),
+    ("Native Hawaiian", "nhpi"),
+    ("White", "white"),
+    ("Hispanic or Latino", "hispanic"),
+    ("Veteran", "veteran"),
+    ("Elderly", "elderly"),
+    ("DIS", "disability"),
+    ("English less than very well", "eng_very_well")
+]
+
+# The columns of the files that describe the areas and do not depend on the households, such as the names added by
+# formatGeographyEligibility and the party of the congressional districts from addCDFlag
+area_columns = ["rural", "CountyName", "MetDivName", "Democratic"]
+
+# The current eligibility of every geography, by the path to its file in Current_Eligibility without the extension, so
+# that it is only read or computed once per session. The current eligibility that is computed because there is no file
+# is kept by the path and the exact_allocation it was computed with
+_baselines = {}
+_baselines_lock = threading.Lock()
+
+# The folder the eligibility of every PUMA of a scenario is saved to by savePumaAggregates, one file per state
+puma_aggregates_folder_name = ".puma_aggregates"
+
+# Every geography the eligibility can be aggregated by, as it is written in the GeoCorr Application
+all_geographies = ["Public-use microdata area (PUMA)", "County", "118th Congress (2023-2024)", "Metropolitan division",
+                   "ZIP/ZCTA", "State"]
+
+
+def selectedPopulations(population_flags: dict[str, int]) -> list[tuple[str, str]]:
     """
-    This function will determine eligibility for ACP for all states. It does so by iterating through all the states and
-    reading the eligibility data for each state. It will then aggregate the data by the geography specified. It will
-    then save the data to a csv file in the state folder.
+    This function finds the covered populations that are used.
+    :param population_flags: A dictionary with the parameters of the covered populations as keys, such as "aian", and
+    0|1 as values
+    :return: The (column name, parameter) tuples of the covered populations that are used
+    """
+
+    return [(population_name, population_var) for population_name, population_var in covered_populations
+            if population_flags.get(population_var, 0) == 1]
+
+
+def computePUMAEligibility(data_dir: str, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
+                           has_snap: int = 1, populations: list[tuple[str, str]] = None,
+                           households: HouseholdArray = None, vintage: str = None,
+                           exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function will find the number of eligible and ineligible households in every PUMA. The households of every
+    state are read from the household arrays of loadHouseholdArray, which are built from the state files the first
+    time, and the eligible and ineligible households of every PUMA are summed in one pass by pumaTotals. If the state
+    files use the 2010 PUMAs, the data is crosswalked to the 2020 PUMAs. Every geography is crosswalked from this
+    dataframe.
     :param data_dir: The path to the data directory which contains the ACS_PUMS folder
     :param povpip: The desired income threshold
     :param has_pap: Whether to use the PAP criteria 0|1
     :param has_ssip: Whether to use the SSIP criteria 0|1
     :param has_hins4: Whether to use the HINS4 criteria 0|1
     :param has_snap: Whether to use the SNAP criteria 0|1
-    :param geography: The geography to aggregate the data by
-    :param aian: Whether we want to see the effects to the American Indian and Alaska Native population 0|1
-    :param asian: Whether we want to see the effects to the Asian population 0|1
-    :param black: Whether we want to see the effects to the Black or African American population 0|1
-    :param nhpi: Whether we want to see the effects to the Native Hawaiian population 0|1
-    :param white: Whether we want to see the effects to the White population 0|1
-    :param hispanic: Whether we want to see the effects to the Hispanic or Latino population 0|1
-    :param veteran: Whether we want to see the effects to the Veteran population 0|1
-    :param elderly: Whether we want to see the effects to the Elderly population 0|1
-    :param disability: Whether we want to see the effects to the Disability population 0|1
-    :param eng_very_well: Whether we want to see the effects to the population that speaks English very well 0|1
-    :param end_folder: The folder to save the data to
-    :return: None, but saves the data to csv files
+    :param populations: The covered populations to add, from selectedPopulations
+    :param households: The household arrays from loadHouseholdArray. If None, they are loaded
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param exact_allocation: Whether to remap the 2010 PUMAs with the largest remainder method of allocateTotals,
+    so the totals of the 2020 PUMAs add up to the totals of the 2010 PUMAs 0|1
+    :return: A dataframe with the puma22, Num Eligible, Num Ineligible, Percentage Eligible and covered population
+    columns
     """
 
-    # Path to relevant folders
-    pums_folder = data_dir + "ACS_PUMS/"
-    state_folder = pums_folder + "state_data/"
-    current_data = pums_folder + "Current_Eligibility/"
-    test_data = pums_folder + end_folder
-    geocorr_folder = data_dir + "GeoCorr/"
-    puma_cw_folder = geocorr_folder + "Public-use microdata area (PUMA)/"
+    if populations is None:
+        populations = []
 
+    # Load the household arrays if they are not given
+    if households is None:
+        households = loadHouseholdArray(data_dir, vintage)
 
-    if not os.path.exists(current_data):
-        os.makedirs(current_data)
+    with traceStage("aggregate") as stage:
+        main_df = households.pumaEligibility(povpip, has_pap, has_ssip, has_hins4, has_snap,
+                                             [population_name for population_name, _ in populations],
+                                             exact_allocation)
+        stage.addRows(rows_in=len(households), rows_out=len(main_df))
 
-    if not os.path.exists(test_data):
-        os.makedirs(test_data)
+    # Sort the main dataframe by puma22
+    main_df.sort_values(by=["puma22"], inplace=True)
 
+    # Round the percentage eligible column to two decimal places
+    main_df["Percentage Eligible"] = (main_df["Percentage Eligible"] * 100).round(2)
 
+    # PUMAs are seven digits, so add leading zeros
+    main_df["puma22"] = main_df["puma22"].astype(str)
+    main_df["puma22"] = main_df["puma22"].str.zfill(7)
+
+    # If it is using 2010 PUMAs, then crosswalk the data to 2020 PUMAs
+    if '0600102' in main_df['puma22'].values:
+        with traceStage("crosswalk") as stage:
+            cw_File = downloadOldPumaNewPumaFile(data_dir)
+            main_df = crossWalkOldPumaNewPuma(main_df, cw_File, exact_allocation)
+            stage.addRows(rows_out=len(main_df))
+
+    return main_df
 
-    # Dictionary to map the geography to the code column and crosswalk file
-    geography_mapping = {
-        "Public-use microdata area (PUMA)": ("puma22", "puma_equivalency.csv"),
-        "118th Congress (2023-2024)": (
-            "cd118", "United_States_Public-Use-Microdata-Area-(Puma)_to_118Th-Congress-(2023-2024).csv"),
-        "State": ("state", "United_States_Public-Use-Microdata-Area-(Puma)_to_State.csv"),
-        "County": ("county", "United_States_Public-Use-Microdata-Area-(Puma)_to_County.csv"),
-        "ZIP/ZCTA": ("zcta", "United_States_Public-Use-Microdata-Area-(Puma)_to_ZIP-ZCTA.csv"),
-        "Unified school district": (
-            "sduni20", "United_States_Public-Use-Microdata-Area-(Puma)_to_Unified-School-District.csv"),
-        "Metropolitan division": (
-            "metdiv20", "United_States_Public-Use-Microdata-Area-(Puma)_to_Metropolitan-Division.csv")
-    }
-
-    # Get the code column and crosswalk file
-    code_column, cw_name = geography_mapping[geography]
-    cw_file = puma_cw_folder + cw_name
-
-    # Create the columns for the dataframe
-    columns = ["puma22", "Num Eligible", "Num Ineligible", "Percentage Eligible"]
-
-    # Initialize the variables for the columns of covered populations
-    covered_populations = [
-        ("American Indian and Alaska Native", "aian"),
-        ("Asian", "asian"),
-        ("Black or African American", "black"),
-        ("Native Hawaiian", "nhpi"),
-        ("White", "white"),
-        ("Hispanic or Latino", "hispanic"),
-        ("Veteran", "veteran"),
-        ("Elderly", "elderly"),
-        ("DIS", "disability"),
-        ("English less than very well", "eng_very_well")
-    ]
-
-    # Add the columns for the covered populations if they are used
-    for population_name, population_var in covered_populations:
-        if locals()[population_var] == 1:
-            columns.append(population_name + " Eligible")
-
-    # Create a dataframe to store the results, which will first be stored in puma
-    main_df = pd.DataFrame(columns=columns)
+
+def computePUMAReplicates(data_dir: str, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
+                          has_snap: int = 1, populations: list[tuple[str, str]] = None, vintage: str = None) \
+        -> tuple[np.ndarray, list[str], np.ndarray]:
+    """
+    This function will find the number eligible in every PUMA with the full weight WGTP and with every replicate
+    weight WGTP1 to WGTP80, for the standard errors. The households of a PUMA are multiplied with their 81 weights in
+    one matrix multiplication, instead of running the eligibility 80 more times. If the state files use the 2010
+    PUMAs, the totals are crosswalked to the 2020 PUMAs.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param povpip: The desired income threshold
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param populations: The covered populations to add, from selectedPopulations
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :return: The PUMA codes, the names of the totals, such as "Num Eligible", and an array of the totals with one row
+    per PUMA, one column per total, and the 81 weights on the last axis
+    """
+
+    state_folder = pumsFolder(data_dir, vintage) + "state_data/"
+
+    if populations is None:
+        populations = []
+
+    measures = ["Num Eligible"] + [population_name + " Eligible" for population_name, _ in populations]
+    weight_columns = ["WGTP"] + replicate_weight_columns
+
+    puma_totals = {}
 
     # Iterate through all folders in the State data folder
     for state in os.listdir(state_folder):
-        # Save the path to the state folder
         state_files = state_folder + state + "/"
-        # Iterate through all files in the state folder
         for file in os.listdir(state_files):
             # Only read the csv files
-            if file.endswith(".csv"):
-                # Read the file
-                temp_df = pd.read_csv(state_files + file, header=0)
+            if not file.endswith(".csv"):
+                continue
+
+            with traceStage("read") as stage:
+                temp_df = pd.read_csv(state_files + file, header=0, dtype={"SERIALNO": str})
+                stage.addRead(state_files + file)
+
+                replicate_file = replicateWeightsFile(state_files + file)
+                if not os.path.exists(replicate_file):
+                    raise FileNotFoundError(f"{replicate_file} does not exist, run everyStateEligibility to create it")
+
+                # Add the replicate weights to every household
+                replicate_df = pd.read_csv(replicate_file, header=0, dtype={"SERIALNO": str})
+                stage.addRead(replicate_file)
+                temp_df = pd.merge(temp_df, replicate_df, on="SERIALNO", how="left", validate="1:1")
+                stage.addRows(rows_out=len(temp_df))
+
+            with traceStage("replicates") as stage:
+                stage.addRows(rows_in=len(temp_df))
+
+                # Find the eligible households, in the same way as computePUMAEligibility
+                eligible = (((temp_df["has_pap"] == 1) & (has_pap == 1)) |
+                            ((temp_df["has_ssip"] == 1) & (has_ssip == 1)) |
+                            ((temp_df["has_hins4"] == 1) & (has_hins4 == 1)) |
+                            ((temp_df["has_snap"] == 1) & (has_snap == 1)))
+                if povpip != 0:
+                    eligible |= temp_df["POVPIP"] <= povpip
 
-                # Drop SERIALNO column
-                temp_df = temp_df.drop(columns=["SERIALNO"])
+                # One column for every total, with 1 if the household is counted in it
+                indicators = np.column_stack(
+                    [eligible.to_numpy()] +
+                    [eligible.to_numpy() & (temp_df[population_name].to_numpy() != 0)
+                     for population_name, _ in populations]).astype(np.float64)
+                weights = temp_df[weight_columns].fillna(0).to_numpy(dtype=np.float64)
 
-                # Turn all acp_eligible values to 0
-                temp_df["acp_eligible"] = 0
+                # Multiply the households of every PUMA with their weights
+                for puma_person, rows in temp_df.groupby("PUMA_person").indices.items():
+                    puma_totals[str(puma_person).zfill(7)] = indicators[rows].T @ weights[rows]
 
-                # If the povpip is not 0, then use it as a criteria
-                if povpip != 0:
-                    # Turn all acp_eligible values to 1 if they meet the criteria and if we are using the criteria
-                    temp_df.loc[(temp_df["POVPIP"] <= povpip) | ((temp_df["has_pap"] == 1) & (has_pap == 1)) |
-                                ((temp_df["has_ssip"] == 1) & (has_ssip == 1)) |
-                                ((temp_df["has_hins4"] == 1) & (has_hins4 == 1)) |
-                                ((temp_df["has_snap"] == 1) & (has_snap == 1)), "acp_eligible"] = 1
-
-                # If the povpip is 0, then use the other criteria
-                else:
-                    temp_df.loc[((temp_df["has_pap"] == 1) & (has_pap == 1)) |
-                                ((temp_df["has_ssip"] == 1) & (has_ssip == 1)) |
-                                ((temp_df["has_hins4"] == 1) & (has_hins4 == 1)) |
-                                ((temp_df["has_snap"] == 1) & (has_snap == 1)), "acp_eligible"] = 1
-
-                # Find the total number eligible for every PUMA_person
-                unique_puma_person = temp_df["PUMA_person"].unique()
-
-                # Iterate through every PUMA_person
-                for puma_person in unique_puma_person:
-                    # Create a dataframe for the PUMA_person
-                    puma_df = temp_df.loc[temp_df["PUMA_person"] == puma_person]
-
-                    # Find the number eligible and ineligible
-                    eligible_df = puma_df.loc[puma_df["acp_eligible"] == 1]
-                    ineligible_df = puma_df.loc[puma_df["acp_eligible"] == 0]
-
-                    eligible = eligible_df["WGTP"].sum()
-                    ineligible = ineligible_df["WGTP"].sum()
-
-                    # Calculate the percentage eligible
-                    percentage_eligible = eligible / (eligible + ineligible)
-
-                    # Create a list to store the data
-                    data = [puma_person, eligible, ineligible, percentage_eligible]
-
-                    # If the covered populations are used, then add the number eligible for each population
-                    for population_name, population_var in covered_populations:
-                        if locals()[population_var] == 1:
-                            data.append(eligible_df[population_name].sum())
-
-                    # Add the puma_person and percentage eligible to the main dataframe
-                    new_df = pd.DataFrame([data], columns=columns)
-
-                    # If the main df is empty, set it equal to the new df
-                    if main_df.empty:
-                        main_df = new_df
-                    else:
-                        # Add the new dataframe to the main dataframe
-                        main_df = pd.concat([main_df, new_df], axis=0)
+                stage.addRows(rows_out=len(puma_totals))
 
-    # Sort the main dataframe by puma22
-    main_df.sort_values(by=["puma22"], inplace=True)
+    codes = np.array(sorted(puma_totals), dtype=str)
+    totals = np.array([puma_totals[code] for code in codes]).reshape(len(codes), len(measures), len(weight_columns))
 
-    # Round the percentage eligible column to two decimal places
-    main_df["Percentage Eligible"] = (main_df["Percentage Eligible"] * 100).round(2)
+    # If it is using 2010 PUMAs, then crosswalk the totals to 2020 PUMAs
+    if "0600102" in puma_totals:
+        crosswalk = loadCrossWalkFile(downloadOldPumaNewPumaFile(data_dir), "puma12")
+        codes, totals = crosswalkReplicates(codes, totals, crosswalk)
+        codes = np.array([code.zfill(7) for code in codes], dtype=str)
 
-    # PUMAs are seven digits, so add leading zeros
-    main_df["puma22"] = main_df["puma22"].astype(str)
-    main_df["puma22"] = main_df["puma22"].str.zfill(7)
+    return codes, measures, totals
 
-    # If it is using 2010 PUMAs, then crosswalk the data to 2020 PUMAs
-    if '0600102' in main_df['puma22'].values:
-        cw_File = downloadOldPumaNewPumaFile(data_dir)
-        main_df = crossWalkOldPumaNewPuma(main_df, cw_File)
+
+def crosswalkReplicates(codes: np.ndarray, totals: np.ndarray, crosswalk: CrossWalk) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function will crosswalk the totals from computePUMAReplicates to another geography. Every replicate is
+    multiplied by the afact and added to its target, without rounding.
+    :param codes: The PUMA codes
+    :param totals: The totals, with one row per PUMA
+    :param crosswalk: The crosswalk from the PUMAs to the geography
+    :return: The codes of the geography and the totals, with one row per code
+    """
+
+    # The position of every PUMA, with the PUMA codes written as seven digits
+    positions = {code: i for i, code in enumerate(codes.tolist())}
+    source_codes = [code.split(".")[0].zfill(7) for code in crosswalk.source_codes.tolist()]
+    source_positions = np.array([positions.get(code, -1) for code in source_codes], dtype=np.intp)
+
+    # Keep the rows of the crosswalk with a PUMA in the totals
+    rows = source_positions[np.asarray(crosswalk.source_idx)] >= 0
+    source = source_positions[np.asarray(crosswalk.source_idx)[rows]]
+    target = np.asarray(crosswalk.target_idx)[rows]
+    afact = np.round(np.asarray(crosswalk.afact)[rows].astype(np.float64), 6)
+
+    target_totals = np.zeros((len(crosswalk.target_codes),) + totals.shape[1:])
+    np.add.at(target_totals, target, totals[source] * afact[:, None, None])
+
+    # Only keep the targets with a PUMA
+    used = np.unique(target)
+
+    return np.asarray(crosswalk.target_codes)[used], target_totals[used]
+
+
+def replicateStandardErrors(codes: np.ndarray, measures: list[str], totals: np.ndarray, code_column: str) \
+        -> pd.DataFrame:
+    """
+    This function will compute the successive difference replication standard error of every total, which is
+    SE = sqrt(4 / 80 * sum((replicate - estimate) ^ 2)).
+    :param codes: The codes of the geography
+    :param measures: The names of the totals, such as "Num Eligible"
+    :param totals: The totals, with one row per code and the 81 weights on the last axis
+    :param code_column: The code column of the geography
+    :return: A dataframe with the code column and a "<total> SE" column for every total
+    """
+
+    differences = totals[:, :, 1:] - totals[:, :, :1]
+    standard_errors = np.sqrt(4 / 80 * (differences ** 2).sum(axis=2)).round(2)
+
+    df = pd.DataFrame(standard_errors, columns=[measure + " SE" for measure in measures])
+    df.insert(0, code_column, codes.astype(str))
+
+    return df
+
+
+def eligibilityFileName(data_dir: str, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
+                        has_snap: int = 1, populations: list[tuple[str, str]] = None,
+                        end_folder: str = "Change_Eligibility/", vintage: str = None) -> tuple[str, bool]:
+    """
+    This function will create the start of the file name for the eligibility of a scenario, without the geography. If
+    all the criteria are used, the file is saved in the Current_Eligibility folder, else it is saved in the end folder.
+    The folders are created if they do not exist.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param povpip: The desired income threshold
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param populations: The covered populations that are used, from selectedPopulations
+    :param end_folder: The folder to save the data to
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the files are saved in the ACS_PUMS folder
+    :return: The path to the file without the geography and extension, and whether the scenario is a change from the
+    current eligibility
+    """
+
+    # Path to relevant folders
+    pums_folder = pumsFolder(data_dir, vintage)
+    current_data = pums_folder + "Current_Eligibility/"
+    test_data = pums_folder + end_folder
+
+    if not os.path.exists(current_data):
+        os.makedirs(current_data)
+
+    if not os.path.exists(test_data):
+        os.makedirs(test_data)
+
+    if populations is None:
+        populations = []
 
     # Create the file name
     file_name = "percentage_eligible"
@@ -907,329 +1233,903 @@ def determine_eligibility(data_dir: str, povpip: int = 200, has_pap: int = 1, ha
             file_name += "_has_snap"
         add_col = True
 
-    # Determine if any covered populations are used
-    if (aian == 1 and asian == 1 and black == 1 and nhpi == 1 and white == 1 and hispanic == 1 and veteran == 1
-            and elderly == 1 and disability == 1 and eng_very_well == 1):
+    # Determine if all the covered populations are used
+    if len(populations) == len(covered_populations):
         file_name += "-covered_populations"
+    else:
+        for population_name, population_var in populations:
+            file_name += "_" + population_var
 
-        # Add the file name to the end file
-        if add_col:
-            file_name = test_data + file_name
+    # Add the file name to the end file
+    if add_col:
+        file_name = test_data + file_name
+
+    return file_name, add_col
+
+
+def baselineEligibility(data_dir: str, col_name: str, populations: list[tuple[str, str]], vintage: str = None,
+                        exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function gets the current eligibility of a geography, which every scenario is compared to. It is kept in
+    memory for the session, so a sweep only gets it once for every geography. It is the dataframe of the current
+    eligibility if it was determined in this session, else the file in the Current_Eligibility folder, in any output
+    format. If there is no file, it is computed from the household arrays, and kept for the exact_allocation it was
+    computed with, since the other mode crosswalks it to other totals.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param col_name: The code column of the geography
+    :param populations: The covered populations that are used, from selectedPopulations. If any are used, the current
+    eligibility with every covered population is used
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals, if the current
+    eligibility is computed 0|1
+    :return: The dataframe of the current eligibility, which must not be changed
+    """
+
+    current_data = pumsFolder(data_dir, vintage) + "Current_Eligibility/"
+
+    if populations:
+        file_stem = current_data + f"eligibility-by-covered_populations-{col_name}"
     else:
-        for population_name, population_var in covered_populations:
-            if locals()[population_var] == 1:
-                file_name += "_" + population_var
+        file_stem = current_data + f"eligibility-by-{col_name}"
 
-        # Add the file name to the end file
-        if add_col:
-            file_name = test_data + file_name
+    with _baselines_lock:
+        if file_stem in _baselines:
+            return _baselines[file_stem]
 
-    # If the geography is PUMA, then do not crosswalk the data
-    if code_column == "puma22":
-        # If we are looking at changes, add the current percentage eligible column
-        if add_col:
-            # Read the original file
-            if (aian == 1 or asian == 1 or black == 1 or nhpi == 1 or white == 1 or hispanic == 1 or veteran == 1 or
-                    elderly == 1 or disability == 1 or eng_very_well == 1):
-                original_file = current_data + "eligibility-by-covered_populations-puma22.csv"
+        try:
+            _baselines[file_stem] = readFrame(findOutputFile(file_stem), [col_name])
+            return _baselines[file_stem]
+        except FileNotFoundError:
+            pass
+
+        # Compute the current eligibility if it was never saved
+        computed_key = (file_stem, exact_allocation)
+        if computed_key not in _baselines:
+            baseline_populations = covered_populations if populations else []
+            puma_df = computePUMAEligibility(data_dir, 200, 1, 1, 1, 1, baseline_populations,
+                                             loadHouseholdArray(data_dir, vintage), vintage, exact_allocation)
+            if col_name == "puma22":
+                _baselines[computed_key] = puma_df.reset_index(drop=True)
             else:
-                original_file = current_data + "eligibility-by-puma22.csv"
-            original_df = pd.read_csv(original_file, header=0, dtype={"puma22": str})
+                crosswalk = getCrossWalk(data_dir, "puma22", col_name)
+                _baselines[computed_key] = crosswalkEligibility(puma_df, crosswalk.toSourceDict(), col_name,
+                                                                exact_allocation)
 
-            # Rename all the columns to have "Current" in front of them
-            original_df = original_df.rename(columns={"Num Eligible": "Current Num Eligible",
-                                                      "Num Ineligible": "Current Num Ineligible",
-                                                      "Percentage Eligible": "Current Percentage Eligible"})
+        return _baselines[computed_key]
 
-            # If covered populations are used, open that file and rename the columns
-            if "covered_populations" in original_file:
-                # Iterate through the covered populations
-                for population_name, population_var in covered_populations:
-                    if locals()[population_var] == 1:
-                        original_df = original_df.rename(
-                            columns={population_name + " Eligible": "Current " + population_name + " Eligible"})
-                    else:
-                        original_df = original_df.drop(columns=[population_name + " Eligible"])
 
-            # Round the percentage eligible column to two decimal places
-            main_df["Percentage Eligible"] = main_df["Percentage Eligible"].round(2)
-            original_df["Current Percentage Eligible"] = original_df["Current Percentage Eligible"].round(2)
+def addCurrentEligibility(new_df: pd.DataFrame, data_dir: str, col_name: str, populations: list[tuple[str, str]],
+                          vintage: str = None, exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function will add the current eligibility to the eligibility of a scenario. It gets the current eligibility
+    of the geography from baselineEligibility, adds its columns with "Current" in front of them by the code of the
+    geography, and replaces the covered population columns with the percentage difference from the current
+    eligibility.
+    :param new_df: The dataframe with the eligibility of the scenario
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param col_name: The code column of the geography
+    :param populations: The covered populations that are used, from selectedPopulations
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals, if the current
+    eligibility is computed 0|1
+    :return: The dataframe with the current eligibility columns
+    """
+
+    original_df = baselineEligibility(data_dir, col_name, populations, vintage, exact_allocation)
+
+    # Rename all the columns to have "Current" in front of them
+    original_df = original_df.rename(columns={"Num Eligible": "Current Num Eligible",
+                                              "Num Ineligible": "Current Num Ineligible",
+                                              "Percentage Eligible": "Current Percentage Eligible"})
+
+    # If covered populations are used, rename the columns of the populations and drop the others
+    if populations:
+        for population_name, population_var in covered_populations:
+            if (population_name, population_var) in populations:
+                original_df = original_df.rename(
+                    columns={population_name + " Eligible": "Current " + population_name + " Eligible"})
+            else:
+                original_df = original_df.drop(columns=[population_name + " Eligible"])
+
+    # Round the percentage eligible column to two decimal places
+    new_df["Percentage Eligible"] = new_df["Percentage Eligible"].round(2)
+    original_df["Current Percentage Eligible"] = original_df["Current Percentage Eligible"].round(2)
+
+    # Only keep the code, the Current columns, and the area columns the scenario does not have, such as rural. Other
+    # columns of the current eligibility, such as its standard errors, are not columns of the scenario
+    original_df = original_df[[column for column in original_df.columns
+                               if column == col_name or (column not in new_df.columns and
+                                                         (column.startswith("Current ") or column in area_columns))]]
+
+    # Add the current eligibility to every area by its code
+    new_df = pd.merge(new_df, original_df, on=col_name, how="left", validate="1:1")
+
+    # Calculate the difference between the two covered populations eligible columns
+    for population_name, population_var in populations:
+        # Calculate the difference between the two covered populations eligible columns
+        new_df["difference_" + population_var] = new_df[population_name + " Eligible"] - new_df[
+            "Current " + population_name + " Eligible"]
+
+        # Calculate the difference percentage
+        new_df["difference_percentage_" + population_var] = (new_df["difference_" + population_var] /
+                                                             new_df["Current " + population_name +
+                                                                    " Eligible"] * 100).round(2)
+        new_df = new_df.drop(
+            columns=["Current " + population_name + " Eligible", "difference_" + population_var])
+
+    # Move the current columns to the second, third and fourth positions
+    columns = new_df.columns.tolist()
+
+    for column in ["Current Percentage Eligible", "Current Num Ineligible", "Current Num Eligible"]:
+        columns.remove(column)
+        columns.insert(1, column)
+
+    # Reorder the columns
+    return new_df[columns]
+
+
+def crosswalkEligibility(puma_df: pd.DataFrame, crosswalk_dict: dict, col_name: str,
+                         exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function will crosswalk the eligibility of every PUMA to another geography with crosswalkPUMAData, and make
+    the percentage eligible column of the new geography.
+    :param puma_df: The dataframe from computePUMAEligibility. It is not changed
+    :param crosswalk_dict: The dictionary from the toSourceDict function of the crosswalk
+    :param col_name: The code column of the new geography
+    :param exact_allocation: Whether to use the largest remainder method of allocateTotals 0|1
+    :return: A dataframe with the code column, Num Eligible, Num Ineligible, covered population and Percentage
+    Eligible columns
+    """
+
+    # Drop the percentage eligible column
+    main_df = puma_df.drop(columns=["Percentage Eligible"])
+
+    # Crosswalk the data
+    with traceStage("crosswalk") as stage:
+        new_df = crosswalkPUMAData(main_df, crosswalk_dict, "puma22", col_name, exact_allocation)
+        stage.addRows(rows_in=len(main_df), rows_out=len(new_df))
+
+    # Make the percentage eligible column
+    new_df["Percentage Eligible"] = new_df["Num Eligible"] / (
+            new_df["Num Eligible"] + new_df["Num Ineligible"]) * 100
+
+    # Round the percentage eligible column to two decimal places
+    new_df["Percentage Eligible"] = new_df["Percentage Eligible"].round(2)
+
+    return new_df
+
+
+@lru_cache(maxsize=None)
+def geographyNames(crosswalk_file: str, code_column: str, name_column: str) -> pd.DataFrame:
+    """
+    This function reads the name of every code of a geography from its crosswalk file, such as the CountyName of every
+    county. The names are only read once per crosswalk file, and the dataframe must not be changed.
+    :param crosswalk_file: The path to the crosswalk file
+    :param code_column: The code column, which is written as five digits
+    :param name_column: The name column
+    :return: A dataframe with the code and name columns, with one row per code
+    """
+
+    # Read the crosswalk file
+    df = pd.read_csv(crosswalk_file, header=0, usecols=[code_column, name_column], dtype={code_column: str})
+
+    # Drop the duplicate rows
+    df = df.drop_duplicates(subset=[code_column])
+
+    df[code_column] = df[code_column].astype(str).str.zfill(5)
+
+    return df
+
+
+def formatGeographyEligibility(data_dir: str, new_df: pd.DataFrame, code_column: str, col_name: str, cw_file: str,
+                               add_col: bool, populations: list[tuple[str, str]], vintage: str = None,
+                               exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function will add the columns of the file of a geography to its eligibility: the current eligibility columns
+    if we are looking at changes, the rural and CountyName columns for counties, and the MetDivName column for
+    metropolitan divisions. The columns that new_df already has are kept.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param new_df: The eligibility of the geography, from crosswalkEligibility
+    :param code_column: The code column of the geography, from geographyColumn
+    :param col_name: The code column of the crosswalk of the geography
+    :param cw_file: The path to the crosswalk file, for the names of the areas
+    :param add_col: Whether to add the current eligibility columns, from eligibilityFileName
+    :param populations: The covered populations that are used, from selectedPopulations
+    :param vintage: The name of the PUMS vintage, from vintageName, for the current eligibility
+    :param exact_allocation: Whether to use the largest remainder method of allocateTotals 0|1
+    :return: The dataframe, as it is saved
+    """
+
+    # If we are looking at changes, add the current percentage eligible column
+    if add_col:
+        new_df = addCurrentEligibility(new_df, data_dir, col_name, populations, vintage, exact_allocation)
+
+    # If the code column is county, then add the rural column and county name column
+    if code_column == "county":
+        if "rural" not in new_df.columns.tolist():
+            # Download the covered population file
+            covered_pops_df = downloadCoveredPopFile()
+
+            # Rename the columns
+            covered_pops_df = covered_pops_df.rename(columns={"geo_id": "county"})
+
+            # Turn the county column into a string and zero fill it
+            covered_pops_df["county"] = covered_pops_df["county"].astype(str)
+            covered_pops_df["county"] = covered_pops_df["county"].str.zfill(5)
+
+            new_df["county"] = new_df["county"].astype(str)
+            new_df["county"] = new_df["county"].str.zfill(5)
+
+            # Only keep county and rural columns
+            covered_pops_df = covered_pops_df[["county", "rural"]]
+
+            # Merge the dataframes
+            new_df = pd.merge(new_df, covered_pops_df, on="county", how="left")
+
+        # Move the rural column to the second position
+        columns = new_df.columns.tolist()
+
+        # Move the rural column to the second position
+        columns.remove("rural")
+
+        # Add the rural column to the second position
+        columns.insert(1, "rural")
+
+        # Reorder the columns
+        new_df = new_df[columns]
+        if "CountyName" not in new_df.columns.tolist():
+            # Read the names from the crosswalk file
+            df = geographyNames(cw_file, "county", "CountyName")
+
+            new_df["county"] = new_df["county"].astype(str)
+            new_df["county"] = new_df["county"].str.zfill(5)
+
+            # Add the "CountyName" column to the new dataframe
+            new_df = pd.merge(new_df, df[["county", "CountyName"]], on="county", how="left")
+
+        # Move the CountyName column to the second position
+        columns = new_df.columns.tolist()
 
-            # Reset the index
-            original_df.reset_index(inplace=True)
-            main_df.reset_index(inplace=True)
-            original_df.drop(columns=["index"], inplace=True)
-            main_df.drop(columns=["index"], inplace=True)
+        # Remove the CountyName column
+        columns.remove("CountyName")
 
-            # Add the current percentage eligible column to the main dataframe
-            main_df = pd.concat([main_df, original_df], axis=1, join="outer", ignore_index=False, sort=True)
+        # Add the CountyName column to the second position
+        columns.insert(1, "CountyName")
 
-            # Calculate the difference between the two covered populations eligible columns
-            for population_name, population_var in covered_populations:
-                if locals()[population_var] == 1:
-                    main_df["difference_" + population_var] = main_df[population_name + " Eligible"] - main_df[
-                        "Current " + population_name + " Eligible"]
-                    main_df["difference_percentage_" + population_var] = ((main_df["difference_" + population_var] /
-                                                                           main_df["Current " + population_name +
-                                                                                   " Eligible"]) * 100).round(2)
-                    # Drop the columns that are no longer needed
-                    main_df = main_df.drop(
-                        columns=["Current " + population_name + " Eligible", "difference_" + population_var])
+        # Reorder the columns
+        new_df = new_df[columns]
 
-            # Combine duplicate columns
-            main_df = main_df.loc[:, ~main_df.columns.duplicated()]
+    # If the code column is metdiv, then add the metdiv name column
+    if code_column == "metdiv20":
+        if "MetDivName" not in new_df.columns.tolist():
+            # Read the names from the crosswalk file
+            df = geographyNames(cw_file, "metdiv20", "MetDivName")
 
-            # Move the current percentage eligible column to the second position
-            columns = main_df.columns.tolist()
+            new_df["metdiv20"] = new_df["metdiv20"].astype(str)
+            new_df["metdiv20"] = new_df["metdiv20"].str.zfill(5)
 
-            # Remove the current percentage eligible column
-            columns.remove("Current Percentage Eligible")
+            # Add the "MetDivName" column to the new dataframe
+            new_df = pd.merge(new_df, df[["metdiv20", "MetDivName"]], on="metdiv20", how="left")
 
-            # Add the current percentage eligible column to the second position
-            columns.insert(1, "Current Percentage Eligible")
+        # Move the MetDivName column to the second position
+        columns = new_df.columns.tolist()
 
-            # Remove the current percentage eligible column
-            columns.remove("Current Num Ineligible")
+        # Remove the MetDivName column
+        columns.remove("MetDivName")
 
-            # Add the current percentage eligible column to the second position
-            columns.insert(1, "Current Num Ineligible")
+        # Add the MetDivName column to the second position
+        columns.insert(1, "MetDivName")
 
-            # Remove the current percentage eligible column
-            columns.remove("Current Num Eligible")
+        # Reorder the columns
+        new_df = new_df[columns]
 
-            # Add the current percentage eligible column to the second position
-            columns.insert(1, "Current Num Eligible")
+    # Fill the null values with 0
+    return new_df.fillna(0)
 
-            # Reorder the columns
-            main_df = main_df[columns]
 
-        # Save the data
-        file_name += "-puma22.csv"
+def writeGeographyEligibility(data_dir: str, puma_df: pd.DataFrame, geography: str, file_name: str, add_col: bool,
+                              populations: list[tuple[str, str]],
+                              replicates: tuple[np.ndarray, list[str], np.ndarray] = None, vintage: str = None,
+                              exact_allocation: int = 0, writer: OutputWriter = None,
+                              output_format: str = "csv") -> str:
+    """
+    This function will crosswalk the eligibility of every PUMA to a geography and save it to a csv file. If the
+    geography is PUMA, the data is saved as it is. For counties, the rural and CountyName columns are added, and for
+    metropolitan divisions, the MetDivName column is added.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param puma_df: The dataframe from computePUMAEligibility. It is not changed
+    :param geography: The geography to aggregate the data by
+    :param file_name: The path to the file without the geography, from eligibilityFileName
+    :param add_col: Whether to add the current eligibility columns, from eligibilityFileName
+    :param populations: The covered populations that are used, from selectedPopulations
+    :param replicates: The totals from computePUMAReplicates. If they are given, the standard errors are added
+    :param vintage: The name of the PUMS vintage, from vintageName, for the current eligibility
+    :param exact_allocation: Whether to use the largest remainder method of allocateTotals 0|1
+    :param writer: The OutputWriter to save the file with in the background. If None, the file is saved before this
+    function returns
+    :param output_format: The format of the file, one of output_formats, such as "csv.zst" or "parquet"
+    :return: The path to the file
+    """
 
-        # Fill the null values with 0
-        main_df = main_df.fillna(0)
+    # Get the code column of the geography
+    code_column = geographyColumn(geography)
 
-        # Save the dataframe to a csv file
-        main_df.to_csv(file_name, index=False)
+    # If the geography is PUMA, then do not crosswalk the data
+    if code_column == "puma22":
+        col_name = "puma22"
+        cw_file = None
+        new_df = puma_df.copy()
 
     # Else, crosswalk the data
     else:
-        # Drop the percentage eligible column
-        main_df = main_df.drop(columns=["Percentage Eligible"])
+        # Get the crosswalk file from the registry
+        crosswalk = getCrossWalk(data_dir, "puma22", code_column)
+        cw_file = crosswalk.file_path
+        col_name = crosswalk.target_col
+
+        new_df = crosswalkEligibility(puma_df, crosswalk.toSourceDict(), col_name, exact_allocation)
+
+    # Add the standard errors of the totals
+    if replicates is not None:
+        codes, measures, totals = replicates
+        if code_column != "puma22":
+            codes, totals = crosswalkReplicates(codes, totals, crosswalk)
+        new_df = pd.merge(new_df, replicateStandardErrors(codes, measures, totals, col_name), on=col_name, how="left")
+
+    # Add the geography and the extension to the file name
+    file_stem = file_name + f"-{col_name}"
+    file_name = outputFile(file_stem, output_format)
+
+    new_df = formatGeographyEligibility(data_dir, new_df, code_column, col_name, cw_file, add_col, populations,
+                                        vintage, exact_allocation)
+
+    # Keep the current eligibility in memory for the scenarios that are compared to it
+    if not add_col:
+        with _baselines_lock:
+            _baselines[file_stem] = new_df
+
+    # Save the dataframe to a csv file, in the background if there is a writer
+    if writer is not None:
+        writer.submit(new_df, file_name)
+    else:
+        writeFrame(new_df, file_name)
 
-        # Read the crosswalk file
-        dc, col_name = code_to_source_dict(cw_file, "puma")
+    return file_name
 
-        # Add the geography to the file name
-        file_name += f"-{col_name}.csv"
 
-        # Crosswalk the data
-        new_df = crosswalkPUMAData(main_df, dc, "puma22", col_name)
+def crosswalkAreas(puma_df: pd.DataFrame, crosswalk: CrossWalk, targets: list[str],
+                   exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function will crosswalk the eligibility of the PUMAs to some areas of a geography. The PUMAs that contribute
+    to the areas are found with the reverse index of the crosswalk, and every one of them is crosswalked with all of
+    its rows, so every PUMA is allocated in the same way as for every area, and the areas get the same numbers as in
+    the file of every area.
+    :param puma_df: The dataframe from computePUMAEligibility, with at least the PUMAs that contribute to the areas
+    :param crosswalk: The crosswalk from puma22 to the geography, from getCrossWalk
+    :param targets: The codes of the areas, as they are written in the code column of the geography
+    :param exact_allocation: Whether to use the largest remainder method of allocateTotals 0|1
+    :return: A dataframe with the code column, Num Eligible, Num Ineligible, covered population and Percentage
+    Eligible columns, with one row for every area that gets data
+    """
 
-        # Make the percentage eligible column
-        new_df["Percentage Eligible"] = new_df["Num Eligible"] / (
-                new_df["Num Eligible"] + new_df["Num Ineligible"]) * 100
+    col_name = crosswalk.target_col
+    targets = [str(target) for target in targets]
 
-        # Round the percentage eligible column to two decimal places
-        new_df["Percentage Eligible"] = new_df["Percentage Eligible"].round(2)
+    # The PUMAs of the sources of the areas, written as seven digits
+    sources = crosswalk.sourcesOf(targets)
+    pumas = {code.split(".")[0].zfill(7) for code in np.asarray(sources).astype(str).tolist()}
 
-        # If we are looking at changes, add the current percentage eligible column
-        if add_col:
-            # Read the original file
-            if (aian == 1 or asian == 1 or black == 1 or nhpi == 1 or white == 1 or hispanic == 1 or veteran == 1 or
-                    elderly == 1 or disability == 1):
-                original_file = current_data + f"eligibility-by-covered_populations-{col_name}.csv"
-            else:
-                original_file = current_data + f"eligibility-by-{col_name}.csv"
-            original_df = pd.read_csv(original_file, header=0)
+    puma_df = puma_df[puma_df["puma22"].isin(pumas)]
+    crosswalk_dict = crosswalk.toSourceDict(crosswalk.targetsOf(sources))
+    new_df = crosswalkEligibility(puma_df, crosswalk_dict, col_name, exact_allocation)
+
+    return new_df[new_df[col_name].astype(str).isin(targets)].reset_index(drop=True)
+
+
+@tracedStage("determine_eligibility")
+def areaEligibility(data_dir: str, geography: str = "State", states: list[str] = None, area_ids: list[str] = None,
+                    povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1, has_snap: int = 1,
+                    population_names: list[str] = None, households: HouseholdArray = None, vintage: str = None,
+                    exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function will determine the eligibility of some areas of a geography, such as one congressional district or
+    the counties of two states. The areas are found with the reverse index of the crosswalk, and only the households of
+    the PUMAs that contribute to them are read from the household arrays. Every PUMA of those households is
+    crosswalked with all of its rows, so the areas get the same numbers as in the file of determine_eligibility.
+    Example:
+        areaEligibility(data_dir, "County", states=["06"])
+        areaEligibility(data_dir, "118th Congress (2023-2024)", area_ids=["0612"], povpip=135)
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param geography: The geography to aggregate the data by
+    :param states: The FIPS codes of the states, such as "06". Every area that gets data from a PUMA of the states is
+    kept, so an area that crosses a state line is kept whole
+    :param area_ids: The codes of the areas, as they are written in the code column of the geography
+    :param povpip: The desired income threshold
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param population_names: The covered populations to add, such as ["aian", "veteran"]
+    :param households: The household arrays from loadHouseholdArray. If None, they are loaded
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals 0|1
+    :return: A dataframe with the code column, Num Eligible, Num Ineligible, covered population and Percentage
+    Eligible columns, with one row for every area
+    """
+
+    if households is None:
+        households = loadHouseholdArray(data_dir, vintage)
+
+    populations = selectedPopulations({population_var: 1 for population_var in population_names or []})
+
+    # States are written as two digits, and PUMAs as seven digits
+    if states is not None:
+        states = [str(state).zfill(2) for state in states]
+
+    col_name = geographyColumn(geography)
+
+    # For PUMAs, the areas are the PUMAs of the states and the PUMAs that are given
+    if col_name == "puma22":
+        pumas = None
+        if area_ids is not None:
+            pumas = [str(area_id).split(".")[0].zfill(7) for area_id in area_ids]
+        household_states = states
+
+    # Else, find the areas and the PUMAs that contribute to them in the crosswalk
+    else:
+        crosswalk = getCrossWalk(data_dir, "puma22", col_name)
+        col_name = crosswalk.target_col
+
+        # The PUMA of every source code, written as seven digits
+        source_codes = np.asarray(crosswalk.source_codes).astype(str)
+        source_pumas = dict(zip(source_codes.tolist(), [code.split(".")[0].zfill(7) for code in source_codes.tolist()]))
+
+        targets = []
+        if area_ids is not None:
+            targets += [str(area_id) for area_id in area_ids]
+        if states is not None:
+            targets += crosswalk.targetsOf([code for code, puma in source_pumas.items() if puma[:2] in states]).tolist()
+
+        sources = crosswalk.sourcesOf(targets).tolist()
+        pumas = sorted(source_pumas[code] for code in sources)
+        household_states = None
+
+    # Only read the households of the PUMAs
+    positions = households.pumaPositions(pumas, household_states)
+    puma_df = computePUMAEligibility(data_dir, povpip, has_pap, has_ssip, has_hins4, has_snap, populations,
+                                     households=households.subset(households.pumaRows(positions)), vintage=vintage,
+                                     exact_allocation=exact_allocation)
+
+    if col_name == "puma22":
+        keep = np.zeros(len(puma_df), dtype=bool)
+        if pumas is not None:
+            keep |= puma_df["puma22"].isin(pumas).to_numpy()
+        if states is not None:
+            keep |= puma_df["puma22"].str[:2].isin(states).to_numpy()
+
+        return puma_df[keep].reset_index(drop=True)
+
+    return crosswalkAreas(puma_df, crosswalk, targets, exact_allocation)
+
+
+def determine_eligibility(data_dir: str, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
+                          has_snap: int = 1, geography: str = "Public-use microdata area (PUMA)",
+                          aian: int = 0, asian: int = 0, black: int = 0, nhpi: int = 0, white: int = 0,
+                          hispanic: int = 0, veteran: int = 0, elderly: int = 0, disability: int = 0,
+                          eng_very_well: int = 0, end_folder: str = "Change_Eligibility/", standard_errors: int = 0,
+                          exact_allocation: int = 0, states: list[str] = None, area_ids: list[str] = None,
+                          writer: OutputWriter = None, output_format: str = "csv", save_aggregates: int = 0):
+    """
+    This function will determine eligibility for ACP for all states. It does so by iterating through all the states and
+    reading the eligibility data for each state. It will then aggregate the data by the geography specified. It will
+    then save the data to a csv file in the state folder.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param povpip: The desired income threshold
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param geography: The geography to aggregate the data by
+    :param aian: Whether we want to see the effects to the American Indian and Alaska Native population 0|1
+    :param asian: Whether we want to see the effects to the Asian population 0|1
+    :param black: Whether we want to see the effects to the Black or African American population 0|1
+    :param nhpi: Whether we want to see the effects to the Native Hawaiian population 0|1
+    :param white: Whether we want to see the effects to the White population 0|1
+    :param hispanic: Whether we want to see the effects to the Hispanic or Latino population 0|1
+    :param veteran: Whether we want to see the effects to the Veteran population 0|1
+    :param elderly: Whether we want to see the effects to the Elderly population 0|1
+    :param disability: Whether we want to see the effects to the Disability population 0|1
+    :param eng_very_well: Whether we want to see the effects to the population that speaks English very well 0|1
+    :param end_folder: The folder to save the data to
+    :param standard_errors: Whether to add the replicate weight standard error of every total 0|1
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals, so the totals
+    of every geography add up to the totals of the PUMAs 0|1
+    :param states: Only determine the eligibility of the areas of these states, with areaEligibility
+    :param area_ids: Only determine the eligibility of these areas, with areaEligibility
+    :param writer: The OutputWriter to save the file with in the background. If None, the file is saved before this
+    function returns
+    :param output_format: The format of the file, one of output_formats, such as "csv.zst" or "parquet"
+    :param save_aggregates: Whether to save the eligibility of the PUMAs of every state with savePumaAggregates, so
+    the file can be updated with updateStateEligibility 0|1
+    :return: None, but saves the data to csv files. If states or area_ids are given, the dataframe of areaEligibility
+    is returned instead, so a file of every area is never replaced by some of the areas
+    """
 
-            # Rename all the columns to have "Current" in front of them
-            original_df = original_df.rename(columns={"Num Eligible": "Current Num Eligible",
-                                                      "Num Ineligible": "Current Num Ineligible",
-                                                      "Percentage Eligible": "Current Percentage Eligible"})
+    population_flags = dict(aian=aian, asian=asian, black=black, nhpi=nhpi, white=white, hispanic=hispanic,
+                            veteran=veteran, elderly=elderly, disability=disability, eng_very_well=eng_very_well)
+    populations = selectedPopulations(population_flags)
+
+    if states is not None or area_ids is not None:
+        return areaEligibility(data_dir, geography, states, area_ids, povpip, has_pap, has_ssip, has_hins4, has_snap,
+                               [population_var for population_var, flag in population_flags.items() if flag == 1],
+                               exact_allocation=exact_allocation)
+
+    main_df = computePUMAEligibility(data_dir, povpip, has_pap, has_ssip, has_hins4, has_snap, populations,
+                                     exact_allocation=exact_allocation)
+
+    replicates = None
+    if standard_errors == 1:
+        replicates = computePUMAReplicates(data_dir, povpip, has_pap, has_ssip, has_hins4, has_snap, populations)
+
+    file_name, add_col = eligibilityFileName(data_dir, povpip, has_pap, has_ssip, has_hins4, has_snap, populations,
+                                             end_folder)
+
+    # Save the eligibility of the PUMAs of every state, so a state can be updated with updateStateEligibility
+    if save_aggregates == 1:
+        scenario = dict(povpip=povpip, has_pap=has_pap, has_ssip=has_ssip, has_hins4=has_hins4, has_snap=has_snap,
+                        populations=[population_var for _, population_var in populations],
+                        exact_allocation=exact_allocation, add_col=add_col)
+        savePumaAggregates(data_dir, main_df, file_name, scenario)
+
+    writeGeographyEligibility(data_dir, main_df, geography, file_name, add_col, populations, replicates,
+                              exact_allocation=exact_allocation, writer=writer, output_format=output_format)
+
+
+@tracedStage("everyGeographyEligibility")
+def everyGeographyEligibility(data_dir: str, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1,
+                              has_hins4: int = 1, has_snap: int = 1, geographies: list[str] = None,
+                              aian: int = 0, asian: int = 0, black: int = 0, nhpi: int = 0, white: int = 0,
+                              hispanic: int = 0, veteran: int = 0, elderly: int = 0, disability: int = 0,
+                              eng_very_well: int = 0, end_folder: str = "Change_Eligibility/",
+                              max_workers: int = 6, households: HouseholdArray = None,
+                              standard_errors: int = 0, vintage: str = None,
+                              exact_allocation: int = 0, writer: OutputWriter = None,
+                              output_format: str = "csv", save_aggregates: int = 0) -> dict[str, str]:
+    """
+    This function will determine eligibility for ACP for several geographies at once. It gives the same files as
+    calling determine_eligibility for every geography, but the eligibility of every PUMA is only computed once, and
+    the crosswalks to the geographies and the writes run at the same time.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param povpip: The desired income threshold
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param geographies: The geographies to aggregate the data by. By default, every geography in all_geographies
+    :param aian: Whether we want to see the effects to the American Indian and Alaska Native population 0|1
+    :param asian: Whether we want to see the effects to the Asian population 0|1
+    :param black: Whether we want to see the effects to the Black or African American population 0|1
+    :param nhpi: Whether we want to see the effects to the Native Hawaiian population 0|1
+    :param white: Whether we want to see the effects to the White population 0|1
+    :param hispanic: Whether we want to see the effects to the Hispanic or Latino population 0|1
+    :param veteran: Whether we want to see the effects to the Veteran population 0|1
+    :param elderly: Whether we want to see the effects to the Elderly population 0|1
+    :param disability: Whether we want to see the effects to the Disability population 0|1
+    :param eng_very_well: Whether we want to see the effects to the population that speaks English very well 0|1
+    :param end_folder: The folder to save the data to
+    :param max_workers: The number of geographies that are crosswalked and written at the same time
+    :param households: The household arrays from loadHouseholdArray. If they are given, the state files are not read
+    :param standard_errors: Whether to add the replicate weight standard error of every total 0|1
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals, so the totals
+    of every geography add up to the totals of the PUMAs 0|1
+    :param writer: The OutputWriter to save the files with in the background, so the next scenario can start before
+    they are written. If None, the files are saved before this function returns
+    :param output_format: The format of the files, one of output_formats, such as "csv.zst" or "parquet"
+    :param save_aggregates: Whether to save the eligibility of the PUMAs of every state with savePumaAggregates, so
+    the files can be updated with updateStateEligibility 0|1
+    :return: A dictionary with the geographies as keys and the paths to their files as values
+    """
 
+    if geographies is None:
+        geographies = all_geographies
 
-            # If covered populations are used, open that file and rename the columns
-            if "covered_populations" in original_file:
-                # Iterate through the covered populations
-                for population_name, population_var in covered_populations:
-                    if locals()[population_var] == 1:
-                        original_df = original_df.rename(
-                            columns={population_name + " Eligible": "Current " + population_name + " Eligible"})
-                    else:
-                        original_df = original_df.drop(columns=[population_name + " Eligible"])
+    populations = selectedPopulations(dict(aian=aian, asian=asian, black=black, nhpi=nhpi, white=white,
+                                           hispanic=hispanic, veteran=veteran, elderly=elderly, disability=disability,
+                                           eng_very_well=eng_very_well))
 
+    # Compute the eligibility of every PUMA once
+    main_df = computePUMAEligibility(data_dir, povpip, has_pap, has_ssip, has_hins4, has_snap, populations,
+                                     households, vintage, exact_allocation)
 
-            # Round the percentage eligible column to two decimal places
-            new_df["Percentage Eligible"] = new_df["Percentage Eligible"].round(2)
-            original_df["Current Percentage Eligible"] = original_df["Current Percentage Eligible"].round(2)
+    replicates = None
+    if standard_errors == 1:
+        replicates = computePUMAReplicates(data_dir, povpip, has_pap, has_ssip, has_hins4, has_snap, populations,
+                                           vintage)
 
-            # Reset the index
-            original_df.reset_index(inplace=True)
-            new_df.reset_index(inplace=True)
-            original_df.drop(columns=["index"], inplace=True)
-            new_df.drop(columns=["index"], inplace=True)
+    file_name, add_col = eligibilityFileName(data_dir, povpip, has_pap, has_ssip, has_hins4, has_snap, populations,
+                                             end_folder, vintage)
 
-            # Add the current percentage eligible column to the main dataframe
-            new_df = pd.concat([new_df, original_df], axis=1, join="outer", ignore_index=False, sort=True)
+    # Save the eligibility of the PUMAs of every state, so a state can be updated with updateStateEligibility
+    if save_aggregates == 1:
+        scenario = dict(povpip=povpip, has_pap=has_pap, has_ssip=has_ssip, has_hins4=has_hins4, has_snap=has_snap,
+                        populations=[population_var for _, population_var in populations],
+                        exact_allocation=exact_allocation, add_col=add_col)
+        savePumaAggregates(data_dir, main_df, file_name, scenario, vintage)
 
-            # Calculate the difference between the two covered populations eligible columns
-            for population_name, population_var in covered_populations:
-                # If the population is used, then calculate the difference
-                if locals()[population_var] == 1:
-                    # Calculate the difference between the two covered populations eligible columns
-                    new_df["difference_" + population_var] = new_df[population_name + " Eligible"] - new_df[
-                        "Current " + population_name + " Eligible"]
+    # Crosswalk and write every geography at the same time
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {geography: submitTraced(executor, writeGeographyEligibility, data_dir, main_df, geography,
+                                           file_name, add_col, populations, replicates, vintage, exact_allocation,
+                                           writer, output_format)
+                   for geography in geographies}
 
-                    # Calculate the difference percentage
-                    new_df["difference_percentage_" + population_var] = (new_df["difference_" + population_var] /
-                                                                         new_df["Current " + population_name +
-                                                                                " Eligible"] * 100).round(2)
-                    new_df = new_df.drop(
-                        columns=["Current " + population_name + " Eligible", "difference_" + population_var])
+        return {geography: future.result() for geography, future in futures.items()}
 
-            # Combine duplicate columns
-            new_df = new_df.loc[:, ~new_df.columns.duplicated()]
 
-            # Move the current percentage eligible column to the second position
-            columns = new_df.columns.tolist()
+def pumaAggregatesFolder(data_dir: str, file_name: str, vintage: str = None) -> str:
+    """
+    This function gets the folder the eligibility of every PUMA of a scenario is saved to, with one file per state.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param file_name: The path to the file of the scenario without the geography, from eligibilityFileName
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the ACS_PUMS folder is used
+    :return: The path to the folder, ending with a slash
+    """
 
-            # Remove the current percentage eligible column
-            columns.remove("Current Percentage Eligible")
+    pums_folder = pumsFolder(data_dir, vintage)
+    scenario = os.path.relpath(file_name, pums_folder).replace(os.sep, "-")
 
-            # Add the current percentage eligible column to the second position
-            columns.insert(1, "Current Percentage Eligible")
+    return pums_folder + puma_aggregates_folder_name + "/" + scenario + "/"
 
-            # Remove the current percentage eligible column
-            columns.remove("Current Num Ineligible")
 
-            # Add the current percentage eligible column to the second position
-            columns.insert(1, "Current Num Ineligible")
+def savePumaAggregates(data_dir: str, puma_df: pd.DataFrame, file_name: str, scenario: dict,
+                       vintage: str = None) -> str:
+    """
+    This function will save the eligibility of every PUMA of a scenario, with one file for the PUMAs of every state,
+    and the state files it was computed from. When the PUMS files of a state are published again, only the PUMAs of
+    that state are computed again by updateStateEligibility.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param puma_df: The dataframe from computePUMAEligibility
+    :param file_name: The path to the file of the scenario without the geography, from eligibilityFileName
+    :param scenario: The povpip, has_pap, has_ssip, has_hins4, has_snap, populations (the parameters of the covered
+    populations, such as "aian"), exact_allocation and add_col of the scenario
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the ACS_PUMS folder is used
+    :return: The path to the folder
+    """
 
-            # Remove the current percentage eligible column
-            columns.remove("Current Num Eligible")
+    folder = pumaAggregatesFolder(data_dir, file_name, vintage)
+    os.makedirs(folder, exist_ok=True)
 
-            # Add the current percentage eligible column to the second position
-            columns.insert(1, "Current Num Eligible")
+    # The first two digits of a PUMA code are the FIPS code of its state
+    for state_code, state_df in puma_df.groupby(puma_df["puma22"].str[:2]):
+        writeFrame(state_df, folder + state_code + ".csv")
 
-            # Reorder the columns
-            new_df = new_df[columns]
+    # Save the scenario and the state files, written last so that it marks a finished save
+    meta = {"file_name": os.path.relpath(file_name, pumsFolder(data_dir, vintage)), "scenario": scenario,
+            "state_files": stateFileStamps(data_dir, vintage)}
+    with open(folder + "meta.json.part", "w") as file:
+        json.dump(meta, file)
+    os.replace(folder + "meta.json.part", folder + "meta.json")
 
-        # If the code column is county, then add the rural column and county name column
-        if code_column == "county":
-            if "rural" not in new_df.columns.tolist():
-                # Download the covered population file
-                covered_pops_df = downloadCoveredPopFile()
+    return folder
 
-                # Rename the columns
-                covered_pops_df = covered_pops_df.rename(columns={"geo_id": "county"})
 
-                # Turn the county column into a string and zero fill it
-                covered_pops_df["county"] = covered_pops_df["county"].astype(str)
-                covered_pops_df["county"] = covered_pops_df["county"].str.zfill(5)
+def loadPumaAggregates(folder: str) -> tuple[pd.DataFrame, dict]:
+    """
+    This function will read the eligibility of every PUMA of a scenario, saved by savePumaAggregates.
+    :param folder: The folder of the scenario, from pumaAggregatesFolder
+    :return: The dataframe, in the same form as computePUMAEligibility gives it, and the meta of the scenario
+    """
 
-                new_df["county"] = new_df["county"].astype(str)
-                new_df["county"] = new_df["county"].str.zfill(5)
+    with open(folder + "meta.json") as file:
+        meta = json.load(file)
 
-                # Only keep county and rural columns
-                covered_pops_df = covered_pops_df[["county", "rural"]]
+    puma_df = pd.concat([readFrame(folder + file, ["puma22"]) for file in sorted(os.listdir(folder))
+                         if file.endswith(".csv")], ignore_index=True)
 
-                # Merge the dataframes
-                new_df = pd.merge(new_df, covered_pops_df, on="county", how="left")
+    return puma_df.sort_values(by=["puma22"]).reset_index(drop=True), meta
 
-            # Move the rural column to the second position
-            columns = new_df.columns.tolist()
 
-            # Move the rural column to the second position
-            columns.remove("rural")
+def changedStates(data_dir: str, meta: dict, vintage: str = None) -> list[str]:
+    """
+    This function finds the states whose eligibility file changed since the eligibility of the PUMAs of a scenario was
+    saved, such as a state whose PUMS files were published again and given to everyStateEligibility.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param meta: The meta of the scenario, from loadPumaAggregates
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the ACS_PUMS folder is used
+    :return: The folders of the states in the state_data folder, such as "al"
+    """
 
-            # Add the rural column to the second position
-            columns.insert(1, "rural")
+    return [state for state, stamps in stateFileStamps(data_dir, vintage).items()
+            if meta["state_files"].get(state) != stamps]
 
-            # Reorder the columns
-            new_df = new_df[columns]
-            if "CountyName" not in new_df.columns.tolist():
-                # Read the crosswalk file
-                df = pd.read_csv(cw_file, header=0, dtype={"county": str})
 
-                # Drop the duplicate county rows
-                df = df.drop_duplicates(subset=["county"])
+def patchGeographyEligibility(data_dir: str, puma_df: pd.DataFrame, state_codes: list[str], geography: str,
+                              file_name: str, add_col: bool, populations: list[tuple[str, str]], vintage: str = None,
+                              exact_allocation: int = 0) -> tuple[str, pd.DataFrame] | None:
+    """
+    This function will update the file of a geography after the PUMAs of some states changed. The areas that get data
+    from a PUMA of the states are found with the reverse index of the crosswalk, and only they are crosswalked again
+    with crosswalkAreas, from every PUMA that contributes to them, so an area that crosses a state line, such as a
+    metropolitan division, gets the same numbers as the file of every area. The other rows of the file are kept. The
+    file is not written, so updateStateEligibility only writes the files of a scenario once all of them are updated.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param puma_df: The eligibility of every PUMA, with the PUMAs of the states computed again
+    :param state_codes: The FIPS codes of the states, written as two digits
+    :param geography: The geography of the file
+    :param file_name: The path to the file without the geography, from eligibilityFileName
+    :param add_col: Whether the file has the current eligibility columns, from eligibilityFileName
+    :param populations: The covered populations that are used, from selectedPopulations
+    :param vintage: The name of the PUMS vintage, from vintageName, for the current eligibility
+    :param exact_allocation: Whether to use the largest remainder method of allocateTotals 0|1
+    :return: The path to the file and the updated dataframe, or None if the scenario was never saved for the geography
+    or there is no crosswalk to the geography
+    """
 
-                df["county"] = df["county"].astype(str)
-                df["county"] = df["county"].str.zfill(5)
+    code_column = geographyColumn(geography)
 
-                new_df["county"] = new_df["county"].astype(str)
-                new_df["county"] = new_df["county"].str.zfill(5)
+    # The files are named by the code column of the geography, such as -metdiv20
+    try:
+        output_file = findOutputFile(file_name + f"-{code_column}")
+    except FileNotFoundError:
+        return None
 
-                # Add the "CountyName" column to the new dataframe
-                new_df = pd.merge(new_df, df[["county", "CountyName"]], on="county", how="left")
+    if code_column == "puma22":
+        crosswalk = None
+        col_name = "puma22"
+        cw_file = None
+    else:
+        try:
+            crosswalk = getCrossWalk(data_dir, "puma22", code_column)
+        except FileNotFoundError:
+            return None
+        col_name = crosswalk.target_col
+        cw_file = crosswalk.file_path
+
+    old_df = readFrame(output_file, [col_name])
+
+    # The standard errors need the replicate weights of every household, so they cannot be updated by area
+    if any(column.endswith(" SE") for column in old_df.columns):
+        raise ValueError(f"{output_file} has standard errors, determine the eligibility of every state again")
+
+    # The areas that get data from a PUMA of the states
+    if crosswalk is None:
+        targets = sorted(set(old_df.loc[old_df["puma22"].str[:2].isin(state_codes), "puma22"]) |
+                         set(puma_df.loc[puma_df["puma22"].str[:2].isin(state_codes), "puma22"]))
+        new_df = puma_df[puma_df["puma22"].isin(targets)].reset_index(drop=True)
+    else:
+        source_codes = np.asarray(crosswalk.source_codes).astype(str).tolist()
+        state_sources = [code for code in source_codes if code.split(".")[0].zfill(7)[:2] in state_codes]
+        targets = np.asarray(crosswalk.targetsOf(state_sources)).astype(str).tolist()
+        new_df = crosswalkAreas(puma_df, crosswalk, targets, exact_allocation)
 
-            # Move the CountyName column to the second position
-            columns = new_df.columns.tolist()
+    # Keep the columns that do not depend on the households, such as rural and CountyName, from the file
+    old_area_columns = [column for column in area_columns if column in old_df.columns]
+    if old_area_columns and new_df[col_name].isin(old_df[col_name]).all():
+        new_df = pd.merge(new_df, old_df[[col_name] + old_area_columns], on=col_name, how="left")
 
-            # Remove the CountyName column
-            columns.remove("CountyName")
+    new_df = formatGeographyEligibility(data_dir, new_df, code_column, col_name, cw_file, add_col, populations,
+                                        vintage, exact_allocation)
 
-            # Add the CountyName column to the second position
-            columns.insert(1, "CountyName")
+    if set(new_df.columns) != set(old_df.columns):
+        raise ValueError(f"{output_file} does not have the columns of the scenario, determine its eligibility again")
 
-            # Reorder the columns
-            new_df = new_df[columns]
+    # Replace the rows of the areas, in the order of the codes like the file of every area
+    patched_df = pd.concat([old_df[~old_df[col_name].isin(targets)], new_df[old_df.columns]], ignore_index=True)
+    patched_df = patched_df.sort_values(by=[col_name], kind="stable").reset_index(drop=True)
 
-        # If the code column is metdiv, then add the metdiv name column
-        if code_column == "metdiv20":
-            if "MetDivName" not in new_df.columns.tolist():
-                # Read the crosswalk file
-                df = pd.read_csv(cw_file, header=0, dtype={"metdiv20": str})
+    return output_file, patched_df
 
-                # Drop the duplicate metdiv rows
-                df = df.drop_duplicates(subset=["metdiv20"])
 
-                df["metdiv20"] = df["metdiv20"].astype(str)
-                df["metdiv20"] = df["metdiv20"].str.zfill(5)
+@tracedStage("updateStateEligibility")
+def updateStateEligibility(data_dir: str, states: list[str] = None, geographies: list[str] = None,
+                           vintage: str = None) -> dict[str, list[str]]:
+    """
+    This function will update every scenario that was saved after the PUMS files of some states were published again,
+    without computing the other states. For every scenario saved by savePumaAggregates, the eligibility of the PUMAs of
+    the states is computed again from their state files, and the files of the geographies are updated with
+    patchGeographyEligibility. The current eligibility is updated first, since the other scenarios are compared to it.
+    The files and the saved PUMAs of a scenario are only written once every geography of it is updated, so a scenario
+    that cannot be updated, such as one with standard errors, is left as it was, and is updated again the next time.
+    Example:
+        everyStateEligibility(data_dir, states=["al"])
+        updateStateEligibility(data_dir)
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param states: The folders of the states in the state_data folder, such as "al". If None, the states whose
+    eligibility file changed since every scenario was saved, from changedStates
+    :param geographies: The geographies of the files to update. By default, every geography in all_geographies
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :return: A dictionary with the paths to the files of every scenario without the geography as keys, and the paths
+    to the files that were updated as values
+    """
+
+    if geographies is None:
+        geographies = all_geographies
 
-                new_df["metdiv20"] = new_df["metdiv20"].astype(str)
-                new_df["metdiv20"] = new_df["metdiv20"].str.zfill(5)
+    pums_folder = pumsFolder(data_dir, vintage)
+    aggregates_folder = pums_folder + puma_aggregates_folder_name + "/"
+    if not os.path.exists(aggregates_folder):
+        return {}
 
-                # Add the "MetDivName" column to the new dataframe
-                new_df = pd.merge(new_df, df[["metdiv20", "MetDivName"]], on="metdiv20", how="left")
+    scenarios = []
+    for folder in sorted(os.listdir(aggregates_folder)):
+        if os.path.exists(aggregates_folder + folder + "/meta.json"):
+            scenarios.append(loadPumaAggregates(aggregates_folder + folder + "/"))
 
-            # Move the MetDivName column to the second position
-            columns = new_df.columns.tolist()
+    # Update the current eligibility first
+    scenarios.sort(key=lambda scenario: scenario[1]["scenario"]["add_col"])
 
-            # Remove the MetDivName column
-            columns.remove("MetDivName")
+    # The households of every state are only read once
+    state_households = {}
+    updated = {}
 
-            # Add the MetDivName column to the second position
-            columns.insert(1, "MetDivName")
+    for puma_df, meta in scenarios:
+        scenario = meta["scenario"]
+        file_name = pums_folder + meta["file_name"]
+        populations = selectedPopulations({population_var: 1 for population_var in scenario["populations"]})
 
-            # Reorder the columns
-            new_df = new_df[columns]
+        changed = states if states is not None else changedStates(data_dir, meta, vintage)
+        if not changed:
+            continue
 
-        # Fill the null values with 0
-        new_df = new_df.fillna(0)
+        # Compute the eligibility of the PUMAs of the states again
+        state_codes = []
+        for state in changed:
+            if state not in state_households:
+                state_households[state] = stateHouseholdArray(data_dir, state, vintage)
+            households = state_households[state]
 
-        # Save the dataframe to a csv file
-        new_df.to_csv(file_name, index=False)
+            state_df = computePUMAEligibility(data_dir, scenario["povpip"], scenario["has_pap"], scenario["has_ssip"],
+                                              scenario["has_hins4"], scenario["has_snap"], populations, households,
+                                              vintage, scenario["exact_allocation"])
+
+            # The first two digits of a PUMA code are the FIPS code of its state, in both vintages
+            codes = sorted({code[:2] for code in np.asarray(households.puma_codes).astype(str).tolist()})
+            puma_df = pd.concat([puma_df[~puma_df["puma22"].str[:2].isin(codes)], state_df], ignore_index=True)
+            state_codes += codes
+
+        puma_df = puma_df.sort_values(by=["puma22"]).reset_index(drop=True)
+
+        # Update every geography before anything is written
+        try:
+            patches = [patchGeographyEligibility(data_dir, puma_df, state_codes, geography, file_name,
+                                                 scenario["add_col"], populations, vintage,
+                                                 scenario["exact_allocation"])
+                       for geography in geographies]
+        except ValueError as error:
+            print(f"{file_name} is not updated: {error}")
+            continue
+
+        patches = [patch for patch in patches if patch is not None]
+        for output_file, patched_df in patches:
+            # Keep the current eligibility in memory for the scenarios that are compared to it
+            if not scenario["add_col"]:
+                with _baselines_lock:
+                    _baselines[output_file[:-len(output_formats[outputFormat(output_file)])]] = patched_df
+            writeFrame(patched_df, output_file)
+
+        # Save the PUMAs last, so the scenario is only marked as up to date once its files are written
+        savePumaAggregates(data_dir, puma_df, file_name, scenario, vintage)
+        updated[file_name] = [output_file for output_file, _ in patches]
+
+    return updated
 
 
 def add_participation_rate_combined(data_dir: str):
 
     """
     This function will add the participation rate to the combined files. It does so by iterating through all the
-    combined files and adding the most recent subscriber count for that geography. It then creates the participation rate
-    by dividing the total subscribers by the total eligible.
+    combined files and adding the most recent subscriber count for that geography, from the TrackerSeries of the
+    geography. It then creates the participation rate by dividing the total subscribers by the total eligible.
     :param data_dir:
     :return: None, but saves the data to csv files
     """
 
     pums_folder = data_dir + "ACS_PUMS/"
     change_data = pums_folder + "Change_Eligibility/"
-    acp_data = data_dir + "ACP_Households/"
-    total_acp_folder = acp_data + "Final_Files/"
 
     # Get all the files in the change data folder
-    combined_files = [f for f in os.listdir(change_data) if f.endswith(".csv") and "combined" in f]
+    combined_files = [f for f in os.listdir(change_data) if isOutputFile(f) and "combined" in f]
 
     # Iterate through all the files
     for file in combined_files:
@@ -1237,43 +2137,27 @@ def add_participation_rate_combined(data_dir: str):
         geography = file.split("-")[-1].split(".")[0]
 
         # Read the file
-        pums_df = pd.read_csv(os.path.join(change_data, file), header=0, dtype={geography: str})
+        pums_df = readFrame(os.path.join(change_data, file), [geography])
 
         # Add the total subscribers column
         pums_df["Current Total Subscribers"] = 0
 
-        # Look for the total acp file with the same geography
-        total_acp_file = [f for f in os.listdir(total_acp_folder) if f.endswith(".csv") and geography in f]
-
-        # If the file exists, then add the participation rate
-        if len(total_acp_file) > 0:
-            acp_df = pd.read_csv(os.path.join(total_acp_folder, total_acp_file[0]), header=0, dtype={geography: str})
-
-            # Find unique values for the geography
-            unique_geography = acp_df[geography].unique()
-
-            # Iterate through all the unique values
-            for area in unique_geography:
-                area_df = acp_df.loc[acp_df[geography] == area].copy()
-
-                # Sort them ascending by Data Month
-                area_df.sort_values(by=["Data Month"], inplace=True)
-
-                # Find the most recent month
-                most_recent_month = area_df["Data Month"].iloc[-1]
-
-                # Find the Total Subscribers column for the most recent month
-                total_subscribers = area_df.loc[area_df["Data Month"] == most_recent_month, "Total Subscribers"].iloc[0]
+        # Add the most recent subscriber count of every area, if the total acp file with the same geography exists
+        try:
+            latest = loadTrackerSeries(data_dir, geography).latest("Total Subscribers")
+        except FileNotFoundError:
+            latest = None
 
-                # Add the total subscribers to the pums dataframe
-                pums_df.loc[pums_df[geography] == area, "Current Total Subscribers"] = total_subscribers
+        if latest is not None:
+            pums_df["Current Total Subscribers"] = (
+                pums_df[geography].astype(str).map(latest).fillna(0).astype(np.int64))
 
         # Current Participation Rate
         pums_df["Current Participation Rate"] = (
             ((pums_df["Current Total Subscribers"] / pums_df["Current Num Eligible"]) * 100).round(2))
 
-        # Save the data
-        pums_df.to_csv(os.path.join(change_data, file), index=False)
+        # Save the data in the same format
+        writeFrame(pums_df, os.path.join(change_data, file))
 
 
 # def add_saving_data_to_national(data_dir: str):
@@ -1298,203 +2182,316 @@ def add_participation_rate_combined(data_dir: str):
 
 
 
-def cleanData(data_dir: str):
+def scenarioPovpip(file_name: str) -> str:
     """
-    This function will clean the test data and combine it into one file. It does so by iterating through all the
-    files in the test data folder and combining them into one file for each geography.
-    :param data_dir:
-    :return: None, but saves the data to csv files
+    This function will get the povpip from the name of a scenario file, such as
+    percentage_eligible_povpip_135_has_pap_has_ssip_has_hins4_has_snap-covered_populations-county.csv
+    :param file_name: The name of the scenario file
+    :return: The povpip as a string
     """
 
-    # Path to relevant folders
-    pums_folder = data_dir + "ACS_PUMS/"
-    test_folder = pums_folder + "Change_Eligibility/"
+    return file_name.split("_")[3]
 
-    # Get all the files in the test folder
-    all_files = [f for f in os.listdir(test_folder) if os.path.isfile(os.path.join(test_folder, f))]
 
-    # Get all the geographies
-    geographies = [f.split(".")[0].split("-")[-1] for f in all_files if f.endswith(".csv")]
+def scenarioName(file_name: str) -> str:
+    """
+    This function will get the scenario from the name of a scenario file, which is the povpip and the criteria, such
+    as 135_has_pap_has_ssip_has_hins4_has_snap-covered_populations for
+    percentage_eligible_povpip_135_has_pap_has_ssip_has_hins4_has_snap-covered_populations-county.csv
+    :param file_name: The name of the scenario file
+    :return: The scenario as a string
+    """
 
-    # Remove duplicates
-    geographies = list(set(geographies))
+    # Remove the extension, the geography and the prefix before the povpip
+    name = os.path.basename(file_name).split(".")[0].rsplit("-", 1)[0]
 
-    # Iterate through all the geographies
-    for geography in geographies:
+    return name.split("_", 3)[3]
 
-        # Initialize the main dataframe
-        main_df = pd.DataFrame()
 
-        # Iterate through all the files in the test folder
-        for file in os.listdir(test_folder):
+def scenarioLabels(scenarios: list[str]) -> dict[str, str]:
+    """
+    This function will get the suffix that is added to the column names of every scenario in the combined file. It is
+    the povpip, like it has always been, unless several scenarios have the same povpip, such as the covered_populations
+    and the plain scenario files of one povpip. Those scenarios keep their whole name, so their columns do not
+    overwrite each other.
+    :param scenarios: The scenarios, from scenarioName, or the povpips
+    :return: A dictionary with the scenarios as keys and the suffixes as values
+    """
 
-            # Only read the csv files that are for the current geography and are not the combined file
-            if file.endswith(".csv") and geography in file and "combined" not in file:
+    povpips = {scenario: str(scenario).split("_")[0].split("-")[0] for scenario in scenarios}
+    counts = pd.Series(list(povpips.values())).value_counts()
 
-                # Get the povpip
-                povpip = file.split("_")[3]
+    return {scenario: povpip if counts[povpip] == 1 else str(scenario) for scenario, povpip in povpips.items()}
 
-                # Read the file
-                df = pd.read_csv(test_folder + file, header=0, dtype={geography: str})
 
-                # Rename the columns
-                columns = df.columns.tolist()
+def isCombinedKeyColumn(column: str, geography: str) -> bool:
+    """
+    This function will determine if a column is shared by every scenario of a geography. These columns are the
+    geography code, the current eligibility columns, the rural column and the name columns. They are kept once in the
+    combined file, while every other column gets the povpip added to its name.
+    :param column: The name of the column
+    :param geography: The geography code column
+    :return: True if the column is shared by every scenario, False otherwise
+    """
 
-                # For columns that are not the geography, add the povpip to the column name
-                for column in columns:
+    return column == geography or "Current" in column or "rural" in column or "Name" in column
+
+
+def buildCombinedFrame(scenario_frames: dict[str, pd.DataFrame], geography: str) -> pd.DataFrame:
+    """
+    This function will combine the results of every povpip scenario of one geography into one wide dataframe. Instead
+    of merging every scenario onto a growing dataframe, it stacks all the scenarios into one long dataframe, aligns the
+    shared columns once, and pivots the scenario columns into the wide layout with one reshape.
+    :param scenario_frames: A dictionary with the scenarios, from scenarioName, or the povpips as keys and the scenario
+    dataframes as values
+    :param geography: The geography code column
+    :return: A dataframe with one row per geography code and the scenario columns suffixed with the povpip, or with the
+    whole scenario if several scenarios have the same povpip
+    """
 
-                    # If the column is the geography, then do not add the povpip
-                    if geography == column:
-                        pass
+    # Sort the scenarios by povpip so that the columns are in a predictable order
+    labels = scenarioLabels(list(scenario_frames.keys()))
+    povpips = {scenario: str(scenario).split("_")[0].split("-")[0] for scenario in scenario_frames}
+    scenarios = sorted(scenario_frames.keys(), key=lambda scenario: (int(povpips[scenario]) if
+                                                                     povpips[scenario].isdigit() else 0, str(scenario)))
 
-                    # If the column is the current percentage eligible, then do not add the povpip to the column name
-                    elif "Current" in column:
-                        pass
+    # Stack every scenario into one long dataframe with the suffix of the scenario as a column
+    long_df = pd.concat([scenario_frames[scenario] for scenario in scenarios],
+                        keys=[labels[scenario] for scenario in scenarios],
+                        names=["povpip", None]).reset_index(level="povpip")
 
-                    # If the column is rural, then do not add the povpip to the column name
-                    elif "rural" in column:
-                        pass
+    # The columns shared by every scenario, and the columns that are specific to each scenario
+    columns = [c for c in long_df.columns.tolist() if c != "povpip"]
+    key_columns = [c for c in columns if isCombinedKeyColumn(c, geography)]
+    value_columns = [c for c in columns if c not in key_columns]
 
-                    # If the column is CountyName, then do not add the povpip to the column name
-                    elif "Name" in column:
-                        pass
+    # Align the shared columns once, keeping the first row for every geography code
+    keys_df = long_df[key_columns].drop_duplicates(subset=[geography]).set_index(geography)
 
-                    # Else, add the povpip to the column name
-                    else:
-                        df = df.rename(columns={column: column + "_" + povpip})
+    # Pivot the scenario columns into the wide layout
+    wide_df = long_df.set_index([geography, "povpip"])[value_columns].unstack("povpip")
 
-                # If the main dataframe is empty, set it equal to the dataframe
-                if main_df.empty:
-                    main_df = df
+    # Order the columns by scenario, then by the original column order, and add the suffix to the column names. Only
+    # keep the columns that are in that scenario's file
+    ordered = [(column, labels[scenario]) for scenario in scenarios
+               for column in scenario_frames[scenario].columns.tolist() if column in value_columns]
+    wide_df = wide_df.reindex(columns=pd.MultiIndex.from_tuples(ordered))
+    wide_df.columns = [column + "_" + label for column, label in ordered]
 
-                # Else, merge the dataframes
-                else:
-                    # If the geography is not county, then merge the dataframes on the geography and current percentage
-                    if geography != "county" and geography != "metdiv20":
-                        main_df = pd.merge(main_df, df, on=[geography, "Current Percentage Eligible",
-                                                            "Current Num Eligible", "Current Num Ineligible"],
-                                           how="outer")
+    # Join the shared columns with the scenario columns
+    main_df = keys_df.join(wide_df, how="outer").reset_index()
 
-                    # Else, merge the dataframes on the geography, current percentage, and rural
-                    elif geography == "county":
-                        main_df = pd.merge(main_df, df, on=[geography, "Current Percentage Eligible", "rural",
-                                                            "Current Num Eligible", "Current Num Ineligible",
-                                                            "CountyName"],
-                                           how="outer")
+    # Move the current columns to the second, third, and fourth positions
+    columns = main_df.columns.tolist()
+    for column in ["Current Percentage Eligible", "Current Num Ineligible", "Current Num Eligible"]:
+        columns.remove(column)
+        columns.insert(1, column)
 
-                    elif geography == "metdiv20":
-                        main_df = pd.merge(main_df, df, on=[geography, "Current Percentage Eligible",
-                                                            "Current Num Eligible", "Current Num Ineligible",
-                                                            "MetDivName"],
-                                           how="outer")
+    # If the code column is county, make the rural column be the second column
+    if geography == "county":
+        columns.remove("rural")
+        columns.insert(1, "rural")
 
-        # Move the current percentage eligible column to the second position
-        columns = main_df.columns.tolist()
+    # Reassign the columns
+    return main_df[columns]
 
-        # Remove the current percentage eligible column
-        columns.remove("Current Percentage Eligible")
 
-        # Add the current percentage eligible column to the second position
-        columns.insert(1, "Current Percentage Eligible")
+def cleanData(data_dir: str, scenario_frames: dict[str, dict[str, pd.DataFrame]] = None, output_format: str = "csv"):
+    """
+    This function will clean the test data and combine it into one file. It does so by reading every scenario file in
+    the test data folder once, grouping them by geography, and combining them into one file for each geography with
+    buildCombinedFrame.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param scenario_frames: Optionally, the scenario results already in memory, as a dictionary with the geographies
+    as keys and dictionaries of {scenario: dataframe} as values, with the scenarios from scenarioName or the povpips.
+    If given, the files are not read.
+    :param output_format: The format of the combined files, one of output_formats. The scenario files are read in any
+    format
+    :return: None, but saves the data to csv files
+    """
 
-        # Remove the current percentage eligible column
-        columns.remove("Current Num Ineligible")
+    # Path to relevant folders
+    pums_folder = data_dir + "ACS_PUMS/"
+    test_folder = pums_folder + "Change_Eligibility/"
 
-        # Add the current percentage eligible column to the second position
-        columns.insert(1, "Current Num Ineligible")
+    # Read every scenario file once, grouped by geography
+    if scenario_frames is None:
+        scenario_frames = {}
 
-        # Remove the current percentage eligible column
-        columns.remove("Current Num Eligible")
+        for file in sorted(os.listdir(test_folder)):
+            # Only read the output files that are not the combined files
+            if not isOutputFile(file) or "combined" in file:
+                continue
 
-        # Add the current percentage eligible column to the second position
-        columns.insert(1, "Current Num Eligible")
+            # Get the geography and the scenario, so the files of one povpip with different criteria are both kept
+            geography = file.split(".")[0].split("-")[-1]
+            scenario = scenarioName(file)
 
-        # Reassign the columns
-        main_df = main_df[columns]
+            # Read the file
+            df = readFrame(test_folder + file, [geography])
 
-        # If the code column is county, make the rural column be the second column
-        if geography == "county":
-            # Get the columns
-            columns = main_df.columns.tolist()
+            scenario_frames.setdefault(geography, {})[scenario] = df
 
-            # Remove the rural column
-            columns.remove("rural")
+    # Combine the scenarios of every geography and save the data
+    for geography, frames in scenario_frames.items():
+        main_df = buildCombinedFrame(frames, geography)
 
-            # Add the rural column to the second position
-            columns.insert(1, "rural")
+        writeFrame(main_df, outputFile(test_folder + f"combined-{geography}", output_format))
 
-            # Reassign the columns
-            main_df = main_df[columns]
 
-        # Save the data
-        main_df.to_csv(test_folder + f"combined-{geography}.csv", index=False)
+# The state attribute columns from the deliverable file used to estimate the savings
+state_attribute_columns = [" stusps", "Medicaid expansion (1)", "Party", "ACP Participation Sep 23 (2)",
+                           "Avg claim $ Jan-Sep 2023 (3)"]
 
+# The columns added by computeSavings
+savings_columns = ["Total dif", "Weighed dif", "Saving in $"]
 
-def createDeliverableFiles(data_dir: str):
-    pums_folder = data_dir + "ACS_PUMS/"
 
-    deliverable_folder = pums_folder + "deliverable_file/"
-    national_folder = pums_folder + "National_Changes/"
+def readStateAttributes(deliverable_folder: str) -> pd.DataFrame:
+    """
+    This function will read the state attributes from the deliverable Excel file. These are the Medicaid expansion,
+    the party, the ACP participation and the average claim for every state.
+    :param deliverable_folder: The path to the deliverable folder
+    :return: A dataframe with the state code and the state attribute columns
+    """
 
-    # Turn the excel file into a csv file
+    # Read the excel file
     df = pd.read_excel(deliverable_folder + "State_135_v2.xlsx", header=0)
 
     df["state"] = df["state"].astype(str).str.zfill(2)
 
     df = df.dropna(subset=["Medicaid expansion (1)"])
 
-    df = df[["state", " stusps", "Medicaid expansion (1)", "Party", "ACP Participation Sep 23 (2)",
-             "Avg claim $ Jan-Sep 2023 (3)"]]
+    return df[["state"] + state_attribute_columns]
 
-    for file in os.listdir(national_folder):
-        if file.endswith(".csv"):
-            df_change = pd.read_csv(national_folder + file, header=0, dtype={"state": str})
 
-            if " stusps" not in df_change.columns.tolist():
-                df_change["state"] = df_change["state"].astype(str).str.zfill(2)
+def readScenarioSweep(folder: str, geography: str = "state") -> tuple[pd.DataFrame, dict[str, str]]:
+    """
+    This function will read every scenario file in a folder once and stack them into one long dataframe, with the
+    scenario of each file, from scenarioName, in the Scenario column and its povpip in the POVPIP column. Files with
+    the same povpip but other criteria are different scenarios, so they are kept apart by the Scenario column.
+    :param folder: The path to the folder with the scenario files, such as National_Changes
+    :param geography: The geography code column
+    :return: The long dataframe, and a dictionary with the scenarios as keys and the file names as values
+    """
 
-                df_change = pd.merge(df_change, df, on="state", how="left")
+    if not os.path.isdir(folder):
+        raise FileNotFoundError(f"The sweep folder {folder} does not exist")
 
-                cols = df_change.columns.tolist()
+    frames = []
+    file_names = {}
 
-                cols.remove(" stusps")
+    for file in sorted(os.listdir(folder)):
+        if isOutputFile(file):
+            scenario = scenarioName(file)
 
-                cols.insert(1, " stusps")
+            df = readFrame(folder + file, [geography])
+            if geography == "state":
+                df["state"] = df["state"].astype(str).str.zfill(2)
+            df.insert(0, "POVPIP", scenarioPovpip(file))
+            df.insert(0, "Scenario", scenario)
 
-                df_change = df_change[cols]
+            frames.append(df)
+            file_names[scenario] = file
 
-            df_change["Total dif"] = df_change["Current Num Eligible"] - df_change["Num Eligible"]
+    if len(frames) == 0:
+        raise FileNotFoundError(f"There are no scenario files in the sweep folder {folder}")
 
-            df_change["Weighed dif"] = df_change["Total dif"] * df_change["ACP Participation Sep 23 (2)"]
+    return pd.concat(frames, axis=0, ignore_index=True), file_names
 
-            df_change["Saving in $"] = df_change["Weighed dif"] * df_change["Avg claim $ Jan-Sep 2023 (3)"]
 
-            df_change.to_csv(national_folder + file, index=False)
+def computeSavings(sweep_df: pd.DataFrame, attributes_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function will estimate the savings of every scenario in a sweep. It joins the state attributes to the long
+    sweep dataframe once, and then computes the difference in eligible households, the difference weighted by the ACP
+    participation, and the savings in dollars for every state and every povpip at the same time.
+    :param sweep_df: The long dataframe from readScenarioSweep, with the Scenario, POVPIP and state columns
+    :param attributes_df: The dataframe from readStateAttributes
+    :return: The sweep dataframe with the state attributes and the savings columns
+    """
+
+    # Drop the attributes and savings that were added in a previous run
+    df = sweep_df.drop(columns=[c for c in state_attribute_columns + savings_columns if c in sweep_df.columns])
+
+    # Join the state attributes
+    df = pd.merge(df, attributes_df, on="state", how="left")
+
+    # Move the stusps column next to the state column
+    cols = df.columns.tolist()
+    cols.remove(" stusps")
+    cols.insert(cols.index("state") + 1, " stusps")
+    df = df[cols]
+
+    # Calculate the savings
+    df["Total dif"] = df["Current Num Eligible"] - df["Num Eligible"]
+
+    df["Weighed dif"] = df["Total dif"] * df["ACP Participation Sep 23 (2)"]
+
+    df["Saving in $"] = df["Weighed dif"] * df["Avg claim $ Jan-Sep 2023 (3)"]
 
+    return df
+
+
+@tracedStage("createDeliverableFiles")
+def createDeliverableFiles(data_dir: str, sweep_df: pd.DataFrame = None, file_names: dict[str, str] = None) \
+        -> pd.DataFrame:
+    """
+    This function will add the state attributes and the estimated savings to every file in the National_Changes
+    folder. The savings of every scenario are computed at once with computeSavings, and each file is then written from
+    that result.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param sweep_df: Optionally, the long sweep dataframe already in memory. If not given, it is read from the
+    National_Changes folder
+    :param file_names: The file name for every scenario, required if sweep_df is given
+    :return: The long dataframe with the savings of every scenario, which can be passed to aggregateSavings
+    """
 
-def aggregateSavings(data_dir: str):
     pums_folder = data_dir + "ACS_PUMS/"
-    national_folder = pums_folder + "National_Changes/"
+
     deliverable_folder = pums_folder + "deliverable_file/"
+    national_folder = pums_folder + "National_Changes/"
 
-    main_df = pd.DataFrame(columns=["POVPIP", "National Saving"])
+    attributes_df = readStateAttributes(deliverable_folder)
 
-    for file in os.listdir(national_folder):
-        povpip = file.split("_")[3]
-        df = pd.read_csv(national_folder + file, header=0)
+    if sweep_df is None:
+        sweep_df, file_names = readScenarioSweep(national_folder)
 
-        total_savings = round((df["Saving in $"].sum()), 2)
+    savings_df = computeSavings(sweep_df, attributes_df)
 
-        new_df = pd.DataFrame([[povpip, total_savings]], columns=["POVPIP", "National Saving"])
+    # Write the file of every scenario
+    for scenario, df in savings_df.groupby("Scenario", sort=False):
+        writeFrame(df.drop(columns=["Scenario", "POVPIP"]), national_folder + file_names[scenario])
 
-        main_df = pd.concat([main_df, new_df], axis=0)
+    return savings_df
 
-    main_df = main_df.sort_values(by=["POVPIP"])
 
+@tracedStage("aggregateSavings")
+def aggregateSavings(data_dir: str, savings_df: pd.DataFrame = None):
+    """
+    This function will total the savings of every scenario into the national_savings.csv file, with one row per
+    scenario file. The POVPIP column is the povpip of the scenario, unless several scenarios have the same povpip, in
+    which case it is the whole scenario, like the columns of the combined files.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param savings_df: Optionally, the long dataframe returned by createDeliverableFiles. If not given, it is read from
+    the National_Changes folder
+    :return: None, but saves the data to a csv file
+    """
 
-    main_df.to_csv(deliverable_folder + "national_savings.csv", index=False)
+    pums_folder = data_dir + "ACS_PUMS/"
+    national_folder = pums_folder + "National_Changes/"
+    deliverable_folder = pums_folder + "deliverable_file/"
+
+    if savings_df is None:
+        savings_df, _ = readScenarioSweep(national_folder)
 
+    # Total the savings of every scenario
+    main_df = savings_df.groupby("Scenario")["Saving in $"].sum().round(2).reset_index()
+    main_df["Scenario"] = main_df["Scenario"].map(scenarioLabels(main_df["Scenario"].tolist()))
+    main_df.columns = ["POVPIP", "National Saving"]
 
+    main_df = main_df.sort_values(by=["POVPIP"])
+
+    main_df.to_csv(deliverable_folder + "national_savings.csv", index=False)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    # numba is optional, without it the totals are computed with NumPy
+    numba = None
+
+# The criteria of a scenario, as one record the kernels take: the POVPIP threshold, which is -1 if the income is not
+# used, the bits of the programs that make a household eligible, and the bits of the covered populations that are summed
+criteria_type = np.dtype([("povpip", np.int32), ("program_mask", np.uint8), ("population_mask", np.uint16)])
+
+
+def criteriaRecord(povpip: int, program_mask: int, population_mask: int = 0) -> np.void:
+    """
+    This function creates the criteria record of a scenario.
+    :param povpip: The desired income threshold. If it is 0, the income is not used, like in determine_eligibility
+    :param program_mask: The bits of the programs that are used, as they are stored in the household arrays
+    :param population_mask: The bits of the covered populations to sum, as they are stored in the household arrays
+    :return: The record, of criteria_type
+    """
+
+    return np.array((povpip if povpip != 0 else -1, program_mask, population_mask), dtype=criteria_type)[()]
+
+
+def _populationBits(population_mask: int) -> np.ndarray:
+    """
+    This function finds the bits of the covered populations that are summed.
+    :param population_mask: The population_mask of the criteria
+    :return: The bits, from the lowest to the highest
+    """
+
+    return np.array([bit for bit in range(16) if population_mask >> bit & 1], dtype=np.int64)
+
+
+def _pumaTotalsNumpy(povpip: np.ndarray, programs: np.ndarray, wgtp: np.ndarray, puma_idx: np.ndarray,
+                     populations: np.ndarray, criteria: np.void, number_pumas: int) -> np.ndarray:
+    """
+    This function sums the weights of every PUMA with NumPy. The eligible and all households are summed with one
+    bincount, with the eligibility of a household as the lowest bit of its bin, and the covered populations are only
+    summed over the eligible households.
+    :param povpip: The POVPIP of every household
+    :param programs: The program bits of every household
+    :param wgtp: The weight of every household
+    :param puma_idx: The PUMA of every household
+    :param populations: The covered population bits of every household
+    :param criteria: The criteria, from criteriaRecord
+    :param number_pumas: The number of PUMAs
+    :return: The totals, from pumaTotals
+    """
+
+    population_bits = _populationBits(int(criteria["population_mask"]))
+
+    eligible = (programs & criteria["program_mask"]) != 0
+    if criteria["povpip"] >= 0:
+        eligible |= povpip <= criteria["povpip"]
+
+    # Bin 2 * PUMA has the ineligible households and bin 2 * PUMA + 1 the eligible ones
+    bins = puma_idx.astype(np.intp) * 2 + eligible
+    by_eligibility = np.bincount(bins, weights=wgtp, minlength=2 * number_pumas).reshape(number_pumas, 2)
+
+    totals = np.zeros((number_pumas, 2 + len(population_bits)), dtype=np.int64)
+    totals[:, 0] = by_eligibility[:, 1]
+    totals[:, 1] = by_eligibility.sum(axis=1)
+
+    if len(population_bits):
+        rows = np.flatnonzero(eligible)
+        eligible_pumas = puma_idx[rows].astype(np.intp)
+        eligible_wgtp = wgtp[rows].astype(np.float64)
+        eligible_populations = populations[rows]
+
+        for column, bit in enumerate(population_bits):
+            weights = eligible_wgtp * (eligible_populations >> bit & 1)
+            totals[:, 2 + column] = np.bincount(eligible_pumas, weights=weights, minlength=number_pumas)
+
+    return totals
+
+
+if numba is not None:
+    @numba.njit(cache=True, nogil=True)
+    def _pumaTotalsCompiled(povpip, programs, wgtp, puma_idx, populations, threshold, program_mask, population_bits,
+                            totals):
+        """
+        This function sums the weights of every PUMA in one pass over the households, without a mask or a column. The
+        eligibility is a 0|1 that multiplies the weight, so the loop has no branch.
+        """
+
+        for i in range(len(wgtp)):
+            weight = np.int64(wgtp[i])
+            eligible = np.int64(((programs[i] & program_mask) != 0) | (np.int64(povpip[i]) <= threshold))
+            puma = puma_idx[i]
+
+            totals[puma, 0] += weight * eligible
+            totals[puma, 1] += weight
+            for column in range(len(population_bits)):
+                totals[puma, 2 + column] += weight * eligible * ((populations[i] >> population_bits[column]) & 1)
+else:
+    _pumaTotalsCompiled = None
+
+
+def pumaTotals(povpip: np.ndarray, programs: np.ndarray, wgtp: np.ndarray, puma_idx: np.ndarray,
+               populations: np.ndarray, criteria: np.void, number_pumas: int, compiled: int = 1) -> np.ndarray:
+    """
+    This function sums the weights of the households of every PUMA for the criteria of a scenario: the eligible
+    households, every household, and the eligible households of every covered population of the criteria. With numba,
+    it is one compiled pass over the households, else it is done with NumPy.
+    :param povpip: The POVPIP of every household
+    :param programs: The program bits of every household
+    :param wgtp: The weight of every household
+    :param puma_idx: The PUMA of every household
+    :param populations: The covered population bits of every household
+    :param criteria: The criteria, from criteriaRecord
+    :param number_pumas: The number of PUMAs
+    :param compiled: Whether to use the numba kernel if numba is installed 0|1
+    :return: The totals as int64, with one row per PUMA, and the eligible weight, the total weight, and the eligible
+    weight of every covered population of the criteria, from the lowest bit to the highest, as columns
+    """
+
+    if compiled == 1 and _pumaTotalsCompiled is not None:
+        population_bits = _populationBits(int(criteria["population_mask"]))
+        totals = np.zeros((number_pumas, 2 + len(population_bits)), dtype=np.int64)
+        _pumaTotalsCompiled(np.asarray(povpip), np.asarray(programs), np.asarray(wgtp), np.asarray(puma_idx),
+                            np.asarray(populations), np.int64(criteria["povpip"]), np.int64(criteria["program_mask"]),
+                            population_bits, totals)
+        return totals
+
+    return _pumaTotalsNumpy(np.asarray(povpip), np.asarray(programs), np.asarray(wgtp), np.asarray(puma_idx),
+                            np.asarray(populations), criteria, number_pumas)
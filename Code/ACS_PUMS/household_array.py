@@ -0,0 +1,644 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from Code.ACS_PUMS.eligibility_kernel import criteriaRecord, numba, pumaTotals
+from Code.Geocorr.crosswalk_registry import allocateTotals
+
+# The folder the household arrays are saved to, inside the ACS_PUMS folder
+household_folder_name = ".households"
+
+# The folder the PUMS vintages are saved to, inside the ACS_PUMS folder
+vintages_folder_name = "vintages"
+
+# A PUMA that only exists in the 2010 PUMAs, used to know if the state files use them
+old_puma_code = "0600102"
+
+# The bit of every program in the program flags
+program_bits = {"has_pap": 1, "has_ssip": 2, "has_hins4": 4, "has_snap": 8}
+
+# The covered population columns of the state files, in the order of their bits in the population flags
+population_columns = ["American Indian and Alaska Native", "Asian", "Black or African American", "Native Hawaiian",
+                      "Pacific Islander", "White", "Hispanic or Latino", "Veteran", "Elderly", "DIS",
+                      "English less than very well"]
+
+# The names and types of the arrays
+array_types = {
+    "povpip": np.uint16,
+    "programs": np.uint8,
+    "wgtp": np.uint16,
+    "puma_idx": np.int16,
+    "populations": np.uint16,
+}
+
+# The arrays of the 2010 to 2020 PUMA remap, saved when the state files use the 2010 PUMAs
+remap_arrays = ["remap_source_idx", "remap_target_codes", "remap_target_idx", "remap_afact"]
+
+# The household arrays that were already loaded, with the stamps of the state files they were built from. The keys are
+# the paths to the household folders
+_loaded_households = {}
+_loaded_lock = threading.Lock()
+
+
+def eligibilityCriteria(povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1, has_snap: int = 1,
+                        population_names: list[str] = None) -> np.void:
+    """
+    This function creates the criteria record of a scenario that the eligibility kernel of pumaTotals takes.
+    :param povpip: The desired income threshold. If it is 0, the income is not used
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param population_names: The covered population columns to sum, such as "Asian"
+    :return: The record, from criteriaRecord
+    """
+
+    used = {"has_pap": has_pap, "has_ssip": has_ssip, "has_hins4": has_hins4, "has_snap": has_snap}
+    program_mask = sum(bit for name, bit in program_bits.items() if used[name] == 1)
+    population_mask = sum(1 << population_columns.index(population_name) for population_name in
+                          set(population_names or []))
+
+    return criteriaRecord(povpip, program_mask, population_mask)
+
+
+class HouseholdArray:
+    """
+    Every household of the state files, stored as one small integer per column. The PUMA of a household is stored as
+    its index in puma_codes, the programs it takes part in as bits of programs, and the covered populations it
+    belongs to as bits of populations. The arrays are memory-mapped, so every process that loads them shares one copy.
+    If the state files use the 2010 PUMAs, the remap to the 2020 PUMAs is built once with the arrays, and the totals
+    are remapped in the same way as crossWalkOldPumaNewPuma.
+    """
+
+    def __init__(self, folder: str, puma_codes: np.ndarray, povpip: np.ndarray, programs: np.ndarray,
+                 wgtp: np.ndarray, puma_idx: np.ndarray, populations: np.ndarray, remap_source_idx: np.ndarray = None,
+                 remap_target_codes: np.ndarray = None, remap_target_idx: np.ndarray = None,
+                 remap_afact: np.ndarray = None):
+        self.folder = folder
+        self.puma_codes = puma_codes
+        self.povpip = povpip
+        self.programs = programs
+        self.wgtp = wgtp
+        self.puma_idx = puma_idx
+        self.populations = populations
+        self.remap_source_idx = remap_source_idx
+        self.remap_target_codes = remap_target_codes
+        self.remap_target_idx = remap_target_idx
+        self.remap_afact = remap_afact
+
+        # The households sorted by PUMA, and where every PUMA starts, built the first time it is used
+        self._puma_order = None
+        self._puma_starts = None
+
+    def __len__(self):
+        return len(self.wgtp)
+
+    def __repr__(self):
+        return f"HouseholdArray({len(self)} households, {len(self.puma_codes)} PUMAs)"
+
+    def pumaPositions(self, pumas: list[str] = None, states: list[str] = None) -> np.ndarray:
+        """
+        This function finds the PUMAs of puma_codes that contribute to some 2020 PUMAs or states. If the state files use
+        the 2010 PUMAs, these are the 2010 PUMAs that the remap moves households from into the 2020 PUMAs.
+        :param pumas: The 2020 PUMA codes, written as seven digits
+        :param states: The FIPS codes of the states, written as two digits
+        :return: The positions of the PUMAs in puma_codes
+        """
+
+        codes = np.asarray(self.puma_codes).astype(str)
+        selected = np.zeros(len(codes), dtype=bool)
+
+        # The first two digits of a PUMA code are the FIPS code of its state, in both vintages
+        if states is not None:
+            selected |= np.isin(np.array([code[:2] for code in codes.tolist()]), list(states))
+
+        if pumas is not None:
+            if self.remap_source_idx is None:
+                selected |= np.isin(codes, list(pumas))
+            else:
+                targets = np.isin(np.asarray(self.remap_target_codes).astype(str), list(pumas))
+                sources = np.asarray(self.remap_source_idx)[targets[np.asarray(self.remap_target_idx)]]
+                selected[sources] = True
+
+        return np.flatnonzero(selected)
+
+    def pumaRows(self, positions: np.ndarray) -> np.ndarray:
+        """
+        This function finds the households of some PUMAs, with the households sorted by PUMA. The order is built the
+        first time, so the households of a few PUMAs are found without a scan of every household.
+        :param positions: The positions of the PUMAs in puma_codes, from pumaPositions
+        :return: The rows of the households, in the order of the arrays
+        """
+
+        if self._puma_order is None:
+            puma_idx = np.asarray(self.puma_idx)
+            order = np.argsort(puma_idx, kind="stable")
+            self._puma_starts = np.searchsorted(puma_idx[order], np.arange(len(self.puma_codes) + 1))
+            self._puma_order = order
+
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.intp)
+
+        return np.sort(np.concatenate([self._puma_order[self._puma_starts[position]:self._puma_starts[position + 1]]
+                                       for position in positions]))
+
+    def subset(self, rows: np.ndarray) -> "HouseholdArray":
+        """
+        This function creates the household arrays of some of the households. The PUMA codes and the remap are shared,
+        so pumaEligibility gives the same rows as for every household, with 0 for the PUMAs that are left out.
+        :param rows: The rows of the households, such as from pumaRows
+        :return: The household arrays of the rows
+        """
+
+        return HouseholdArray(self.folder, self.puma_codes, self.povpip[rows], self.programs[rows], self.wgtp[rows],
+                              self.puma_idx[rows], self.populations[rows], self.remap_source_idx,
+                              self.remap_target_codes, self.remap_target_idx, self.remap_afact)
+
+    def eligibleMask(self, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
+                     has_snap: int = 1) -> np.ndarray:
+        """
+        This function finds the households that are eligible for ACP with the given criteria, in the same way as
+        determine_eligibility.
+        :param povpip: The desired income threshold. If it is 0, the income is not used
+        :param has_pap: Whether to use the PAP criteria 0|1
+        :param has_ssip: Whether to use the SSIP criteria 0|1
+        :param has_hins4: Whether to use the HINS4 criteria 0|1
+        :param has_snap: Whether to use the SNAP criteria 0|1
+        :return: A boolean array with True for the eligible households
+        """
+
+        # The bits of the programs that are used
+        used = {"has_pap": has_pap, "has_ssip": has_ssip, "has_hins4": has_hins4, "has_snap": has_snap}
+        program_mask = sum(bit for name, bit in program_bits.items() if used[name] == 1)
+
+        eligible = (self.programs & program_mask) != 0
+
+        if povpip != 0:
+            eligible |= self.povpip <= povpip
+
+        return eligible
+
+    def populationWeights(self, population_name: str) -> np.ndarray:
+        """
+        This function gets the weight of a covered population in every household, which is the same as the column of
+        the state files. It is the weight of the household if it belongs to the population, else 0.
+        :param population_name: The covered population column, such as "Asian"
+        :return: The weights, as int64
+        """
+
+        bit = 1 << population_columns.index(population_name)
+
+        return np.where((self.populations & bit) != 0, self.wgtp, 0).astype(np.int64)
+
+    def pumaEligibility(self, povpip: int = 200, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
+                        has_snap: int = 1, population_names: list[str] = None,
+                        exact_allocation: int = 0) -> pd.DataFrame:
+        """
+        This function finds the number of eligible and ineligible households in every PUMA, for
+        computePUMAEligibility, remapped to the 2020 PUMAs if the state files use the 2010 PUMAs.
+        :param povpip: The desired income threshold. If it is 0, the income is not used
+        :param has_pap: Whether to use the PAP criteria 0|1
+        :param has_ssip: Whether to use the SSIP criteria 0|1
+        :param has_hins4: Whether to use the HINS4 criteria 0|1
+        :param has_snap: Whether to use the SNAP criteria 0|1
+        :param population_names: The covered population columns to add the number eligible for
+        :param exact_allocation: Whether to remap the 2010 PUMAs with the largest remainder method 0|1
+        :return: A dataframe with the puma22, Num Eligible, Num Ineligible, Percentage Eligible and covered population
+        columns, with the percentage eligible between 0 and 1
+        """
+
+        population_names = population_names or []
+        number_pumas = len(self.puma_codes)
+
+        # Sum the weights of the eligible and ineligible households and the covered populations in one pass
+        totals = pumaTotals(self.povpip, self.programs, self.wgtp, self.puma_idx, self.populations,
+                            eligibilityCriteria(povpip, has_pap, has_ssip, has_hins4, has_snap, population_names),
+                            number_pumas)
+
+        df = pd.DataFrame({
+            "puma22": self.puma_codes.astype(str),
+            "Num Eligible": totals[:, 0],
+            "Num Ineligible": totals[:, 1] - totals[:, 0],
+        })
+        df["Percentage Eligible"] = df["Num Eligible"] / (df["Num Eligible"] + df["Num Ineligible"])
+
+        # The covered populations are in the columns of the totals in the order of their bits
+        population_order = sorted(set(population_names), key=population_columns.index)
+        for population_name in population_names:
+            df[population_name + " Eligible"] = totals[:, 2 + population_order.index(population_name)]
+
+        if self.remap_source_idx is not None:
+            df = self.remapPUMAs(df, exact_allocation)
+
+        return df
+
+    def remapPUMAs(self, df: pd.DataFrame, exact_allocation: int = 0) -> pd.DataFrame:
+        """
+        This function remaps the totals of every 2010 PUMA to the 2020 PUMAs. Like crossWalkOldPumaNewPuma, every
+        total is multiplied by the afact and rounded for every row of the remap, and then added up by 2020 PUMA.
+        :param df: The dataframe from pumaEligibility, with one row per 2010 PUMA in the order of puma_codes
+        :param exact_allocation: Whether to round once per 2010 PUMA with the largest remainder method 0|1
+        :return: The dataframe with one row per 2020 PUMA
+        """
+
+        # Only keep the 2020 PUMAs that get data
+        targets, target_idx = np.unique(np.asarray(self.remap_target_idx, dtype=np.intp), return_inverse=True)
+
+        columns = df.columns.drop(["puma22", "Percentage Eligible"])
+        totals = allocateTotals(df[columns].to_numpy(dtype=np.float64), self.remap_source_idx, target_idx,
+                                self.remap_afact, len(targets), exact_allocation)
+
+        remapped = pd.DataFrame(totals, columns=columns)
+        remapped.insert(0, "puma22", np.asarray(self.remap_target_codes)[targets].astype(str))
+        remapped.insert(3, "Percentage Eligible",
+                        remapped["Num Eligible"] / (remapped["Num Eligible"] + remapped["Num Ineligible"]))
+
+        return remapped
+
+
+def pumsFolder(data_dir: str, vintage: str = None) -> str:
+    """
+    This function gets the folder with the state_data folder and the outputs of a PUMS vintage. The most recent
+    vintage, from downloadPUMSFiles, is in the ACS_PUMS folder itself, and the others are in the vintages folder.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage, from vintageName. If None, the ACS_PUMS folder is used
+    :return: The path to the folder, ending with a slash
+    """
+
+    if vintage is None:
+        return data_dir + "ACS_PUMS/"
+
+    return data_dir + "ACS_PUMS/" + vintages_folder_name + "/" + vintage + "/"
+
+
+def _householdFolder(data_dir: str, vintage: str = None) -> str:
+    """
+    This function gets the folder the household arrays are saved to.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :return: The path to the household folder
+    """
+
+    return os.path.abspath(pumsFolder(data_dir, vintage) + household_folder_name)
+
+
+def _stateFiles(data_dir: str, vintage: str = None, states: list[str] = None) -> list[str]:
+    """
+    This function finds the eligibility files of every state.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :param states: The folders of the states in the state_data folder, such as "al". If None, every state is used
+    :return: The paths to the files, sorted
+    """
+
+    state_folder = pumsFolder(data_dir, vintage) + "state_data/"
+    state_files = []
+
+    for state in sorted(os.listdir(state_folder) if states is None else states):
+        folder = state_folder + state + "/"
+        if os.path.isdir(folder):
+            state_files += [os.path.abspath(folder + file) for file in sorted(os.listdir(folder))
+                            if file.endswith(".csv")]
+
+    return state_files
+
+
+def _fileStamps(files: list[str]) -> dict[str, list[float]]:
+    """
+    This function gets the modification time and size of every file, to know if a file changed.
+    :param files: The paths to the files
+    :return: A dictionary with the paths as keys and [mtime, size] as values
+    """
+
+    return {file: [os.path.getmtime(file), os.path.getsize(file)] for file in files}
+
+
+def _checkRange(name: str, values: np.ndarray, dtype) -> np.ndarray:
+    """
+    This function converts a column to a smaller integer type, checking that every value fits in it.
+    :param name: The name of the column, for the error message
+    :param values: The values of the column
+    :param dtype: The integer type
+    :return: The converted values
+    """
+
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(f"The {name} column has values from {values.min()} to {values.max()}, which do not fit in "
+                         f"{np.dtype(dtype).name}")
+
+    return values.astype(dtype)
+
+
+def _buildRemap(data_dir: str, puma_codes: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    This function builds the remap from the 2010 PUMAs to the 2020 PUMAs, from the equivalency file of
+    downloadOldPumaNewPumaFile. Only the rows with a 2010 PUMA of the state files are kept.
+    :param data_dir: The path to the data directory which contains the GeoCorr folder
+    :param puma_codes: The 2010 PUMA codes of the state files
+    :return: A dictionary with the names of the remap arrays as keys and the arrays as values
+    """
+
+    equivalency_file = data_dir + "GeoCorr/Public-use microdata area (PUMA)/puma_equivalency.csv"
+    if not os.path.exists(equivalency_file):
+        raise FileNotFoundError(f"{equivalency_file} does not exist, run downloadOldPumaNewPumaFile to create it")
+
+    df = pd.read_csv(equivalency_file, usecols=["puma12", "puma22", "afact"],
+                     dtype={"puma12": str, "puma22": str, "afact": np.float64})
+    df["puma12"] = df["puma12"].str.zfill(7)
+    df["puma22"] = df["puma22"].str.zfill(7)
+
+    # Keep the rows with a PUMA in the state files
+    positions = pd.Series(np.arange(len(puma_codes)), index=puma_codes)
+    df = df[df["puma12"].isin(positions.index)]
+
+    target_codes, target_idx = np.unique(df["puma22"].to_numpy(dtype=str), return_inverse=True)
+
+    return {
+        "remap_source_idx": positions[df["puma12"]].to_numpy(dtype=np.int32),
+        "remap_target_codes": target_codes,
+        "remap_target_idx": target_idx.astype(np.int32),
+        "remap_afact": df["afact"].to_numpy(dtype=np.float64),
+    }
+
+
+def _readStateFiles(state_files: list[str]) -> pd.DataFrame:
+    """
+    This function reads the columns of the state eligibility files that are stored in the household arrays.
+    :param state_files: The paths to the files
+    :return: A dataframe with the households of every file
+    """
+
+    columns = ["POVPIP", "has_pap", "has_ssip", "has_hins4", "has_snap", "PUMA_person", "WGTP"] + population_columns
+
+    return pd.concat([pd.read_csv(file, usecols=columns, dtype={"PUMA_person": str}) for file in state_files],
+                     ignore_index=True)
+
+
+def _householdArrays(df: pd.DataFrame) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    This function converts the households of the state files to the household arrays.
+    :param df: The households, from _readStateFiles
+    :return: The PUMA codes, and a dictionary with the names of the arrays as keys and the arrays as values
+    """
+
+    # Integer code the PUMAs
+    puma_codes, puma_idx = np.unique(df["PUMA_person"].str.zfill(7).to_numpy(dtype=str), return_inverse=True)
+
+    programs = np.zeros(len(df), dtype=np.int64)
+    for name, bit in program_bits.items():
+        programs |= (df[name].to_numpy() == 1) * bit
+
+    wgtp = df["WGTP"].to_numpy()
+    populations = np.zeros(len(df), dtype=np.int64)
+    for i, population_name in enumerate(population_columns):
+        values = df[population_name].to_numpy()
+
+        # The population columns are either 0 or the weight of the household, so they can be stored as one bit
+        if not ((values == 0) | (values == wgtp)).all():
+            raise ValueError(f"The {population_name} column is not 0 or the weight of the household")
+
+        populations |= (values != 0) * (1 << i)
+
+    arrays = {
+        "povpip": _checkRange("POVPIP", df["POVPIP"].to_numpy(), array_types["povpip"]),
+        "programs": programs.astype(array_types["programs"]),
+        "wgtp": _checkRange("WGTP", wgtp, array_types["wgtp"]),
+        "puma_idx": _checkRange("PUMA", puma_idx, array_types["puma_idx"]),
+        "populations": populations.astype(array_types["populations"]),
+    }
+
+    return puma_codes, arrays
+
+
+def buildHouseholdArray(data_dir: str, vintage: str = None) -> str:
+    """
+    This function reads the eligibility files of every state, made by everyStateEligibility, and saves every household
+    as small integers in .npy files. The covered population columns are stored as bits, since they are either 0 or the
+    weight of the household. If the state files use the 2010 PUMAs, the remap to the 2020 PUMAs is saved with them.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :return: The path to the household folder
+    """
+
+    state_files = _stateFiles(data_dir, vintage)
+    df = _readStateFiles(state_files)
+    puma_codes, arrays = _householdArrays(df)
+
+    # Build the remap once if the state files use the 2010 PUMAs
+    puma_vintage = 2020
+    if old_puma_code in puma_codes:
+        puma_vintage = 2010
+        arrays.update(_buildRemap(data_dir, puma_codes))
+
+    folder = _householdFolder(data_dir, vintage)
+    os.makedirs(folder, exist_ok=True)
+
+    # Replace the files instead of writing over them, so the arrays that are already memory-mapped stay as they were
+    for name, values in [("puma_codes", puma_codes)] + list(arrays.items()):
+        with open(os.path.join(folder, name + ".npy.part"), "wb") as file:
+            np.save(file, values)
+        os.replace(os.path.join(folder, name + ".npy.part"), os.path.join(folder, name + ".npy"))
+
+    # Save the files the arrays were built from, written last so that it marks a finished build
+    with open(os.path.join(folder, "meta.json"), "w") as file:
+        json.dump({"households": len(df), "puma_vintage": puma_vintage, "state_files": _fileStamps(state_files)},
+                  file)
+
+    return folder
+
+
+def loadHouseholdArray(data_dir: str, vintage: str = None) -> HouseholdArray:
+    """
+    This function loads the household arrays. They are built the first time, or when a state file has changed since
+    they were built, and the arrays are memory-mapped. The arrays are only loaded once, and every later call returns
+    the same HouseholdArray until a state file changes.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :return: The HouseholdArray
+    """
+
+    folder = _householdFolder(data_dir, vintage)
+
+    with _loaded_lock:
+        state_files = _fileStamps(_stateFiles(data_dir, vintage))
+
+        # Only reuse the loaded arrays if no state file has changed since they were loaded
+        if folder in _loaded_households and _loaded_households[folder][0] == state_files:
+            return _loaded_households[folder][1]
+
+        meta_file = os.path.join(folder, "meta.json")
+
+        # Build the arrays if they were never built or if a state file has changed
+        up_to_date = False
+        if os.path.exists(meta_file):
+            with open(meta_file) as file:
+                meta = json.load(file)
+            up_to_date = meta["state_files"] == state_files
+
+        if not up_to_date:
+            buildHouseholdArray(data_dir, vintage)
+            with open(meta_file) as file:
+                meta = json.load(file)
+
+        names = ["puma_codes"] + list(array_types)
+        if meta["puma_vintage"] == 2010:
+            names += remap_arrays
+
+        arrays = {name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="r") for name in names}
+
+        households = HouseholdArray(folder, **arrays)
+        _loaded_households[folder] = (meta["state_files"], households)
+
+        return households
+
+
+def pumaVintage(data_dir: str, vintage: str = None) -> int:
+    """
+    This function finds whether the state files use the 2010 or the 2020 PUMAs. Every state of a PUMS vintage uses the
+    same PUMAs, so it is read from the household arrays if they were built, else from the PUMAs of the state files.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :return: 2010 or 2020
+    """
+
+    meta_file = os.path.join(_householdFolder(data_dir, vintage), "meta.json")
+    if os.path.exists(meta_file):
+        with open(meta_file) as file:
+            return json.load(file)["puma_vintage"]
+
+    for state_file in _stateFiles(data_dir, vintage):
+        pumas = pd.read_csv(state_file, usecols=["PUMA_person"], dtype={"PUMA_person": str})["PUMA_person"]
+        if (pumas.str.zfill(7) == old_puma_code).any():
+            return 2010
+
+    return 2020
+
+
+def stateHouseholdArray(data_dir: str, state: str, vintage: str = None) -> HouseholdArray:
+    """
+    This function creates the household arrays of one state from its eligibility file, in memory, without building
+    the arrays of every state. If the state files use the 2010 PUMAs, the remap of the PUMAs of the state is built with
+    them, so pumaEligibility gives the same rows as the arrays of every state give for the PUMAs of the state.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param state: The folder of the state in the state_data folder, such as "al"
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :return: The HouseholdArray of the state
+    """
+
+    state_files = _stateFiles(data_dir, vintage, [state])
+    if not state_files:
+        raise FileNotFoundError(f"There is no eligibility file for {state}, run everyStateEligibility to create it")
+
+    puma_codes, arrays = _householdArrays(_readStateFiles(state_files))
+
+    if pumaVintage(data_dir, vintage) == 2010:
+        arrays.update(_buildRemap(data_dir, puma_codes))
+
+    return HouseholdArray(os.path.dirname(state_files[0]), puma_codes, **arrays)
+
+
+def stateFileStamps(data_dir: str, vintage: str = None) -> dict[str, dict[str, list[float]]]:
+    """
+    This function gets the modification time and size of the eligibility files of every state, to know which states
+    changed.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :return: A dictionary with the folders of the states as keys, and the stamps of their files from _fileStamps as
+    values
+    """
+
+    state_folder = pumsFolder(data_dir, vintage) + "state_data/"
+    stamps = {}
+
+    for state in sorted(os.listdir(state_folder)):
+        if os.path.isdir(state_folder + state):
+            state_files = _stateFiles(data_dir, vintage, [state])
+            if state_files:
+                stamps[state] = _fileStamps(state_files)
+
+    return stamps
+
+
+def benchmarkEligibility(data_dir: str, povpip: int = 200, population_names: list[str] = None, repeats: int = 5,
+                         vintage: str = None) -> pd.DataFrame:
+    """
+    This function times the eligibility of every PUMA with every criteria used: the pandas path that
+    computePUMAEligibility used before the household arrays, which flags the eligible households with .loc and sums
+    them by PUMA (with a groupby, which is faster than its old loop over the PUMAs), and the kernel of pumaTotals with
+    NumPy, and with numba if it is installed. Every path must give the same totals.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param povpip: The desired income threshold
+    :param population_names: The covered population columns to sum. By default, every covered population
+    :param repeats: The number of times every path is run, the fastest is kept
+    :param vintage: The name of the vintage. If None, the ACS_PUMS folder is used
+    :return: A dataframe with the path, the seconds, and the speedup over pandas
+    """
+
+    households = loadHouseholdArray(data_dir, vintage)
+    population_names = population_columns if population_names is None else population_names
+    number_pumas = len(households.puma_codes)
+    puma_idx = np.asarray(households.puma_idx)
+
+    # The households as the columns of the state files
+    df = pd.DataFrame({"POVPIP": np.asarray(households.povpip), "PUMA_person": puma_idx,
+                       "WGTP": np.asarray(households.wgtp).astype(np.int64)})
+    for name, bit in program_bits.items():
+        df[name] = (np.asarray(households.programs) & bit != 0).astype(np.int64)
+    for population_name in population_names:
+        df[population_name] = households.populationWeights(population_name)
+
+    def pandasTotals() -> np.ndarray:
+        has_pap = has_ssip = has_hins4 = has_snap = 1
+
+        # If the povpip is 0, the income is not used
+        df["acp_eligible"] = 0
+        df.loc[((df["POVPIP"] <= povpip) & (povpip != 0)) | ((df["has_pap"] == 1) & (has_pap == 1)) |
+               ((df["has_ssip"] == 1) & (has_ssip == 1)) | ((df["has_hins4"] == 1) & (has_hins4 == 1)) |
+               ((df["has_snap"] == 1) & (has_snap == 1)), "acp_eligible"] = 1
+
+        eligible = df.loc[df["acp_eligible"] == 1].groupby("PUMA_person")[["WGTP"] + population_names].sum()
+        total = df.groupby("PUMA_person")["WGTP"].sum()
+
+        totals = np.zeros((number_pumas, 2 + len(population_names)), dtype=np.int64)
+        totals[eligible.index, 0] = eligible["WGTP"]
+        totals[total.index, 1] = total
+        for column, population_name in enumerate(sorted(population_names, key=population_columns.index)):
+            totals[eligible.index, 2 + column] = eligible[population_name]
+
+        return totals
+
+    criteria = eligibilityCriteria(povpip, 1, 1, 1, 1, population_names)
+    arrays = (households.povpip, households.programs, households.wgtp, households.puma_idx, households.populations)
+
+    paths = {"pandas": pandasTotals,
+             "numpy": lambda: pumaTotals(*arrays, criteria, number_pumas, compiled=0)}
+    if numba is not None:
+        paths["numba"] = lambda: pumaTotals(*arrays, criteria, number_pumas, compiled=1)
+
+    rows = []
+    expected = None
+    for path, function in paths.items():
+        # The first run is not timed, so numba compiles the kernel first
+        totals = function()
+        if expected is None:
+            expected = totals
+        elif not np.array_equal(totals, expected):
+            raise ValueError(f"The {path} path does not give the same totals as the pandas path")
+
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+
+        rows.append([path, min(seconds)])
+
+    result = pd.DataFrame(rows, columns=["path", "seconds"])
+    result["speedup"] = (result["seconds"].iloc[0] / result["seconds"]).round(1)
+
+    return result
@@ -0,0 +1,179 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from Code.ACS_PUMS.household_array import HouseholdArray, loadHouseholdArray, program_bits
+from Code.Geocorr.crosswalk_registry import allocateTotals, geographyColumn, getCrossWalk
+
+# The largest POVPIP of the PUMS files, which stands for 501 percent or more
+max_povpip = 501
+
+
+def _programMask(has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1, has_snap: int = 1) -> int:
+    """
+    This function gets the bits of the programs that are used, as they are stored in the household arrays.
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :return: The bits of the programs
+    """
+
+    used = {"has_pap": has_pap, "has_ssip": has_ssip, "has_hins4": has_hins4, "has_snap": has_snap}
+
+    return sum(bit for name, bit in program_bits.items() if used[name] == 1)
+
+
+def buildPovpipHistograms(households: HouseholdArray, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1,
+                          has_snap: int = 1) -> np.ndarray:
+    """
+    This function counts the households of every PUMA by POVPIP, weighted by WGTP, separately for the households that
+    are eligible through one of the programs and the households that are not.
+    :param households: The household arrays from loadHouseholdArray
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :return: An array with one row per PUMA of puma_codes, then 0 for the households that are not eligible through a
+    program and 1 for the households that are, then one column for every POVPIP from 0 to 501
+    """
+
+    number_bins = max_povpip + 1
+    number_pumas = len(households.puma_codes)
+
+    categorical = (households.programs & _programMask(has_pap, has_ssip, has_hins4, has_snap)) != 0
+    povpip = np.minimum(households.povpip, max_povpip).astype(np.intp)
+
+    # Count every household in the bin of its PUMA, program eligibility, and POVPIP
+    bins = (households.puma_idx.astype(np.intp) * 2 + categorical) * number_bins + povpip
+    histograms = np.bincount(bins, weights=households.wgtp.astype(np.int64), minlength=number_pumas * 2 * number_bins)
+
+    return histograms.reshape(number_pumas, 2, number_bins).astype(np.int64)
+
+
+def loadPovpipHistograms(data_dir: str, has_pap: int = 1, has_ssip: int = 1, has_hins4: int = 1, has_snap: int = 1,
+                         vintage: str = None) -> np.ndarray:
+    """
+    This function loads the POVPIP histograms of every PUMA for the program criteria. They are built the first time,
+    or when the household arrays were rebuilt, and saved with the household arrays.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :return: The histograms, from buildPovpipHistograms
+    """
+
+    households = loadHouseholdArray(data_dir, vintage)
+
+    histogram_file = os.path.join(households.folder,
+                                  f"povpip_histograms_{_programMask(has_pap, has_ssip, has_hins4, has_snap)}.npy")
+    meta_file = os.path.join(households.folder, "meta.json")
+
+    if not os.path.exists(histogram_file) or os.path.getmtime(histogram_file) < os.path.getmtime(meta_file):
+        histograms = buildPovpipHistograms(households, has_pap, has_ssip, has_hins4, has_snap)
+        np.save(histogram_file + ".part.npy", histograms)
+        os.replace(histogram_file + ".part.npy", histogram_file)
+
+    return np.load(histogram_file, mmap_mode="r")
+
+
+def pumaCurves(histograms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function finds the number of eligible households of every PUMA for every POVPIP threshold, from the
+    cumulative histograms. With a threshold of 0 the income is not used, like in determine_eligibility, so only the
+    households that are eligible through a program are counted.
+    :param histograms: The histograms, from buildPovpipHistograms
+    :return: The number eligible, with one row per PUMA and one column for every threshold from 0 to 501, and the
+    number of households of every PUMA
+    """
+
+    histograms = np.asarray(histograms)
+    categorical = histograms[:, 1, :].sum(axis=1)
+
+    eligible = categorical[:, None] + np.cumsum(histograms[:, 0, :], axis=1)
+    eligible[:, 0] = categorical
+
+    return eligible, histograms.sum(axis=(1, 2))
+
+
+def thresholdCurves(data_dir: str, geography: str = "State", has_pap: int = 1, has_ssip: int = 1,
+                    has_hins4: int = 1, has_snap: int = 1, povpips: list[int] = None, vintage: str = None,
+                    exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function gives the number eligible of every area of a geography for every POVPIP threshold, from the
+    histograms, with one crosswalk of the curves of every PUMA. Every point is the same as the file of
+    determine_eligibility with that povpip, without reading the state files.
+    Example:
+        curves = thresholdCurves(data_dir, "County", povpips=list(range(100, 251)))
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param geography: The geography to aggregate the data by
+    :param has_pap: Whether to use the PAP criteria 0|1
+    :param has_ssip: Whether to use the SSIP criteria 0|1
+    :param has_hins4: Whether to use the HINS4 criteria 0|1
+    :param has_snap: Whether to use the SNAP criteria 0|1
+    :param povpips: The thresholds, which are 0 or more. A threshold above 501 gives the same numbers as 501. By
+    default, every threshold from 0 to 501
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals 0|1
+    :return: A dataframe with the code column, povpip, Num Eligible, Num Ineligible and Percentage Eligible columns,
+    with one row for every area and threshold
+    """
+
+    households = loadHouseholdArray(data_dir, vintage)
+    eligible, total = pumaCurves(loadPovpipHistograms(data_dir, has_pap, has_ssip, has_hins4, has_snap, vintage))
+
+    if povpips is None:
+        povpips = list(range(max_povpip + 1))
+
+    povpips = np.asarray(povpips, dtype=np.int64)
+    if (povpips < 0).any():
+        raise ValueError(f"The povpips must be 0 or more, not {povpips[povpips < 0].tolist()}")
+
+    # The number eligible and ineligible are crosswalked as columns, like in crosswalkPUMAData. Every household is
+    # eligible at a threshold above max_povpip, the largest POVPIP, the same as at max_povpip
+    eligible = eligible[:, np.minimum(povpips, max_povpip)]
+    values = np.concatenate([eligible, total[:, None] - eligible], axis=1)
+    codes = np.asarray(households.puma_codes).astype(str)
+
+    # Remap the 2010 PUMAs to the 2020 PUMAs
+    if households.remap_source_idx is not None:
+        targets, target_idx = np.unique(np.asarray(households.remap_target_idx), return_inverse=True)
+        values = allocateTotals(values, households.remap_source_idx, target_idx, households.remap_afact,
+                                len(targets), exact_allocation)
+        codes = np.asarray(households.remap_target_codes)[targets].astype(str)
+
+    col_name = geographyColumn(geography)
+
+    # Crosswalk the curves of every PUMA to the geography at once
+    if col_name != "puma22":
+        crosswalk = getCrossWalk(data_dir, "puma22", col_name)
+        col_name = crosswalk.target_col
+
+        # The row of every PUMA of the crosswalk, with the PUMA codes written as seven digits
+        positions = {code: i for i, code in enumerate(codes.tolist())}
+        source_positions = np.array([positions.get(code.split(".")[0].zfill(7), -1)
+                                     for code in np.asarray(crosswalk.source_codes).tolist()], dtype=np.intp)
+
+        sources = source_positions[np.asarray(crosswalk.source_idx)]
+        rows = sources >= 0
+        afact = np.round(np.asarray(crosswalk.afact)[rows].astype(np.float64), 6)
+        targets, target_idx = np.unique(np.asarray(crosswalk.target_idx)[rows], return_inverse=True)
+
+        values = allocateTotals(values, sources[rows], target_idx, afact, len(targets), exact_allocation)
+        codes = np.asarray(crosswalk.target_codes)[targets].astype(str)
+
+    number_eligible = values[:, :len(povpips)]
+    number_ineligible = values[:, len(povpips):]
+
+    df = pd.DataFrame({
+        col_name: np.repeat(codes, len(povpips)),
+        "povpip": np.tile(povpips, len(codes)),
+        "Num Eligible": number_eligible.ravel(),
+        "Num Ineligible": number_ineligible.ravel(),
+    })
+    df["Percentage Eligible"] = (df["Num Eligible"] / (df["Num Eligible"] + df["Num Ineligible"]) * 100).round(2)
+
+    return df
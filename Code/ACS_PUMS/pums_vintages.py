@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import shutil
+import urllib.request
+
+from Code.ACS_PUMS.acs_pums import downloadOldPumaNewPumaFile, everyGeographyEligibility, everyStateEligibility
+from Code.ACS_PUMS.household_array import HouseholdArray, loadHouseholdArray, pumsFolder, vintages_folder_name
+
+# The website with the PUMS files of every year
+pums_webpage = "https://www2.census.gov/programs-surveys/acs/data/pums/"
+
+# The folder the downloaded files are stored in by their content, inside the ACS_PUMS folder
+store_folder_name = "store"
+
+
+def vintageName(year: int, period: int = 1) -> str:
+    """
+    This function gets the name of a PUMS vintage, which is also the name of its folder, such as "2022-1Year".
+    :param year: The year of the ACS release, such as 2022
+    :param period: 1 for the 1-year release, 5 for the 5-year release
+    :return: The name of the vintage
+    """
+
+    return f"{year}-{period}Year"
+
+
+def listVintages(data_dir: str) -> list[str]:
+    """
+    This function finds the PUMS vintages that were downloaded.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :return: The names of the vintages, sorted
+    """
+
+    vintages_folder = data_dir + "ACS_PUMS/" + vintages_folder_name + "/"
+
+    if not os.path.exists(vintages_folder):
+        return []
+
+    return sorted(vintage for vintage in os.listdir(vintages_folder) if os.path.isdir(vintages_folder + vintage))
+
+
+def _fileHash(path: str) -> str:
+    """
+    This function computes the sha256 hash of a file, reading it in blocks.
+    :param path: The path to the file
+    :return: The hash, as a hexadecimal string
+    """
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+
+def addToStore(data_dir: str, path: str) -> str:
+    """
+    This function moves a file to the store, where it is saved by its hash, and links it back to its path. If the
+    store already has a file with the same content, such as a state file that did not change between two releases, the
+    new copy is deleted and the path is linked to the stored file, so it is only saved once.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param path: The path to the file
+    :return: The hash of the file
+    """
+
+    store_folder = data_dir + "ACS_PUMS/" + store_folder_name + "/"
+    os.makedirs(store_folder, exist_ok=True)
+
+    file_hash = _fileHash(path)
+    store_path = store_folder + file_hash + os.path.splitext(path)[1]
+
+    if os.path.exists(store_path):
+        os.remove(path)
+    else:
+        os.replace(path, store_path)
+
+    # Link the file to the stored file, or copy it if links are not supported
+    try:
+        os.link(store_path, path)
+    except OSError:
+        shutil.copyfile(store_path, path)
+
+    return file_hash
+
+
+def _manifestFile(data_dir: str, vintage: str) -> str:
+    """
+    This function gets the path to the manifest of a vintage, which has the hash and link of every downloaded file.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage
+    :return: The path to the manifest
+    """
+
+    return pumsFolder(data_dir, vintage) + "manifest.json"
+
+
+def readManifest(data_dir: str, vintage: str) -> dict:
+    """
+    This function reads the manifest of a vintage.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage
+    :return: A dictionary with the year, the period, and the files, which has the paths inside the vintage folder as
+    keys and dictionaries with the hash and link as values
+    """
+
+    manifest_file = _manifestFile(data_dir, vintage)
+
+    if not os.path.exists(manifest_file):
+        return {"files": {}}
+
+    with open(manifest_file) as file:
+        return json.load(file)
+
+
+def downloadPUMSVintage(data_dir: str, year: int, period: int = 1, states: list[str] = None) -> str:
+    """
+    This function downloads the PUMS files of one ACS release, in the same way as downloadPUMSFiles, but into the
+    folder of the vintage instead of the state_data folder. Every file is added to the store, so files with the same
+    content are only saved once, and files that were already downloaded are skipped.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param year: The year of the ACS release, such as 2022
+    :param period: 1 for the 1-year release, 5 for the 5-year release
+    :param states: The state acronyms to download, such as ["ca", "ny"]. By default, every state is downloaded
+    :return: The name of the vintage
+    """
+
+    import requests
+    from bs4 import BeautifulSoup
+
+    vintage = vintageName(year, period)
+    state_data_folder = pumsFolder(data_dir, vintage) + "state_data/"
+    os.makedirs(state_data_folder, exist_ok=True)
+
+    manifest = readManifest(data_dir, vintage)
+    manifest["year"] = year
+    manifest["period"] = period
+
+    release_link = pums_webpage + f"{year}/{period}-Year/"
+
+    # Request the website
+    response = requests.get(release_link)
+    response.raise_for_status()
+
+    # Parse the HTML and find all the links in the table
+    soup = BeautifulSoup(response.text, "html.parser")
+    links = soup.find("table").find_all("a")
+
+    # Download the zip files
+    for link in links:
+        # Do not download the US file, and only download the csv files
+        if "us" in link.text or not link.text.startswith("csv_"):
+            continue
+
+        # Get the state acronym from the file name
+        period_index = link.text.find(".zip")
+        state_acronym = link.text[period_index - 2:period_index]
+
+        if states is not None and state_acronym not in states:
+            continue
+
+        relative_path = state_acronym + "/" + link.text
+        path = state_data_folder + relative_path
+
+        # Skip the files that were already downloaded
+        if relative_path in manifest["files"] and os.path.exists(path):
+            continue
+
+        os.makedirs(state_data_folder + state_acronym, exist_ok=True)
+
+        # Download to a temporary file, so that a failed download does not leave a partial file
+        urllib.request.urlretrieve(release_link + link["href"], path + ".part")
+        os.replace(path + ".part", path)
+
+        manifest["files"][relative_path] = {"sha256": addToStore(data_dir, path), "url": release_link + link["href"]}
+
+        with open(_manifestFile(data_dir, vintage), "w") as file:
+            json.dump(manifest, file, indent=2)
+
+    with open(_manifestFile(data_dir, vintage), "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    return vintage
+
+
+def _needsStateEligibility(data_dir: str, vintage: str) -> bool:
+    """
+    This function checks if the eligibility file of a state of a vintage is missing or older than its zip files.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param vintage: The name of the vintage
+    :return: True if everyStateEligibility needs to run
+    """
+
+    state_data_folder = pumsFolder(data_dir, vintage) + "state_data/"
+
+    for state in os.listdir(state_data_folder):
+        folder = state_data_folder + state + "/"
+        eligibility_file = folder + state + "-eligibility.csv"
+
+        zip_files = [folder + file for file in os.listdir(folder) if file.endswith(".zip")]
+
+        if not os.path.exists(eligibility_file):
+            return True
+
+        if any(os.path.getmtime(zip_file) > os.path.getmtime(eligibility_file) for zip_file in zip_files):
+            return True
+
+    return False
+
+
+def ingestVintage(data_dir: str, vintage: str) -> HouseholdArray:
+    """
+    This function prepares a downloaded vintage for the eligibility. It creates the eligibility file of every state
+    if it is missing or out of date, and loads the household arrays. If the vintage uses the 2010 PUMAs, the remap to
+    the 2020 PUMAs is built once here and saved with the household arrays, so the scenarios do not crosswalk the PUMAs
+    again.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param vintage: The name of the vintage
+    :return: The household arrays of the vintage
+    """
+
+    if _needsStateEligibility(data_dir, vintage):
+        everyStateEligibility(data_dir, vintage)
+
+    try:
+        return loadHouseholdArray(data_dir, vintage)
+    except FileNotFoundError:
+        # The vintage uses the 2010 PUMAs and the equivalency file was never downloaded
+        downloadOldPumaNewPumaFile(data_dir)
+        return loadHouseholdArray(data_dir, vintage)
+
+
+def everyVintageEligibility(data_dir: str, vintages: list[str], geographies: list[str] = None,
+                            **criteria) -> dict[str, dict[str, str]]:
+    """
+    This function will determine eligibility for ACP with the same criteria for several PUMS vintages. Every vintage
+    is ingested once, and the crosswalks to the geographies are loaded once and shared by every vintage. The files are
+    saved in the folder of every vintage. To compare a scenario to the current eligibility of a vintage, run it first
+    with the default criteria.
+    Example:
+        everyVintageEligibility(data_dir, ["2021-1Year", "2022-1Year"], povpip=135, aian=1)
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param vintages: The names of the vintages, from vintageName
+    :param geographies: The geographies to aggregate the data by. By default, every geography in all_geographies
+    :param criteria: The criteria and covered populations, as in everyGeographyEligibility
+    :return: A dictionary with the vintages as keys and the dictionaries from everyGeographyEligibility as values
+    """
+
+    results = {}
+
+    for vintage in vintages:
+        households = ingestVintage(data_dir, vintage)
+        results[vintage] = everyGeographyEligibility(data_dir, geographies=geographies, households=households,
+                                                     vintage=vintage, **criteria)
+
+    return results
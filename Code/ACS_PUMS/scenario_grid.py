@@ -0,0 +1,268 @@
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from Code.ACS_PUMS.acs_pums import (all_geographies, computePUMAEligibility, crosswalkEligibility,
+                                    selectedPopulations)
+from Code.ACS_PUMS.household_array import loadHouseholdArray, pumsFolder
+from Code.Geocorr.crosswalk_registry import geographyColumn, getCrossWalk
+
+# The program criteria of a scenario, in the order of the columns of the grid files
+program_criteria = ["has_pap", "has_ssip", "has_hins4", "has_snap"]
+
+# Every combination of the program criteria, such as (1, 0, 1, 1)
+every_program_combination = list(itertools.product([1, 0], repeat=len(program_criteria)))
+
+# The state of a worker process, set once by _startWorker
+_worker = {}
+
+
+def programCombinations(has_pap: list[int] = None, has_ssip: list[int] = None, has_hins4: list[int] = None,
+                        has_snap: list[int] = None) -> list[tuple[int, int, int, int]]:
+    """
+    This function creates the combinations of the program criteria of a grid. By default, every criteria is both used
+    and not used, which gives the 16 combinations.
+    Example:
+        programCombinations(has_snap=[1])  # The 8 combinations that use SNAP
+    :param has_pap: The values of the PAP criteria 0|1
+    :param has_ssip: The values of the SSIP criteria 0|1
+    :param has_hins4: The values of the HINS4 criteria 0|1
+    :param has_snap: The values of the SNAP criteria 0|1
+    :return: The (has_pap, has_ssip, has_hins4, has_snap) tuples
+    """
+
+    values = [flags if flags is not None else [1, 0] for flags in [has_pap, has_ssip, has_hins4, has_snap]]
+
+    return list(itertools.product(*values))
+
+
+def gridFolder(data_dir: str, output_folder: str = "Scenario_Grid/", vintage: str = None) -> str:
+    """
+    This function gets the folder the files of a grid are saved in.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param output_folder: The name of the folder of the grid, inside the ACS_PUMS folder
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the ACS_PUMS folder is used
+    :return: The path to the folder
+    """
+
+    return pumsFolder(data_dir, vintage) + output_folder
+
+
+def _partitionFile(folder: str, col_name: str, povpip: int) -> str:
+    """
+    This function gets the path to the file of one povpip and one geography of a grid.
+    :param folder: The folder of the grid, from gridFolder
+    :param col_name: The code column of the geography
+    :param povpip: The povpip
+    :return: The path to the file
+    """
+
+    return folder + col_name + f"/povpip_{povpip}.csv"
+
+
+def _startWorker(data_dir: str, col_names: list[str], vintage: str):
+    """
+    This function prepares a worker process. The household arrays and the crosswalks are memory-mapped, so every
+    process reads the same pages, and the crosswalk dictionaries are created once per process instead of once per
+    scenario.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param col_names: The code columns of the geographies
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :return: None
+    """
+
+    _worker["data_dir"] = data_dir
+    _worker["vintage"] = vintage
+    _worker["households"] = loadHouseholdArray(data_dir, vintage)
+    _worker["crosswalks"] = {col_name: getCrossWalk(data_dir, "puma22", col_name).toSourceDict()
+                             for col_name in col_names if col_name != "puma22"}
+    _worker["col_names"] = col_names
+
+
+def _runPartition(povpip: int, combinations: list[tuple[int, int, int, int]], population_names: list[str],
+                  folder: str, exact_allocation: int = 0) -> int:
+    """
+    This function determines the eligibility of every combination of the program criteria for one povpip, and writes
+    one file for every geography. The files are written to a temporary file first, so that a partition that did not
+    finish is never read.
+    :param povpip: The povpip
+    :param combinations: The combinations of the program criteria, from programCombinations
+    :param population_names: The parameters of the covered populations, such as "aian"
+    :param folder: The folder of the grid, from gridFolder
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals 0|1
+    :return: The povpip, once its files are written
+    """
+
+    populations = selectedPopulations({population_var: 1 for population_var in population_names})
+    frames = {col_name: [] for col_name in _worker["col_names"]}
+
+    for combination in combinations:
+        puma_df = computePUMAEligibility(_worker["data_dir"], povpip, *combination, populations=populations,
+                                         households=_worker["households"], vintage=_worker["vintage"],
+                                         exact_allocation=exact_allocation)
+
+        for col_name in _worker["col_names"]:
+            if col_name == "puma22":
+                new_df = puma_df.reset_index(drop=True)
+            else:
+                new_df = crosswalkEligibility(puma_df, _worker["crosswalks"][col_name], col_name, exact_allocation)
+
+            # Add the criteria of the scenario in front of the code column
+            new_df.insert(0, "povpip", povpip)
+            for position, (criteria, value) in enumerate(zip(program_criteria, combination)):
+                new_df.insert(1 + position, criteria, value)
+
+            frames[col_name].append(new_df)
+
+    for col_name, col_frames in frames.items():
+        file_name = _partitionFile(folder, col_name, povpip)
+        pd.concat(col_frames, ignore_index=True).fillna(0).to_csv(file_name + ".part", index=False)
+        os.replace(file_name + ".part", file_name)
+
+    return povpip
+
+
+def _readCheckpoint(checkpoint_file: str, grid: dict) -> list[int]:
+    """
+    This function reads the povpips that are already done from the checkpoint of a grid. The checkpoint can only be
+    used by the same grid, so that the files of two grids are never mixed in one folder.
+    :param checkpoint_file: The path to the checkpoint file
+    :param grid: The description of the grid, without the povpips
+    :return: The povpips that are done
+    """
+
+    if not os.path.exists(checkpoint_file):
+        return []
+
+    with open(checkpoint_file) as file:
+        checkpoint = json.load(file)
+
+    if checkpoint["grid"] != grid:
+        raise ValueError(f"{os.path.dirname(checkpoint_file)} has the files of another grid. Use another output "
+                         f"folder, or delete the folder to start over")
+
+    return checkpoint["done"]
+
+
+def _writeCheckpoint(checkpoint_file: str, grid: dict, done: list[int]):
+    """
+    This function saves the povpips that are done to the checkpoint of a grid.
+    :param checkpoint_file: The path to the checkpoint file
+    :param grid: The description of the grid, without the povpips
+    :param done: The povpips that are done
+    :return: None
+    """
+
+    with open(checkpoint_file + ".part", "w") as file:
+        json.dump({"grid": grid, "done": sorted(done)}, file, indent=2)
+    os.replace(checkpoint_file + ".part", checkpoint_file)
+
+
+def runScenarioGrid(data_dir: str, povpips: list[int], combinations: list[tuple[int, int, int, int]] = None,
+                    geographies: list[str] = None, population_names: list[str] = None,
+                    output_folder: str = "Scenario_Grid/", processes: int = None, vintage: str = None,
+                    progress: int = 1, exact_allocation: int = 0) -> str:
+    """
+    This function determines the eligibility for a grid of scenarios, such as povpip 100 to 250 with the 16
+    combinations of the program criteria for 6 geographies, with a pool of processes. The grid is split by povpip, and
+    every process computes every combination of one povpip at a time, so the processes stay busy until the last
+    povpips. The household arrays and the crosswalks are memory-mapped, so the processes share one copy of them.
+    The files are saved with one folder for every geography and one file for every povpip, such as
+    Scenario_Grid/county/povpip_135.csv, with the povpip and the program criteria as the first columns. A checkpoint
+    is saved after every povpip, so a grid that was stopped continues from the povpips that are not done. The
+    current eligibility columns, the rural and CountyName columns, and the standard errors are not added.
+    Example:
+        runScenarioGrid(data_dir, list(range(100, 251)), geographies=["State", "County"])
+    :param data_dir: The path to the data directory which contains the ACS_PUMS and GeoCorr folders
+    :param povpips: The povpips of the grid
+    :param combinations: The combinations of the program criteria, from programCombinations. By default, all 16
+    :param geographies: The geographies to aggregate the data by. By default, every geography in all_geographies
+    :param population_names: The covered populations to add, such as ["aian", "veteran"]
+    :param output_folder: The name of the folder of the grid, inside the ACS_PUMS folder
+    :param processes: The number of processes. By default, the number of CPUs
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the most recent files are used
+    :param progress: Whether to print the progress after every povpip 0|1
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals 0|1
+    :return: The path to the folder of the grid
+    """
+
+    if combinations is None:
+        combinations = every_program_combination
+
+    if geographies is None:
+        geographies = all_geographies
+
+    if population_names is None:
+        population_names = []
+
+    # Load the household arrays and the crosswalks once here, so they are built or compiled before the processes
+    # start and every process only has to memory-map them
+    loadHouseholdArray(data_dir, vintage)
+    col_names = []
+    for geography in geographies:
+        col_name = geographyColumn(geography)
+        if col_name != "puma22":
+            col_name = getCrossWalk(data_dir, "puma22", col_name).target_col
+        col_names.append(col_name)
+
+    folder = gridFolder(data_dir, output_folder, vintage)
+    for col_name in col_names:
+        os.makedirs(folder + col_name, exist_ok=True)
+
+    # Find the povpips that are already done
+    grid = {"combinations": [list(combination) for combination in combinations], "geographies": col_names,
+            "populations": population_names, "vintage": vintage, "exact_allocation": exact_allocation}
+    checkpoint_file = folder + "checkpoint.json"
+    done = _readCheckpoint(checkpoint_file, grid)
+    todo = [povpip for povpip in dict.fromkeys(povpips) if povpip not in done]
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_startWorker,
+                             initargs=(data_dir, col_names, vintage)) as executor:
+        futures = [executor.submit(_runPartition, povpip, combinations, population_names, folder, exact_allocation)
+                   for povpip in todo]
+
+        for number, future in enumerate(as_completed(futures), start=1):
+            done.append(future.result())
+            _writeCheckpoint(checkpoint_file, grid, done)
+
+            if progress == 1:
+                elapsed = time.time() - start
+                remaining = elapsed / number * (len(todo) - number)
+                print(f"Scenario grid: {number}/{len(todo)} povpips done, {elapsed:.0f}s elapsed, about "
+                      f"{remaining:.0f}s left")
+
+    return folder
+
+
+def readScenarioGrid(data_dir: str, geography: str, output_folder: str = "Scenario_Grid/", povpips: list[int] = None,
+                     vintage: str = None) -> pd.DataFrame:
+    """
+    This function reads the files of one geography of a grid into one dataframe.
+    :param data_dir: The path to the data directory which contains the ACS_PUMS folder
+    :param geography: The geography, as it is written in the GeoCorr Application or its code column
+    :param output_folder: The name of the folder of the grid, inside the ACS_PUMS folder
+    :param povpips: The povpips to read. By default, every povpip that is done
+    :param vintage: The name of the PUMS vintage, from vintageName. If None, the ACS_PUMS folder is used
+    :return: A dataframe with the povpip, program criteria, code, and eligibility columns
+    """
+
+    folder = gridFolder(data_dir, output_folder, vintage)
+
+    with open(folder + "checkpoint.json") as file:
+        checkpoint = json.load(file)
+
+    # Find the code column the grid was saved with
+    col_name = geographyColumn(geography)
+    col_name = next((name for name in checkpoint["grid"]["geographies"] if name.startswith(col_name)), col_name)
+
+    if povpips is None:
+        povpips = checkpoint["done"]
+
+    frames = [pd.read_csv(_partitionFile(folder, col_name, povpip), dtype={col_name: str}) for povpip in povpips]
+
+    return pd.concat(frames, ignore_index=True)
@@ -1,15 +1,32 @@
 import os
+import re
+import shutil
+import tempfile
 import time
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin
 
+import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
+
+# requests, bs4, and selenium are imported by the functions that download files, so the rest of the module can be
+# used without them
+if TYPE_CHECKING:
+    import requests
+
+# numpy's string operations, which are ufuncs in numpy 2
+_strings = np.strings if hasattr(np, "strings") else np.char
+
+# List of states
+geocorr_states = ["Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut", "Delaware",
+                  "District of Columbia", "Florida", "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa",
+                  "Kansas", "Kentucky", "Louisiana", "Maine", "Maryland", "Massachusetts", "Michigan", "Minnesota",
+                  "Mississippi", "Montana", "Nebraska", "Nevada", "New Hampshire", "New Jersey",
+                  "New Mexico", "New York", "North Carolina", "North Dakota", "Ohio", "Oklahoma", "Oregon",
+                  "Pennsylvania", "Puerto Rico", "Rhode Island", "South Carolina", "South Dakota", "Tennessee", "Texas",
+                  "Utah", "Vermont", "Virginia", "Washington", "West Virginia", "Wisconsin", "Wyoming"]
 
 
 def getMostRecentGeoCorrApplication(data_directory: str, link_year: int = 0) -> str:
@@ -22,6 +39,9 @@ def getMostRecentGeoCorrApplication(data_directory: str, link_year: int = 0) ->
     :return: The link to the most recent GeoCorr Application
     """
 
+    import requests
+    from bs4 import BeautifulSoup
+
     directory = data_directory + "GeoCorr"
 
     # Create directory for downloads
@@ -70,6 +90,12 @@ def downloadCrossWalkFile(weblink: str, data_directory: str, source_geography: s
     :return: The path to the crosswalk file and the name of the source geography column
     """
 
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     options = ["state", "county", "county subdivision (township, mcd)",
                "place (city, town, village, cdp, etc.)", "census tract", "census block group", "census block",
                "zip/zcta", "public-use microdata area (puma)", "core-based statistical area (cbsa)",
@@ -101,15 +127,6 @@ def downloadCrossWalkFile(weblink: str, data_directory: str, source_geography: s
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    # List of states
-    states = ["Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut", "Delaware",
-              "District of Columbia", "Florida", "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa",
-              "Kansas", "Kentucky", "Louisiana", "Maine", "Maryland", "Massachusetts", "Michigan", "Minnesota",
-              "Mississippi", "Montana", "Nebraska", "Nevada", "New Hampshire", "New Jersey",
-              "New Mexico", "New York", "North Carolina", "North Dakota", "Ohio", "Oklahoma", "Oregon",
-              "Pennsylvania", "Puerto Rico", "Rhode Island", "South Carolina", "South Dakota", "Tennessee", "Texas",
-              "Utah", "Vermont", "Virginia", "Washington", "West Virginia", "Wisconsin", "Wyoming"]
-
     # download the chrome driver from                     https://chromedriver.chromium.org/downloads
 
     # Open the Chrome browser
@@ -137,7 +154,7 @@ def downloadCrossWalkFile(weblink: str, data_directory: str, source_geography: s
 
         # To set the state(s)
         if state_name == "0":
-            if option.text in states:
+            if option.text in geocorr_states:
                 option.click()
         else:
             # Click the state_name and unclick the auto-selected Missouri
@@ -183,6 +200,34 @@ def downloadCrossWalkFile(weblink: str, data_directory: str, source_geography: s
     # Find the link to download the file
     download_link = driver.find_element(By.TAG_NAME, "a")
 
+    # Final file path
+    file_path = crossWalkFilePath(weblink, directory, source_geography, target_geography, state_name)
+
+    # Download the file to the current directory
+    urllib.request.urlretrieve(download_link.get_attribute("href"), file_path)
+
+    # Close the browser
+    driver.quit()
+
+    # Clean the crosswalk file
+    file_path, source_col = cleanCrossWalkFile(file_path, sourceColumnName(source_geography))
+
+    return file_path, source_col
+
+
+def crossWalkFilePath(weblink: str, directory: str, source_geography: str, target_geography: str,
+                      state_name: str = "0") -> str:
+    """
+    This function creates the path that a crosswalk file is saved to, such as
+    United_States_Public-Use-Microdata-Area-(Puma)_to_County.csv
+    :param weblink: The link to the GeoCorr Application
+    :param directory: The folder of the source geography
+    :param source_geography: The source geography
+    :param target_geography: The target geography
+    :param state_name: The name of the state, or "0" for all the states
+    :return: The path to the crosswalk file
+    """
+
     # Rename source and target geographies
     source_geography = source_geography.replace("/", "-").title()
     source_geography = source_geography.replace(" ", "-").title()
@@ -200,106 +245,361 @@ def downloadCrossWalkFile(weblink: str, data_directory: str, source_geography: s
     # File name
     file_name = state_name + "_" + source_geography + "_to_" + target_geography + ".csv"
 
-    # Final file path
-    file_path = directory + "/" + file_name
+    return directory + "/" + file_name
 
-    # Download the file to the current directory
-    urllib.request.urlretrieve(download_link.get_attribute("href"), file_path)
 
-    # Close the browser
-    driver.quit()
+def sourceColumnName(source_geography: str) -> str:
+    """
+    This function gets the name of the source geography column in the crosswalk file, which is used by
+    cleanCrossWalkFile to find the full column name.
+    :param source_geography: The source geography as it is written in the GeoCorr Application
+    :return: The name of the source geography column
+    """
+
+    # Rename the source geography the same way as the file name
+    source_geography = source_geography.replace("/", "-").title()
+    source_geography = source_geography.replace(" ", "-").title()
 
     source_col = ""
     if source_geography == "Zip-Zcta":
         source_col = "zcta"
-    elif source_geography == "Census Tract":
+    elif source_geography == "Census-Tract":
         source_col = "tract"
+    elif source_geography == "Census-Block-Group":
+        source_col = "bg"
     elif source_geography == "County":
         source_col = "county"
-    elif source_geography == "Metropolitan Division":
+    elif source_geography == "Metropolitan-Division":
         source_col = "metdiv"
     elif source_geography == "Public-Use-Microdata-Area-(Puma)":
         source_col = "puma"
-    elif source_geography == "118Th Congress (2023-2024)":
+    elif source_geography == "118Th-Congress-(2023-2024)":
         source_col = "cd"
-    elif source_geography == "Unified School District":
+    elif source_geography == "Unified-School-District":
         source_col = "sduni"
 
+    return source_col
+
+
+def parseGeoCorrForm(weblink: str, session: "requests.Session" = None) -> dict:
+    """
+    This function reads the form of the GeoCorr Application, so that it can be submitted without a browser. It finds
+    the url the form is submitted to, the default value of every field, and the options of the state, source
+    geography, and target geography lists.
+    :param weblink: The link to the GeoCorr Application
+    :param session: Optionally, the requests session to use
+    :return: A dictionary with the action url, the default fields as a list of (name, value) tuples, and the names and
+    options of the state, source, and target lists. The options are dictionaries of {option text: option value}. If the
+    page does not have the form, or the form does not have the state, source, and target lists, a ValueError is raised
+    """
+
+    import requests
+    from bs4 import BeautifulSoup
+
+    if session is None:
+        session = requests.Session()
+
+    # Request the application
+    response = session.get(weblink)
+    response.raise_for_status()
+
+    # Parse the application
+    soup = BeautifulSoup(response.text, "html.parser")
+    form = soup.find("form")
+
+    if form is None:
+        raise ValueError(f"{weblink} does not have a form, so it is not a GeoCorr Application")
+
+    # The default value of every field, as the browser would submit them
+    fields = []
+    for tag in form.find_all("input"):
+        name = tag.get("name")
+        input_type = tag.get("type", "text").lower()
+
+        if name is None or input_type in ["submit", "reset", "button", "image"]:
+            continue
+        if input_type in ["checkbox", "radio"] and not tag.has_attr("checked"):
+            continue
+
+        fields.append((name, tag.get("value", "on" if input_type in ["checkbox", "radio"] else "")))
+
+    state_select = None
+    geography_selects = []
+
+    for select in form.find_all("select"):
+        options = {option.text.strip(): option.get("value", option.text.strip()) for option in select.find_all("option")}
+
+        # The state list contains the state names, and the source and target lists contain the geographies
+        if "Alabama" in options:
+            state_select = (select.get("name"), options)
+        elif any(text.lower() == "county" for text in options):
+            geography_selects.append((select.get("name"), options))
+        else:
+            # Keep the selected options of every other list
+            for option in select.find_all("option"):
+                if option.has_attr("selected"):
+                    fields.append((select.get("name"), option.get("value", option.text.strip())))
+
+    # The layout of the form has changed if the lists are not found
+    if state_select is None:
+        raise ValueError(f"The form of {weblink} does not have a list of the states")
+    if len(geography_selects) != 2:
+        raise ValueError(f"The form of {weblink} has {len(geography_selects)} lists of geographies instead of a source "
+                         f"and a target list")
+
+    return {
+        "action": urljoin(weblink, form.get("action", weblink)),
+        "method": form.get("method", "get").lower(),
+        "fields": fields,
+        "state": state_select,
+        "source": geography_selects[0],
+        "target": geography_selects[1],
+    }
+
+
+def _optionValue(options: dict, text: str) -> str:
+    """
+    This function finds the value of an option by its text, ignoring the case.
+    :param options: A dictionary of {option text: option value}
+    :param text: The text of the option
+    :return: The value of the option
+    """
+
+    for option_text, value in options.items():
+        if option_text.lower() == text.lower():
+            return value
+
+    raise ValueError(f"{text} is not an option of the GeoCorr Application")
+
+
+def fetchCrossWalkFile(weblink: str, data_directory: str, source_geography: str, target_geography: str,
+                       state_name: str = "0", form: dict = None, session: "requests.Session" = None) -> tuple[str, str]:
+    """
+    This function downloads the crosswalk file for the specified source and target geographies by submitting the
+    GeoCorr Application form directly, without a browser. Downloads are cached by application, source geography,
+    target geography, and state, so the same crosswalk is only requested once. The file is then cleaned by calling the
+    cleanCrossWalkFile function, the same as downloadCrossWalkFile.
+    :param weblink: The link to the GeoCorr Application
+    :param data_directory: The path to the data directory
+    :param source_geography: The source geography
+    :param target_geography: The target geography
+    :param state_name: The name of the state in case the user wants to download the crosswalk file for a specific state
+    :param form: Optionally, the form returned by parseGeoCorrForm, so it is only read once for many downloads
+    :param session: Optionally, the requests session to use
+    :return: The path to the crosswalk file and the name of the source geography column
+    """
+
+    import requests
+    from bs4 import BeautifulSoup
+
+    if session is None:
+        session = requests.Session()
+
+    directory = data_directory + "GeoCorr/" + source_geography.replace("/", "_")
+    os.makedirs(directory, exist_ok=True)
+
+    # The cache is keyed by the application version, source, target, and state
+    application = os.path.splitext(weblink.rstrip("/").split("/")[-1])[0]
+    cache_folder = data_directory + "GeoCorr/.cache/" + application + "/"
+    os.makedirs(cache_folder, exist_ok=True)
+
+    cache_name = "_".join(re.sub(r"[^A-Za-z0-9]+", "-", name).strip("-").lower()
+                          for name in [source_geography, target_geography, state_name]) + ".csv"
+    cache_file = cache_folder + cache_name
+
+    # Final file path
+    file_path = crossWalkFilePath(weblink, directory, source_geography, target_geography, state_name)
+
+    if not os.path.exists(cache_file):
+        if form is None:
+            form = parseGeoCorrForm(weblink, session)
+
+        state_field, state_options = form["state"]
+        source_field, source_options = form["source"]
+        target_field, target_options = form["target"]
+
+        # Replace the default states and geographies with the ones requested
+        params = [(name, value) for name, value in form["fields"]
+                  if name not in [state_field, source_field, target_field]]
+
+        if state_name == "0":
+            # Every state, DC, and Puerto Rico
+            params += [(state_field, _optionValue(state_options, state)) for state in geocorr_states + ["Missouri"]]
+        else:
+            params.append((state_field, _optionValue(state_options, state_name)))
+
+        params.append((source_field, _optionValue(source_options, source_geography)))
+        params.append((target_field, _optionValue(target_options, target_geography)))
+
+        # Submit the form
+        if form["method"] == "post":
+            response = session.post(form["action"], data=params)
+        else:
+            response = session.get(form["action"], params=params)
+        response.raise_for_status()
+
+        # Find the link to download the file in the query output
+        soup = BeautifulSoup(response.text, "html.parser")
+        links = soup.find_all("a", href=True)
+        csv_links = [link for link in links if link["href"].endswith(".csv")]
+
+        if len(csv_links or links) == 0:
+            raise ValueError(f"The query output of {source_geography} to {target_geography} does not have a link to "
+                             f"the crosswalk file")
+
+        download_link = urljoin(response.url, (csv_links or links)[0]["href"])
+
+        # Download the file to the cache, writing it to a temporary file first so that a partial download is never
+        # used. Every download has its own temporary file, so two downloads of the same file never write to one file
+        response = session.get(download_link)
+        response.raise_for_status()
+
+        handle, temp_file = tempfile.mkstemp(dir=cache_folder, prefix=cache_name + ".", suffix=".part")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                file.write(response.content)
+            os.replace(temp_file, cache_file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    # Copy the cached file, since cleanCrossWalkFile overwrites the file
+    shutil.copyfile(cache_file, file_path)
+
     # Clean the crosswalk file
-    file_path, source_col = cleanCrossWalkFile(file_path, source_col)
+    return cleanCrossWalkFile(file_path, sourceColumnName(source_geography))
 
-    return file_path, source_col
 
+def fetchCrossWalkFiles(weblink: str, data_directory: str, geography_pairs: list[tuple[str, str]],
+                        state_name: str = "0", max_workers: int = 4) -> dict[tuple[str, str], tuple[str, str]]:
+    """
+    This function downloads several crosswalk files at the same time with fetchCrossWalkFile. The GeoCorr Application
+    form is only read once, and a pair that is given more than once is only downloaded once, so two threads never write
+    the same file.
+    :param weblink: The link to the GeoCorr Application
+    :param data_directory: The path to the data directory
+    :param geography_pairs: A list of (source geography, target geography) tuples
+    :param state_name: The name of the state in case the user wants to download the crosswalk files for a specific
+    state
+    :param max_workers: The number of files to download at the same time
+    :return: A dictionary with the (source geography, target geography) tuples as keys, and the path to the crosswalk
+    file and the name of the source geography column as values
+    """
+
+    import requests
+
+    form = parseGeoCorrForm(weblink)
+
+    def fetch(pair: tuple[str, str]) -> tuple[str, str]:
+        # Every thread uses its own session
+        with requests.Session() as session:
+            return fetchCrossWalkFile(weblink, data_directory, pair[0], pair[1], state_name, form, session)
+
+    # Remove the duplicate pairs, keeping their order
+    unique_pairs = list(dict.fromkeys(tuple(pair) for pair in geography_pairs))
 
-def cleanCrossWalkFile(file_name: str, source_col: str) -> tuple[str, str]:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(fetch, unique_pairs))
+
+    return dict(zip(unique_pairs, results))
+
+
+def _zfill(values: pd.Series, width: int) -> pd.Series:
     """
-    This function cleans the crosswalk file. This is necessary because the crosswalk files have an extra row at the top
-    :param file_name: The name of the crosswalk file
-    :param source_col: The name of the source geography column
-    :return: The name of the crosswalk file and the name of the source geography column
+    This function pads codes with zeros on the left, using numpy's fixed-width string operations on the whole column
+    at once.
+    :param values: The column with the codes
+    :param width: The width of the codes
+    :return: The padded codes
     """
 
-    df = pd.read_csv(file_name, encoding="ISO-8859-1", dtype=str, skiprows=[1])
+    # numpy's string operations do not take empty arrays
+    if len(values) == 0:
+        return values
 
-    columns = df.columns.tolist()
+    return pd.Series(_strings.zfill(values.to_numpy(dtype=str), width), index=values.index)
 
-    for column in columns:
-        if source_col.lower() in column.lower():
-            source_col = column
-            break
+
+def _concat(first: pd.Series, second: pd.Series) -> pd.Series:
+    """
+    This function concatenates two columns of codes, such as the state code and the puma code.
+    :param first: The column that goes first
+    :param second: The column that goes second
+    :return: The concatenated codes
+    """
+
+    if len(first) == 0:
+        return first
+
+    return pd.Series(_strings.add(first.to_numpy(dtype=str), second.to_numpy(dtype=str)), index=first.index)
+
+
+def _cleanCrossWalkChunk(df: pd.DataFrame, file_name: str, source_col: str) -> pd.DataFrame:
+    """
+    This function applies the cleaning rules of cleanCrossWalkFile to one chunk of the crosswalk file.
+    :param df: The chunk of the crosswalk file, read as strings
+    :param file_name: The name of the crosswalk file
+    :param source_col: The name of the source geography column
+    :return: The cleaned chunk
+    """
 
     # Standardize 'zcta' column
     if 'zcta' in df:
-        df['zcta'] = df['zcta'].astype(str).str.zfill(5)
+        df['zcta'] = _zfill(df['zcta'], 5)
 
     # Standardize 'state' column
     if 'state' in df:
-        df['state'] = df['state'].astype(str).str.zfill(2)
+        df['state'] = _zfill(df['state'], 2)
 
     # Standardize 'puma' column
     if 'puma' in source_col:
-        print(source_col)
-        df[source_col] = df[source_col].astype(str).str.zfill(5)
-        df[source_col] = df['state'] + df[source_col]
+        df[source_col] = _zfill(df[source_col], 5)
+        df[source_col] = _concat(df['state'], df[source_col])
 
     # Standardize 'sduni20' column (Unified School District)
     if 'sduni20' in df:
-        df['sduni20'] = df['sduni20'].astype(str).str.zfill(5)
-        df['state'] = df['state'].astype(str).str.zfill(2)
-        df['sduni20'] = df['state'] + df['sduni20']
+        df['sduni20'] = _zfill(df['sduni20'], 5)
+        df['state'] = _zfill(df['state'], 2)
+        df['sduni20'] = _concat(df['state'], df['sduni20'])
         df = df.drop(columns=['state'])
 
     # Standardize 'metdiv20' column (Metropolitan Division)
     if 'metdiv20' in df:
-        df['metdiv20'] = df['metdiv20'].astype(str).str.zfill(5)
+        df['metdiv20'] = _zfill(df['metdiv20'], 5)
         df = df[df['metdiv20'] != '99999']
 
     # Standardize 'county' column
     if 'county' in df:
-        df['county'] = df['county'].astype(str).str.zfill(5)
+        df['county'] = _zfill(df['county'], 5)
 
     # Standardize 'tract' column (Census Tract)
     if 'tract' in df:
-        df['tract'] = df['tract'].astype(str).str.replace(".", "", regex=False)
-        df['tract'] = df['tract'].str.pad(width=6, side='right', fillchar='0')
-        df['county'] = df['county'].astype(str).str.zfill(5)
-        df['tract'] = df['county'] + df['tract']
+        tract = _strings.replace(df['tract'].to_numpy(dtype=str), ".", "")
+        df['tract'] = pd.Series(_strings.ljust(tract, 6, '0'), index=df.index)
+        df['county'] = _zfill(df['county'], 5)
+        df['tract'] = _concat(df['county'], df['tract'])
         df = df.drop(columns=['county'])
+
+        # Standardize 'bg' column (Census Block Group), which is the tract code followed by the block group digit
+        if 'bg' in df:
+            df['bg'] = _concat(df['tract'], _zfill(df['bg'], 1))
+
         if '2018' in file_name:
             df = df.rename(columns={"tract": "tract10"})
 
     # Standardize 'cd118' column (118th Congress)
     if 'cd118' in df:
-        df['cd118'] = df['cd118'].astype(str).str.zfill(2)
-        df['state'] = df['state'].astype(str).str.zfill(2)
-        df['cd118'] = df['state'] + df['cd118']
+        df['cd118'] = _zfill(df['cd118'], 2)
+        df['state'] = _zfill(df['state'], 2)
+        df['cd118'] = _concat(df['state'], df['cd118'])
         df = df.drop(columns=['state'])
 
     # Standardize 'puma22' column (Public-Use Microdata Area)
     if 'puma22' in df:
-        df['puma22'] = df['puma22'].astype(str).str.zfill(5)
-        df['state'] = df['state'].astype(str).str.zfill(2)
-        df['puma22'] = df['state'] + df['puma22']
+        df['puma22'] = _zfill(df['puma22'], 5)
+        df['state'] = _zfill(df['state'], 2)
+        df['puma22'] = _concat(df['state'], df['puma22'])
 
         # Drop the state column if it is not the source or target geography
         temp_name = file_name.split("States")[1]
@@ -310,7 +610,48 @@ def cleanCrossWalkFile(file_name: str, source_col: str) -> tuple[str, str]:
     # Drop rows with '00000' in the source column (e.g., zip code)
     df = df[df[source_col] != "00000"]
 
+    return df
+
+
+def cleanCrossWalkFile(file_name: str, source_col: str, chunk_size: int = 250000) -> tuple[str, str]:
+    """
+    This function cleans the crosswalk file. This is necessary because the crosswalk files have an extra row at the top.
+    The file is read and cleaned in chunks, and every cleaned chunk is written as soon as it is ready, so that large
+    tract and block group crosswalk files do not have to fit in memory.
+    :param file_name: The name of the crosswalk file
+    :param source_col: The name of the source geography column
+    :param chunk_size: The number of rows to clean at a time
+    :return: The name of the crosswalk file and the name of the source geography column
+    """
+
+    # Read the column names. An empty file has none
+    try:
+        columns = pd.read_csv(file_name, encoding="ISO-8859-1", nrows=0).columns.tolist()
+    except pd.errors.EmptyDataError:
+        columns = []
+
+    for column in columns:
+        if source_col.lower() in column.lower():
+            source_col = column
+            break
+
+    # Write the cleaned chunks to a temporary file, which then replaces the crosswalk file. The header is written up
+    # front, from an empty chunk, so a file without rows is still saved with the columns of a cleaned file
+    temp_file = file_name + ".part"
+    if len(columns) == 0:
+        open(temp_file, "w").close()
+        chunks = []
+    else:
+        empty_df = pd.DataFrame({column: pd.Series(dtype=str) for column in columns})
+        _cleanCrossWalkChunk(empty_df, file_name, source_col).to_csv(temp_file, index=False)
+        chunks = pd.read_csv(file_name, encoding="ISO-8859-1", dtype=str, skiprows=[1], chunksize=chunk_size)
+
+    for df in chunks:
+        df = _cleanCrossWalkChunk(df, file_name, source_col)
+
+        df.to_csv(temp_file, mode="a", header=False, index=False)
+
     # Save the cleaned file
-    df.to_csv(file_name, index=False)
+    os.replace(temp_file, file_name)
 
     return file_name, source_col
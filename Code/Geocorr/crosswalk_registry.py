@@ -0,0 +1,533 @@
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+# The code column of every geography, as it is written in the GeoCorr Application
+geography_columns = {
+    "Public-use microdata area (PUMA)": "puma22",
+    "puma (2012)": "puma12",
+    "118th Congress (2023-2024)": "cd118",
+    "State": "state",
+    "County": "county",
+    "ZIP/ZCTA": "zcta",
+    "Unified school district": "sduni20",
+    "Metropolitan division": "metdiv20",
+}
+
+# The folder the compiled crosswalks are saved to, inside the GeoCorr folder
+compiled_folder_name = ".compiled"
+
+# The compiled arrays of a crosswalk. The rows are stored once, and the index is stored in both directions in the CSR
+# form: the rows sorted by source or target code, and the offset where the rows of every code start
+compiled_arrays = ["source_codes", "target_codes", "source_idx", "target_idx", "afact", "source_offsets", "source_rows",
+                   "target_offsets", "target_rows"]
+
+# The crosswalks that were already loaded, shared by every consumer, with the modification time and size of the csv
+# file they were loaded from. The keys are the paths to the csv files
+_loaded_crosswalks = {}
+_loaded_lock = threading.Lock()
+
+# The columns of every crosswalk file, by the path, modification time and size of the file
+_file_columns = {}
+
+
+def buildIndex(idx: np.ndarray, number_codes: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function builds one direction of the index of a crosswalk in the CSR form. The rows of code i are
+    rows[offsets[i]:offsets[i + 1]], in the order of the file.
+    :param idx: The source_idx or target_idx of the rows
+    :param number_codes: The number of source or target codes
+    :return: The offsets, with one more value than the number of codes, and the rows sorted by code
+    """
+
+    idx = np.asarray(idx)
+    rows = np.argsort(idx, kind="stable")
+    offsets = np.searchsorted(idx[rows], np.arange(number_codes + 1))
+
+    return offsets.astype(np.int64), rows.astype(np.int32)
+
+
+class CrossWalk:
+    """
+    A crosswalk from a source geography to a target geography. The source and target codes are stored once, in sorted
+    arrays, and every row of the crosswalk is stored as the integer index of its source code, the integer index of its
+    target code, and its allocation factor. The rows of every source code and of every target code are indexed in the
+    CSR form, so both "which targets does this source feed" and "which sources feed this target" are found without a
+    scan. The arrays are memory-mapped from the compiled files, so every process that loads the same crosswalk shares
+    one copy.
+    """
+
+    def __init__(self, file_path: str, source_col: str, target_col: str, source_codes: np.ndarray,
+                 target_codes: np.ndarray, source_idx: np.ndarray, target_idx: np.ndarray, afact: np.ndarray,
+                 source_offsets: np.ndarray = None, source_rows: np.ndarray = None, target_offsets: np.ndarray = None,
+                 target_rows: np.ndarray = None):
+        self.file_path = file_path
+        self.source_col = source_col
+        self.target_col = target_col
+        self.source_codes = source_codes
+        self.target_codes = target_codes
+        self.source_idx = source_idx
+        self.target_idx = target_idx
+        self.afact = afact
+
+        # Build the index if it was not compiled
+        if source_offsets is None or source_rows is None:
+            source_offsets, source_rows = buildIndex(source_idx, len(source_codes))
+        if target_offsets is None or target_rows is None:
+            target_offsets, target_rows = buildIndex(target_idx, len(target_codes))
+
+        self.source_offsets = source_offsets
+        self.source_rows = source_rows
+        self.target_offsets = target_offsets
+        self.target_rows = target_rows
+
+    def __len__(self):
+        return len(self.afact)
+
+    def __repr__(self):
+        return f"CrossWalk({self.source_col} -> {self.target_col}, {len(self)} rows)"
+
+    @staticmethod
+    def _indexRows(codes: np.ndarray, offsets: np.ndarray, rows: np.ndarray, wanted: list[str] = None) -> np.ndarray:
+        """
+        This function finds the rows of some codes in one direction of the index.
+        :param codes: The sorted source or target codes
+        :param offsets: The offsets of that direction of the index
+        :param rows: The rows of that direction of the index
+        :param wanted: The codes to find. Codes that are not in the crosswalk are skipped. By default, every code
+        :return: The rows, grouped by code in the order of the sorted codes, and in the order of the file within every
+        code
+        """
+
+        if wanted is None:
+            return np.asarray(rows, dtype=np.intp)
+
+        # The index of every code in the sorted codes
+        wanted = np.unique(np.asarray(wanted, dtype=str))
+        codes = np.asarray(codes)
+        positions = np.searchsorted(codes, wanted)
+        positions = positions[(positions < len(codes)) & (codes[np.minimum(positions, len(codes) - 1)] == wanted)]
+
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.intp)
+
+        return np.concatenate([np.asarray(rows[offsets[position]:offsets[position + 1]], dtype=np.intp)
+                               for position in positions])
+
+    def targetRows(self, target_codes: list[str] = None) -> np.ndarray:
+        """
+        This function finds the rows of the crosswalk of some targets with the target index.
+        :param target_codes: The target codes. Codes that are not in the crosswalk are skipped. By default, every target
+        :return: The rows, grouped by target in the order of the sorted target codes, and in the order of the file
+        within every target
+        """
+
+        return self._indexRows(self.target_codes, self.target_offsets, self.target_rows, target_codes)
+
+    def sourceRows(self, source_codes: list[str] = None) -> np.ndarray:
+        """
+        This function finds the rows of the crosswalk of some sources with the source index.
+        :param source_codes: The source codes. Codes that are not in the crosswalk are skipped. By default, every source
+        :return: The rows, grouped by source in the order of the sorted source codes, and in the order of the file
+        within every source
+        """
+
+        return self._indexRows(self.source_codes, self.source_offsets, self.source_rows, source_codes)
+
+    def sourcesOf(self, target_codes: list[str]) -> np.ndarray:
+        """
+        This function finds the sources that feed some targets, such as the PUMAs of a county.
+        :param target_codes: The target codes
+        :return: The sorted source codes
+        """
+
+        return np.asarray(self.source_codes)[np.unique(np.asarray(self.source_idx)[self.targetRows(target_codes)])]
+
+    def targetsOf(self, source_codes: list[str]) -> np.ndarray:
+        """
+        This function finds the targets that some sources feed, such as the counties a PUMA is in.
+        :param source_codes: The source codes
+        :return: The sorted target codes
+        """
+
+        return np.asarray(self.target_codes)[np.unique(np.asarray(self.target_idx)[self.sourceRows(source_codes)])]
+
+    def toSourceDict(self, target_codes: list[str] = None) -> dict[str, list[tuple[str, float]]]:
+        """
+        This function creates the same dictionary as code_to_source_dict, with the target codes as keys and the source
+        codes as values. An example of the dictionary is:
+        {puma22: [(zcta1, afact1), (zcta2, afact2), ...]}
+        The afacts in the GeoCorr files have at most four decimals, so rounding the float32 afact to six decimals
+        gives back the value that was read from the csv file.
+        :param target_codes: Only add these target codes. By default, every target is added
+        :return: A dictionary with the target codes as keys and lists of (source code, afact) tuples as values
+        """
+
+        # Sort the rows by target, keeping the order of the file within every target
+        order = self.targetRows(target_codes)
+        target_idx = np.asarray(self.target_idx)[order]
+        sources = np.asarray(self.source_codes)[np.asarray(self.source_idx)[order]].tolist()
+        afacts = np.round(np.asarray(self.afact)[order].astype(np.float64), 6).tolist()
+
+        # Find where every target starts and ends
+        targets, starts = np.unique(target_idx, return_index=True)
+        ends = np.append(starts[1:], len(target_idx))
+
+        code_dict = {}
+        for target, start, end in zip(targets.tolist(), starts.tolist(), ends.tolist()):
+            code_dict[str(self.target_codes[target])] = list(zip(sources[start:end], afacts[start:end]))
+
+        return code_dict
+
+
+def allocateTotals(values: np.ndarray, source_idx: np.ndarray, target_idx: np.ndarray, afact: np.ndarray,
+                   number_targets: int, exact_allocation: int = 0) -> np.ndarray:
+    """
+    This function allocates the totals of every source to the targets of a crosswalk and adds them up by target. By
+    default, every piece is multiplied by its afact and rounded before it is added, which is how the crosswalk
+    functions have always rounded, and makes the totals of the targets drift from the totals of the sources. With
+    exact_allocation, the pieces keep their fractions, and the total of every source, rounded once, is split between
+    its pieces with the largest remainder method: every piece gets the whole part of its share, and the units that are
+    left go to the pieces with the largest fractions. The targets then add up to the sources.
+    :param values: The totals, with one row per source and one column per total
+    :param source_idx: The row of the source of every piece of the crosswalk
+    :param target_idx: The target of every piece of the crosswalk, from 0 to number_targets - 1
+    :param afact: The allocation factor of every piece
+    :param number_targets: The number of targets
+    :param exact_allocation: Whether to use the largest remainder method 0|1
+    :return: The totals, with one row per target and one column per total
+    """
+
+    values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+    source_idx = np.asarray(source_idx, dtype=np.intp)
+    target_idx = np.asarray(target_idx, dtype=np.intp)
+    afact = np.asarray(afact, dtype=np.float64)
+    number_sources = len(values)
+
+    if exact_allocation == 1:
+        # The afacts of the GeoCorr files have four decimals, so the afacts of a source only add up to 1 within the
+        # rounding of its pieces. Scale them to add up to 1 exactly, so the whole source is allocated
+        coverage = np.bincount(source_idx, weights=afact, minlength=number_sources)
+        number_pieces = np.bincount(source_idx, minlength=number_sources)
+        whole = np.abs(coverage - 1) <= 0.00005 * number_pieces
+        afact = np.where(whole[source_idx], afact / np.where(whole, coverage, 1)[source_idx], afact)
+
+    shares = values[source_idx] * afact[:, None]
+
+    if exact_allocation == 1:
+        pieces = np.floor(shares)
+        remainders = shares - pieces
+
+        # Sort the pieces of every source by their remainder, from the largest to the smallest
+        source_starts = np.searchsorted(np.sort(source_idx), np.arange(number_sources))
+
+        for column in range(values.shape[1]):
+            # The number of units that are left for every source once every piece has its whole part
+            source_totals = np.round(np.bincount(source_idx, weights=shares[:, column], minlength=number_sources))
+            left = source_totals - np.bincount(source_idx, weights=pieces[:, column], minlength=number_sources)
+
+            order = np.lexsort((-remainders[:, column], source_idx))
+            rank = np.arange(len(order)) - source_starts[source_idx[order]]
+            pieces[order[rank < left[source_idx[order]]], column] += 1
+    else:
+        pieces = np.round(shares)
+
+    # Add up the pieces of every target, with the pieces sorted by target
+    totals = np.zeros((number_targets, values.shape[1]))
+    if len(target_idx) > 0:
+        order = np.argsort(target_idx, kind="stable")
+        sorted_targets = target_idx[order]
+        starts = np.flatnonzero(np.r_[True, sorted_targets[1:] != sorted_targets[:-1]])
+        totals[sorted_targets[starts]] = np.add.reduceat(pieces[order], starts, axis=0)
+
+    return totals.astype(np.int64)
+
+
+def geographyColumn(geography: str) -> str:
+    """
+    This function gets the code column of a geography. The geography can be written as it is in the GeoCorr
+    Application, such as "County", or be the code column itself, such as "county".
+    :param geography: The geography
+    :return: The code column of the geography
+    """
+
+    if geography in geography_columns:
+        return geography_columns[geography]
+
+    for name, column in geography_columns.items():
+        if geography.lower() == name.lower():
+            return column
+
+    return geography
+
+
+def findTargetColumn(columns: list[str], source_col: str) -> str:
+    """
+    This function finds the column with the target codes in a crosswalk file, given the column with the source codes.
+    :param columns: The columns of the crosswalk file
+    :param source_col: The column with the source codes
+    :return: The column with the target codes
+    """
+
+    col_names = [col for col in columns if col != source_col]
+
+    # Find the column with the target codes
+    for col in col_names:
+        if "zcta" in col:
+            return col
+        elif "county" in col and "tract" not in col_names:
+            return col
+        elif "metdiv" in col:
+            return col
+        elif "puma" in col:
+            return col
+        elif "tract" in col:
+            return col
+        elif "cd" in col:
+            return col
+        elif "sdbest" in col:
+            return col
+        elif "sdelem" in col:
+            return col
+        elif "sdsec" in col:
+            return col
+        elif "sduni" in col:
+            return col
+        elif "state" in col:
+            return col
+
+    return ""
+
+
+def _compiledFolder(file_path: str) -> str:
+    """
+    This function gets the folder a crosswalk file is compiled to. It is in the .compiled folder next to the source
+    geography folders, in a folder with the name of the source geography folder and the crosswalk file.
+    :param file_path: The path to the crosswalk file
+    :return: The path to the compiled folder
+    """
+
+    source_folder, file_name = os.path.split(os.path.abspath(file_path))
+    geocorr_folder, source_name = os.path.split(source_folder)
+
+    return os.path.join(geocorr_folder, compiled_folder_name, source_name, os.path.splitext(file_name)[0])
+
+
+def compileCrossWalkFile(file_path: str, source_col: str) -> str:
+    """
+    This function compiles a cleaned crosswalk file into the binary form used by the registry. The source and target
+    codes are stored in sorted arrays, and the rows are stored as integer indexes into them with a float32 afact.
+    The column names are detected once and saved with the arrays, and so is the index of the rows by source and by
+    target. Other processes may have the arrays of an older compile memory-mapped, so the meta is removed first, and
+    every array is written to a temporary file and moved into place instead of being written over.
+    :param file_path: The path to the cleaned crosswalk file
+    :param source_col: The column with the source codes, or the start of its name, such as "puma"
+    :return: The path to the compiled folder
+    """
+
+    # Get the column name for the source geography
+    columns = pd.read_csv(file_path, nrows=0).columns.tolist()
+    for col in columns:
+        if source_col in col:
+            source_col = col
+            break
+
+    target_col = findTargetColumn(columns, source_col)
+
+    # Read the codes as strings to keep the leading zeros
+    df = pd.read_csv(file_path, usecols=[source_col, target_col, "afact"],
+                     dtype={source_col: str, target_col: str, "afact": np.float64})
+
+    # Integer code the source and target codes
+    source_codes, source_idx = np.unique(df[source_col].to_numpy(dtype=str), return_inverse=True)
+    target_codes, target_idx = np.unique(df[target_col].to_numpy(dtype=str), return_inverse=True)
+
+    arrays = {"source_codes": source_codes, "target_codes": target_codes,
+              "source_idx": source_idx.astype(np.int32), "target_idx": target_idx.astype(np.int32),
+              "afact": df["afact"].to_numpy(dtype=np.float32)}
+
+    # Save the index in both directions
+    for name, idx, codes in [("source", source_idx, source_codes), ("target", target_idx, target_codes)]:
+        arrays[name + "_offsets"], arrays[name + "_rows"] = buildIndex(idx, len(codes))
+
+    compiled_folder = _compiledFolder(file_path)
+    os.makedirs(compiled_folder, exist_ok=True)
+
+    # Remove the meta first, so the arrays are not taken for a finished compile while they are replaced
+    meta_file = os.path.join(compiled_folder, "meta.json")
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    for name, values in arrays.items():
+        _replaceFile(os.path.join(compiled_folder, name + ".npy"), lambda file: np.save(file, values))
+
+    # Save the column names and the file the arrays were compiled from, written last so that it marks a finished
+    # compile
+    meta = {"file_path": os.path.abspath(file_path), "source_col": source_col, "target_col": target_col,
+            "mtime": os.path.getmtime(file_path), "size": os.path.getsize(file_path)}
+    _replaceFile(meta_file, lambda file: file.write(json.dumps(meta).encode()))
+
+    return compiled_folder
+
+
+def _replaceFile(file_path: str, write) -> str:
+    """
+    This function writes a file to a temporary file in the same folder and then moves it into place, so a process that
+    has the old file open or memory-mapped keeps the old file, and two processes never write to the same temporary
+    file.
+    :param file_path: The path to the file
+    :param write: A function that writes the contents to the binary file object it is given
+    :return: The path to the file
+    """
+
+    folder, file_name = os.path.split(file_path)
+    descriptor, part_file = tempfile.mkstemp(dir=folder, prefix=file_name + ".", suffix=".part")
+
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            write(file)
+        os.replace(part_file, file_path)
+    except BaseException:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+
+    return file_path
+
+
+def loadCrossWalkFile(file_path: str, source_col: str) -> CrossWalk:
+    """
+    This function loads a crosswalk file. The file is compiled the first time, or when the csv file has changed since
+    it was compiled, and the compiled arrays are memory-mapped. A crosswalk is only loaded once, and every later call
+    returns the same CrossWalk until the csv file changes, such as when it is downloaded again.
+    :param file_path: The path to the cleaned crosswalk file
+    :param source_col: The column with the source codes, or the start of its name, such as "puma"
+    :return: The CrossWalk
+    """
+
+    key = os.path.abspath(file_path)
+    stamp = (os.path.getmtime(file_path), os.path.getsize(file_path))
+
+    with _loaded_lock:
+        if key in _loaded_crosswalks and _loaded_crosswalks[key][0] == stamp:
+            return _loaded_crosswalks[key][1]
+
+        compiled_folder = _compiledFolder(file_path)
+        meta_file = os.path.join(compiled_folder, "meta.json")
+
+        while True:
+            # Compile the file if it was never compiled, if it has changed, or if it was compiled without the index
+            meta = None
+            if os.path.exists(meta_file):
+                meta = _readMeta(meta_file)
+                if meta is not None and (meta["mtime"], meta["size"]) != stamp:
+                    meta = None
+                elif not all(os.path.exists(os.path.join(compiled_folder, name + ".npy"))
+                             for name in compiled_arrays):
+                    meta = None
+
+            if meta is None:
+                compileCrossWalkFile(file_path, source_col)
+                meta = _readMeta(meta_file)
+                if meta is None:
+                    continue
+
+            arrays = {name: np.load(os.path.join(compiled_folder, name + ".npy"), mmap_mode="r")
+                      for name in compiled_arrays}
+
+            # If another process compiled the file again while the arrays were loaded, they may not go together
+            if _readMeta(meta_file) == meta:
+                break
+
+        crosswalk = CrossWalk(key, meta["source_col"], meta["target_col"], **arrays)
+        _loaded_crosswalks[key] = (stamp, crosswalk)
+
+        return crosswalk
+
+
+def _readMeta(meta_file: str) -> dict | None:
+    """
+    This function reads the meta of a compiled crosswalk.
+    :param meta_file: The path to the meta.json file
+    :return: The meta, or None if it was removed by a compile in another process
+    """
+
+    try:
+        with open(meta_file) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def discoverCrossWalkFiles(data_dir: str) -> dict[tuple[str, str], str]:
+    """
+    This function finds every cleaned crosswalk file in the GeoCorr folder, and reads the header of each one to find
+    its source and target columns. The header is only read again if the file has changed. The source geography comes
+    from the folder the file is in.
+    :param data_dir: The path to the data directory which contains the GeoCorr folder
+    :return: A dictionary with (source column, target column) tuples as keys and the paths to the files as values
+    """
+
+    geocorr_folder = data_dir + "GeoCorr/"
+    crosswalk_files = {}
+
+    if not os.path.exists(geocorr_folder):
+        return crosswalk_files
+
+    for source_folder in sorted(os.listdir(geocorr_folder)):
+        folder = os.path.join(geocorr_folder, source_folder)
+
+        # Skip the cache and compiled folders
+        if source_folder.startswith(".") or not os.path.isdir(folder):
+            continue
+
+        # The source geography is the name of the folder, such as ZIP_ZCTA
+        source_name = geographyColumn(source_folder.replace("_", "/"))
+
+        for file in sorted(os.listdir(folder)):
+            if not file.endswith(".csv"):
+                continue
+
+            file_path = os.path.join(folder, file)
+
+            # Read the header once for every version of the file
+            key = (file_path, os.path.getmtime(file_path), os.path.getsize(file_path))
+            if key not in _file_columns:
+                _file_columns[key] = pd.read_csv(file_path, nrows=0).columns.tolist()
+            columns = _file_columns[key]
+
+            # Find the source column by the start of its name, such as "puma" for "puma22" or "puma12"
+            source_prefix = source_name.rstrip("0123456789")
+            source_col = next((col for col in columns if col.startswith(source_prefix)), "")
+            target_col = findTargetColumn(columns, source_col)
+
+            if source_col and target_col:
+                crosswalk_files[(source_col, target_col)] = file_path
+
+    return crosswalk_files
+
+
+def getCrossWalk(data_dir: str, source_geography: str, target_geography: str) -> CrossWalk:
+    """
+    This function gets the crosswalk from a source geography to a target geography. The geographies can be written as
+    they are in the GeoCorr Application, such as "County", or be the code columns, such as "county".
+    :param data_dir: The path to the data directory which contains the GeoCorr folder
+    :param source_geography: The source geography
+    :param target_geography: The target geography
+    :return: The CrossWalk
+    """
+
+    source_col = geographyColumn(source_geography)
+    target_col = geographyColumn(target_geography)
+
+    crosswalk_files = discoverCrossWalkFiles(data_dir)
+
+    if (source_col, target_col) not in crosswalk_files:
+        raise FileNotFoundError(f"There is no crosswalk file from {source_geography} to {target_geography} in "
+                                f"{data_dir}GeoCorr/")
+
+    return loadCrossWalkFile(crosswalk_files[(source_col, target_col)], source_col)
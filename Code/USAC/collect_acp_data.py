@@ -1,10 +1,24 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
+import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
 
-from Code.ACS_PUMS.acs_pums import code_to_source_dict
+from Code.Geocorr.crosswalk_registry import CrossWalk, allocateTotals, getCrossWalk
+from Code.output_writer import findOutputFile, isOutputFile, outputFile, readFrame, writeFrame
+from Code.pipeline_trace import traceStage, tracedStage
+
+# The data columns of the ACP tracker, in the order of the files
+usac_data_columns = ['Net New Enrollments Alternative Verification Process',
+                     'Net New Enrollments Verified by School', 'Net New Enrollments Lifeline',
+                     'Net New Enrollments National Verifier Application',
+                     'Net New Enrollments Total', 'Total Alternative Verification Process',
+                     'Total Verified by School', 'Total Lifeline',
+                     'Total National Verifier Application', 'Total Subscribers']
+
+# The state of a tracker worker process, set once by _startTrackerWorker
+_tracker_worker = {}
 
 
 def downloadFile(data_directory: str):
@@ -15,6 +29,9 @@ def downloadFile(data_directory: str):
     :return: None
     """
 
+    import requests
+    from bs4 import BeautifulSoup
+
     # Create directory for downloads
     download_directory = os.path.join(data_directory, "ACP_Households", "Middle_Files")
     os.makedirs(download_directory, exist_ok=True)
@@ -180,7 +197,8 @@ def organizeDataByZip(df: pd.DataFrame) -> dict[str, list[list[str, float]]]:
 
 
 def crosswalkUSACData(data_directory: str, code_dict: dict[str, list[tuple[str, float]]],
-                      zip_data_dict: dict[str, list[list[str, float]]], code_col: str):
+                      zip_data_dict: dict[str, list[list[str, float]]], code_col: str, exact_allocation: int = 0,
+                      output_format: str = "csv") -> str:
     """
     This function crosswalks the ACP data to the target geography codes. The data is then aggregated by the target
     geography code and data month.
@@ -188,119 +206,154 @@ def crosswalkUSACData(data_directory: str, code_dict: dict[str, list[tuple[str,
     :param code_dict: A dictionary where the keys are the target geography codes and the values are lists of tuples.
     :param zip_data_dict: A dictionary where the keys are the Zip Codes and the values are lists of lists.
     :param code_col: The name of the column containing the target geography codes
-    :return: None, the data is saved to a csv file
+    :param exact_allocation: Whether to round once per Zip Code and month with the largest remainder method, so the
+    totals of the target geography add up to the totals of the Zip Codes 0|1. See allocateTotals
+    :param output_format: The format of the file, one of output_formats, such as "csv.zst" or "parquet"
+    :return: The path to the file the data is saved to
     """
 
     # Create a string for the file to be saved to
-    end_file = data_directory + "ACP_Households/Final_Files/Total-ACP-Households-by-" + code_col + ".csv"
-
-    # Create a list to store the new data
-    new_list = []
-
-    # Loop through the keys in the zip_data_dict, which are zip codes
-    for key in zip_data_dict.keys():
-        # Loop through the keys in the code_dict, which are target geography codes
-        # values are lists of tuples of zcta codes and their afact [(ZCTA, AF), (ZCTA, AF), ...]
-        for middle_key, value in code_dict.items():
-            # Loop through the tuples in the list
-            for small_key in value:
-                # If the zip code is in the list of zcta codes
-                if key == small_key[0]:
-                    # Add the target geography code, afact, and data to the new list
-                    new_list.append([middle_key, small_key[1], zip_data_dict[key]])
+    end_file = outputFile(data_directory + "ACP_Households/Final_Files/Total-ACP-Households-by-" + code_col,
+                          output_format)
+
+    # Keep the fractions until every Zip Code and month is rounded once
+    if exact_allocation == 1:
+        df = allocateUSACData(code_dict, zip_data_dict, code_col)
+
+    # Round every piece
+    else:
+        # Create a list to store the new data
+        new_list = []
+
+        # Loop through the keys in the zip_data_dict, which are zip codes
+        for key in zip_data_dict.keys():
+            # Loop through the keys in the code_dict, which are target geography codes
+            # values are lists of tuples of zcta codes and their afact [(ZCTA, AF), (ZCTA, AF), ...]
+            for middle_key, value in code_dict.items():
+                # Loop through the tuples in the list
+                for small_key in value:
+                    # If the zip code is in the list of zcta codes
+                    if key == small_key[0]:
+                        # Add the target geography code, afact, and data to the new list
+                        new_list.append([middle_key, small_key[1], zip_data_dict[key]])
+
+        """
+        EXAMPLE OF ONE ROW IN THE NEW_LIST:
+
+        ['03730', 0.2696, [['2022-01-01', '90010', 0.0, 0.0, 2.0, 9.0, 11.0, 8.0, 0.0, 54.0, 39.0, 101.0],
+         ['2022-02-01', '90010', 0.0, 0.0, 6.0, 7.0, 13.0, 8.0, 0.0, 60.0, 46.0, 114.0]]]
+
+        """
+
+        # Create a list to store the new data
+        second_list = []
+
+        # Loop through the items in the list of [target geography codes, afact, and [data]]
+        for item in new_list:
+            # Get the target geography code and afact
+            target_geo_code = item[0]
+            afact = item[1]
+            # Loop through the data rows in the data list
+            for ls in item[2]:
+                # Create a new list with the target geography code and afact, which will be appended to second_list
+                new_ls = [ls[0], target_geo_code]
+                # Loop through the items in the data list, starting at the second item
+                for item_two in ls[2:]:
+                    # Multiply the item by the afact and append it to the new list
+                    new_ls.append(int(round(item_two * afact)))
+                # Append the new list to second_list
+                second_list.append(new_ls)
+
+        """
+        EXAMPLE OF ONE ROW IN THE SECOND_LIST:
+
+        ['2022-01-01', '03730', 0.0, 0.0, 0.5392, 2.4264, 2.9656000000000002, 2.1568, 0.0, 14.5584, 10.5144, 27.2296]
+
+        Note: There can be multiple rows with the same puma22 code and data month, so the data needs to be aggregated
+        """
+
+        # Turn second_list into a dataframe, columns are the same as the columns in the original data file
+        df = pd.DataFrame(second_list, columns=['Data Month', code_col] + usac_data_columns)
+
+        # Aggregate the data if there are multiple rows with the same puma22 code and data month
+        df = df.groupby(['Data Month', code_col]).sum()
+
+        # Round the data to the nearest whole number
+        df = df.round(0)
+
+        # Reset the index
+        df = df.reset_index()
 
-    """
-    EXAMPLE OF ONE ROW IN THE NEW_LIST:
-
-    ['03730', 0.2696, [['2022-01-01', '90010', 0.0, 0.0, 2.0, 9.0, 11.0, 8.0, 0.0, 54.0, 39.0, 101.0],
-     ['2022-02-01', '90010', 0.0, 0.0, 6.0, 7.0, 13.0, 8.0, 0.0, 60.0, 46.0, 114.0]]]
+    # Sort the dataframe by the target geography code and data month
+    df = df.sort_values(by=[code_col, 'Data Month'])
 
-    """
+    # Save the dataframe in the output format
+    writeFrame(df, end_file)
 
-    # Create a list to store the new data
-    second_list = []
-
-    # Loop through the items in the list of [target geography codes, afact, and [data]]
-    for item in new_list:
-        # Get the target geography code and afact
-        target_geo_code = item[0]
-        afact = item[1]
-        # Loop through the data rows in the data list
-        for ls in item[2]:
-            # Create a new list with the target geography code and afact, which will be appended to second_list
-            new_ls = [ls[0], target_geo_code]
-            # Loop through the items in the data list, starting at the second item
-            for item_two in ls[2:]:
-                # Multiply the item by the afact and append it to the new list
-                new_ls.append(int(round(item_two * afact)))
-            # Append the new list to second_list
-            second_list.append(new_ls)
+    # Delete the dataframes to save memory
+    del df
+    del code_dict
+    del zip_data_dict
 
-    """
-    EXAMPLE OF ONE ROW IN THE SECOND_LIST:
+    return end_file
 
-    ['2022-01-01', '03730', 0.0, 0.0, 0.5392, 2.4264, 2.9656000000000002, 2.1568, 0.0, 14.5584, 10.5144, 27.2296]
 
-    Note: There can be multiple rows with the same puma22 code and data month, so the data needs to be aggregated
+def allocateUSACData(code_dict: dict[str, list[tuple[str, float]]], zip_data_dict: dict[str, list[list[str, float]]],
+                     code_col: str) -> pd.DataFrame:
+    """
+    This function crosswalks the ACP data with the largest remainder method of allocateTotals. Every month of every
+    Zip Code is a source, and its total is rounded once and split between the target geography codes, instead of
+    rounding every piece.
+    :param code_dict: A dictionary where the keys are the target geography codes and the values are lists of tuples.
+    :param zip_data_dict: A dictionary where the keys are the Zip Codes and the values are lists of lists.
+    :param code_col: The name of the column containing the target geography codes
+    :return: A dataframe with the Data Month, target geography code and data columns, with one row per code and month
     """
 
-    # Turn second_list into a dataframe, columns are the same as the columns in the original data file
-    df = pd.DataFrame(second_list,
-                      columns=['Data Month', code_col, 'Net New Enrollments Alternative Verification Process',
-                               'Net New Enrollments Verified by School', 'Net New Enrollments Lifeline',
-                               'Net New Enrollments National Verifier Application',
-                               'Net New Enrollments Total', 'Total Alternative Verification Process',
-                               'Total Verified by School', 'Total Lifeline',
-                               'Total National Verifier Application', 'Total Subscribers'])
-
-    # Aggregate the data if there are multiple rows with the same puma22 code and data month
-    df = df.groupby(['Data Month', code_col]).sum()
-
-    # Round the data to the nearest whole number
-    df = df.round(0)
+    # Every row of every Zip Code is a source, numbered in the order of zip_data_dict
+    months, values, zip_rows = [], [], {}
+    for zip_code, data in zip_data_dict.items():
+        zip_rows[zip_code] = range(len(months), len(months) + len(data))
+        for row in data:
+            months.append(row[0])
+            values.append(row[2:])
 
-    # Reset the index
-    df = df.reset_index()
+    # Find the pieces of the crosswalk, one for every month of every Zip Code of a target geography code
+    sources, target_months, target_codes, afacts = [], [], [], []
+    for target_geo_code, value in code_dict.items():
+        for zip_code, afact in value:
+            for position in zip_rows.get(zip_code, []):
+                sources.append(position)
+                target_months.append(months[position])
+                target_codes.append(target_geo_code)
+                afacts.append(afact)
 
-    # Sort the dataframe by the target geography code and data month
-    df = df.sort_values(by=[code_col, 'Data Month'])
+    # Number the (month, target geography code) pairs, sorted like the groupby of crosswalkUSACData
+    target_idx, targets = pd.factorize(pd.MultiIndex.from_arrays([target_months, target_codes]), sort=True)
 
-    # Save the dataframe as a csv file
-    df.to_csv(end_file, index=False)
+    totals = allocateTotals(np.array(values, dtype=np.float64).reshape(len(values), len(usac_data_columns)),
+                            np.array(sources, dtype=np.intp), target_idx, np.array(afacts), len(targets),
+                            exact_allocation=1)
 
-    # Delete the dataframes to save memory
-    del df
-    del new_list
-    del second_list
-    del code_dict
-    del zip_data_dict
+    df = pd.DataFrame(totals, columns=usac_data_columns)
+    df.insert(0, code_col, targets.get_level_values(1))
+    df.insert(0, 'Data Month', targets.get_level_values(0))
 
+    return df
 
-def addCDFlag(data_dir: str, code_col: str):
 
+def addCDColumn(acp_df: pd.DataFrame, data_dir: str, code_col: str) -> pd.DataFrame:
     """
-    This function adds a column to the final file that indicates whether or not the congressional district is
+    This function adds a column to the crosswalked ACP data that indicates whether or not the congressional district is
     represented by a Democrat.
+    :param acp_df: The ACP data of the congressional districts
     :param data_dir: Path to the data directory
     :param code_col: Column name of the target geography code
-    :return: None, the data is saved to a csv file
+    :return: The dataframe with the CD_Democrat column
     """
 
-    # Path to the folder containing the csv files
-    cd_folder = data_dir + "ACP_Households/CD_Data/"
-
     # Path to the file containing the party for each cd
-    cd_file = cd_folder + "CD_by_party.csv"
-
-    # Path to the final file folder
-    house_holds_folder = data_dir + "ACP_Households/Final_Files/"
-
-    # Path to the final file
-    cd_final_file = ""
-    for file in os.listdir(house_holds_folder):
-        if "cd" in file:
-            cd_final_file = house_holds_folder + file
-            break
+    cd_file = data_dir + "ACP_Households/CD_Data/CD_by_party.csv"
 
     # Read the cd file
     cd_file_df = pd.read_csv(cd_file)
@@ -325,9 +378,6 @@ def addCDFlag(data_dir: str, code_col: str):
     # Only keep the columns we need, CD_Democrat and code_col
     cd_file_df = cd_file_df[[code_col, "CD_Democrat"]]
 
-    # Read the ACP Households file
-    acp_df = pd.read_csv(cd_final_file)
-
     # Convert the code column to a string
     acp_df[code_col] = acp_df[code_col].astype(str)
 
@@ -340,42 +390,235 @@ def addCDFlag(data_dir: str, code_col: str):
     # Fill the NaN values with "N/A"
     acp_df["CD_Democrat"] = acp_df["CD_Democrat"].fillna("NA")
 
-    # Save the dataframe as a csv file
-    acp_df.to_csv(cd_final_file, index=False)
+    return acp_df
+
+
+def addCDFlag(data_dir: str, code_col: str):
+
+    """
+    This function adds a column to the final file that indicates whether or not the congressional district is
+    represented by a Democrat.
+    :param data_dir: Path to the data directory
+    :param code_col: Column name of the target geography code
+    :return: None, the data is saved to a csv file
+    """
+
+    # Path to the final file folder
+    house_holds_folder = data_dir + "ACP_Households/Final_Files/"
+
+    # Path to the final file
+    cd_final_file = ""
+    for file in os.listdir(house_holds_folder):
+        if "cd" in file and isOutputFile(file):
+            cd_final_file = house_holds_folder + file
+            break
+
+    # Read the ACP Households file
+    acp_df = readFrame(cd_final_file)
+
+    # Add the party of every congressional district
+    acp_df = addCDColumn(acp_df, data_dir, code_col)
+
+    # Save the dataframe in the same format
+    writeFrame(acp_df, cd_final_file)
 
     # Delete the dataframes to save memory
-    del cd_file_df
     del acp_df
 
 
-def ZCTAtoTargetGeography(data_directory: str, target_geo: str, source_col: str = "zcta"):
+@tracedStage("ZCTAtoTargetGeography")
+def ZCTAtoTargetGeography(data_directory: str, target_geo: str, source_col: str = "zcta", exact_allocation: int = 0,
+                          output_format: str = "csv"):
     final_folder = os.path.join(data_directory, "ACP_Households", "Final_Files")
-    final_zip_file = os.path.join(final_folder, "Total-ACP-Households-by-zcta.csv")
-    df = pd.read_csv(final_zip_file, dtype={source_col: str})
 
-    geocorr_folder = os.path.join(data_directory, "Geocorr")
-    zcta_cw_folder = os.path.join(geocorr_folder, "ZIP_ZCTA")
+    # Read the Zip Code file in the format it was saved in
+    final_zip_file = findOutputFile(os.path.join(final_folder, "Total-ACP-Households-by-zcta"))
+    df = readFrame(final_zip_file, [source_col])
+
+    with traceStage("crosswalk") as stage:
+        # Get the crosswalk file from the registry
+        crosswalk = getCrossWalk(data_directory, source_col, target_geo)
+        dc, col_name = crosswalk.toSourceDict(), crosswalk.target_col
+
+        zip_data = organizeDataByZip(df)
+
+        end_file = crosswalkUSACData(data_directory, dc, zip_data, col_name, exact_allocation, output_format)
+        stage.addRows(rows_in=len(df))
+        stage.addWrite(end_file)
+
+    if "cd" in col_name:
+        with traceStage("write"):
+            addCDFlag(data_directory, col_name)
+
+
+def crosswalkTrackerRows(crosswalk: CrossWalk, zcta_idx: np.ndarray, month_idx: np.ndarray, values: np.ndarray,
+                         zctas: list[str], months: list[str], exact_allocation: int = 0) -> pd.DataFrame:
+    """
+    This function crosswalks the rows of the ACP tracker to a target geography at once, with allocateTotals. Every row
+    of the tracker is a source, and it is split between the target geography codes of its Zip Code, in the order of
+    the toSourceDict dictionary of the crosswalk, so it gives the same dataframe as crosswalkUSACData.
+    :param crosswalk: The crosswalk from the Zip Codes to the target geography, from getCrossWalk
+    :param zcta_idx: The Zip Code of every row, as its position in zctas
+    :param month_idx: The data month of every row, as its position in months
+    :param values: The data columns of every row, in the order of usac_data_columns
+    :param zctas: The Zip Codes
+    :param months: The data months
+    :param exact_allocation: Whether to round once per row with the largest remainder method 0|1
+    :return: A dataframe with the Data Month, target geography code and data columns, sorted by code and month
+    """
+
+    code_col = crosswalk.target_col
+
+    # The source of the crosswalk of every row, or -1 if its Zip Code is not in the crosswalk
+    positions = {code: i for i, code in enumerate(np.asarray(crosswalk.source_codes).astype(str).tolist())}
+    row_sources = np.array([positions.get(code, -1) for code in zctas], dtype=np.intp)[zcta_idx]
+    rows = np.flatnonzero(row_sources >= 0)
+
+    # The rows of every source, in the order of the tracker
+    rows = rows[np.argsort(row_sources[rows], kind="stable")]
+    source_counts = np.bincount(row_sources[rows], minlength=len(crosswalk.source_codes))
+    source_starts = np.concatenate([[0], np.cumsum(source_counts)[:-1]])
+
+    # The pieces of the crosswalk, sorted by target like toSourceDict
+    order = crosswalk.targetRows()
+    piece_sources = np.asarray(crosswalk.source_idx)[order].astype(np.intp)
+    piece_targets = np.asarray(crosswalk.target_idx)[order].astype(np.intp)
+    piece_afacts = np.round(np.asarray(crosswalk.afact)[order].astype(np.float64), 6)
+
+    # Repeat every piece for every row of its source
+    repeats = source_counts[piece_sources]
+    pieces = np.repeat(np.arange(len(order)), repeats)
+    offsets = np.arange(len(pieces)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    sources = rows[source_starts[piece_sources[pieces]] + offsets]
+
+    # Number the (month, target geography code) pairs
+    number_targets = len(crosswalk.target_codes)
+    pairs, target_idx = np.unique(month_idx[sources].astype(np.int64) * number_targets + piece_targets[pieces],
+                                  return_inverse=True)
+
+    totals = allocateTotals(values, sources, target_idx, piece_afacts[pieces], len(pairs), exact_allocation)
 
-    # Find the crosswalk file
-    if target_geo == "Metropolitan division":
-        cw_file = os.path.join(zcta_cw_folder, "United_States_Zip-Zcta_to_Metropolitan-Division.csv")
-    elif target_geo == "Public-use microdata area (PUMA)":
-        cw_file = os.path.join(zcta_cw_folder, "United_States_Zip-Zcta_to_Public-Use-Microdata-Area-(Puma).csv")
-    elif target_geo == "County":
-        cw_file = os.path.join(zcta_cw_folder, "United_States_Zip-Zcta_to_County.csv")
-    elif target_geo == "State":
-        cw_file = os.path.join(zcta_cw_folder, "United_States_Zip-Zcta_to_State.csv")
-    elif target_geo == "118th Congress (2023-2024)":
-        cw_file = os.path.join(zcta_cw_folder, "United_States_Zip-Zcta_to_118Th-Congress-(2023-2024).csv")
+    df = pd.DataFrame(totals, columns=usac_data_columns)
+    df.insert(0, code_col, np.asarray(crosswalk.target_codes).astype(str)[pairs % number_targets])
+    df.insert(0, 'Data Month', np.asarray(months)[pairs // number_targets])
 
-    dc, col_name = code_to_source_dict(cw_file, source_col)
+    return df.sort_values(by=[code_col, 'Data Month']).reset_index(drop=True)
 
-    zip_data = organizeDataByZip(df)
 
-    crosswalkUSACData(data_directory, dc, zip_data, col_name)
+def _startTrackerWorker(data_directory: str, source_col: str, blocks: dict[str, tuple[str, tuple, str]],
+                        zctas: list[str], months: list[str]):
+    """
+    This function prepares a tracker worker process. The rows of the tracker are read from the shared memory blocks
+    without a copy, so every process uses the one copy the tracker was loaded into.
+    :param data_directory: Path to the data directory
+    :param source_col: The source column of the crosswalk
+    :param blocks: The name, shape and type of the shared memory block of every array
+    :param zctas: The Zip Codes
+    :param months: The data months
+    :return: None
+    """
+
+    _tracker_worker["data_directory"] = data_directory
+    _tracker_worker["source_col"] = source_col
+    _tracker_worker["zctas"] = zctas
+    _tracker_worker["months"] = months
+
+    # Keep the blocks open for as long as the process runs
+    _tracker_worker["blocks"] = [shared_memory.SharedMemory(name=name) for name, _, _ in blocks.values()]
+    for block, (array_name, (_, shape, dtype)) in zip(_tracker_worker["blocks"], blocks.items()):
+        _tracker_worker[array_name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
 
+def _crosswalkTrackerGeography(target_geo: str, exact_allocation: int, output_format: str) -> str:
+    """
+    This function crosswalks the tracker of the worker process to one target geography, adds the CD_Democrat column
+    for the congressional districts, and saves the file once.
+    :param target_geo: The target geography
+    :param exact_allocation: Whether to round once per row with the largest remainder method 0|1
+    :param output_format: The format of the file, one of output_formats, such as "csv.zst" or "parquet"
+    :return: The path to the file
+    """
+
+    data_directory = _tracker_worker["data_directory"]
+
+    with traceStage("crosswalk") as stage:
+        crosswalk = getCrossWalk(data_directory, _tracker_worker["source_col"], target_geo)
+        col_name = crosswalk.target_col
+
+        df = crosswalkTrackerRows(crosswalk, _tracker_worker["zcta_idx"], _tracker_worker["month_idx"],
+                                  _tracker_worker["values"], _tracker_worker["zctas"], _tracker_worker["months"],
+                                  exact_allocation)
+        stage.addRows(rows_in=len(_tracker_worker["values"]), rows_out=len(df))
+
+    # Add the party of the congressional districts before the file is saved, instead of reading it again
     if "cd" in col_name:
-        addCDFlag(data_directory, col_name)
+        df = addCDColumn(df, data_directory, col_name)
+
+    end_file = outputFile(data_directory + "ACP_Households/Final_Files/Total-ACP-Households-by-" + col_name,
+                          output_format)
+
+    return writeFrame(df, end_file)
+
+
+@tracedStage("crosswalkTrackerGeographies")
+def crosswalkTrackerGeographies(data_directory: str, target_geos: list[str], source_col: str = "zcta",
+                                exact_allocation: int = 0, output_format: str = "csv",
+                                processes: int = None) -> dict[str, str]:
+    """
+    This function crosswalks the ACP tracker to several target geographies at once. It gives the same files as calling
+    ZCTAtoTargetGeography for every geography, but the tracker is only read once, into shared memory, and every
+    geography is crosswalked in its own process, so the stage takes about as long as its slowest geography. The
+    CD_Democrat column of the congressional districts is added before the file is saved.
+    Example:
+        crosswalkTrackerGeographies(data_dir, ["County", "118th Congress (2023-2024)", "State"])
+    :param data_directory: Path to the data directory
+    :param target_geos: The target geographies
+    :param source_col: The source column of the crosswalk
+    :param exact_allocation: Whether to round once per Zip Code and month with the largest remainder method 0|1
+    :param output_format: The format of the files, one of output_formats, such as "csv.zst" or "parquet"
+    :param processes: The number of processes. By default, one per geography
+    :return: A dictionary with the target geographies as keys and the paths to their files as values
+    """
+
+    final_folder = os.path.join(data_directory, "ACP_Households", "Final_Files")
+
+    # Read the Zip Code file once, in the format it was saved in
+    df = readFrame(findOutputFile(os.path.join(final_folder, "Total-ACP-Households-by-zcta")), [source_col])
+
+    # Compile the crosswalks here, so every process only has to memory-map them
+    for target_geo in target_geos:
+        getCrossWalk(data_directory, source_col, target_geo)
+
+    # The Zip Codes and the months are integer coded, and the data columns are kept as one matrix
+    zcta_idx, zctas = pd.factorize(df[source_col].astype(str))
+    month_idx, months = pd.factorize(df["Data Month"].astype(str), sort=True)
+    arrays = {"zcta_idx": zcta_idx.astype(np.int32), "month_idx": month_idx.astype(np.int32),
+              "values": df[usac_data_columns].to_numpy(dtype=np.float64)}
+    del df
+
+    # Copy the arrays into shared memory blocks once
+    blocks = {}
+    opened = []
+    try:
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            opened.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            blocks[name] = (block.name, array.shape, array.dtype.str)
+
+        with ProcessPoolExecutor(max_workers=processes or len(target_geos), initializer=_startTrackerWorker,
+                                 initargs=(data_directory, source_col, blocks, zctas.tolist(),
+                                           months.tolist())) as executor:
+            futures = {target_geo: executor.submit(_crosswalkTrackerGeography, target_geo, exact_allocation,
+                                                   output_format)
+                       for target_geo in target_geos}
+
+            return {target_geo: future.result() for target_geo, future in futures.items()}
+
+    finally:
+        for block in opened:
+            block.close()
+            block.unlink()
 
 
 if __name__ == "__main__":
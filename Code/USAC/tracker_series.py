@@ -0,0 +1,257 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from Code.output_writer import findOutputFile, readFrame
+from Code.pipeline_trace import traceStage
+
+# The series that were already loaded, shared by every consumer. The keys are the paths to the files, and the values
+# are the modification time and size of the file and the TrackerSeries
+_loaded_series = {}
+_loaded_lock = threading.Lock()
+
+
+class TrackerSeries:
+    """
+    The crosswalked ACP tracker of a geography as a time series. The geography codes and the data months are stored
+    once, in sorted arrays, and every data column of the tracker is a dense array with one row per code and one column
+    per month, so a trend, a range of months or the latest month of every code is found without a scan or a groupby.
+    The months a code has no data for are NaN.
+    Example:
+        series = loadTrackerSeries(data_dir, "county")
+        growth = series.between("2023-01-01", "2023-12-01").growth("Total Subscribers")
+    """
+
+    def __init__(self, code_col: str, codes: np.ndarray, months: np.ndarray, arrays: dict[str, np.ndarray]):
+        self.code_col = code_col
+        self.codes = codes
+        self.months = months
+        self.arrays = arrays
+
+        # The row of every code
+        self._code_rows = {code: row for row, code in enumerate(codes.tolist())}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        months = f"{self.months[0]} to {self.months[-1]}" if len(self.months) else "no months"
+        return f"TrackerSeries({self.code_col}, {len(self)} codes, {months})"
+
+    @classmethod
+    def fromFrame(cls, df: pd.DataFrame, code_col: str) -> "TrackerSeries":
+        """
+        This function creates the series of a crosswalked tracker dataframe.
+        :param df: The dataframe, with the Data Month, the code column and the data columns, like the
+        Total-ACP-Households-by-<geography> files
+        :param code_col: The code column
+        :return: The TrackerSeries
+        """
+
+        code_idx, codes = pd.factorize(df[code_col].astype(str), sort=True)
+        month_idx, months = pd.factorize(df["Data Month"].astype(str), sort=True)
+
+        # Every other numeric column is a data column, such as Total Subscribers
+        metrics = [column for column in df.select_dtypes(include="number").columns if column != code_col]
+
+        arrays = {}
+        for metric in metrics:
+            array = np.full((len(codes), len(months)), np.nan)
+            array[code_idx, month_idx] = df[metric].to_numpy(dtype=np.float64)
+            arrays[metric] = array
+
+        return cls(code_col, np.asarray(codes, dtype=str), np.asarray(months, dtype=str), arrays)
+
+    def metric(self, metric: str) -> np.ndarray:
+        """
+        This function gets the array of a data column.
+        :param metric: The data column, such as "Total Subscribers"
+        :return: The array, with one row per code and one column per month
+        """
+
+        if metric not in self.arrays:
+            raise KeyError(f"{metric} is not a data column of the tracker, use one of {', '.join(self.arrays)}")
+
+        return self.arrays[metric]
+
+    def toFrame(self, metric: str, values: np.ndarray = None) -> pd.DataFrame:
+        """
+        This function turns the array of a data column, or an array computed from it, into a dataframe.
+        :param metric: The data column
+        :param values: An array with the shape of the series, such as the result of rolling or growth. By default, the
+        array of the data column
+        :return: The dataframe, with the codes as the index and the months as the columns
+        """
+
+        values = self.metric(metric) if values is None else values
+
+        return pd.DataFrame(values, index=pd.Index(self.codes, name=self.code_col), columns=self.months)
+
+    def between(self, start: str = None, stop: str = None) -> "TrackerSeries":
+        """
+        This function gets the months of a range. The arrays are views, so nothing is copied.
+        :param start: The first month, such as "2023-01-01". By default, the first month of the tracker
+        :param stop: The last month, which is included. By default, the last month of the tracker
+        :return: The TrackerSeries of the months
+        """
+
+        first = 0 if start is None else np.searchsorted(self.months, start, side="left")
+        last = len(self.months) if stop is None else np.searchsorted(self.months, stop, side="right")
+
+        return TrackerSeries(self.code_col, self.codes, self.months[first:last],
+                             {metric: array[:, first:last] for metric, array in self.arrays.items()})
+
+    def rows(self, codes: list[str]) -> np.ndarray:
+        """
+        This function finds the rows of some codes.
+        :param codes: The codes. Codes that are not in the tracker are skipped
+        :return: The rows, in the order of the codes
+        """
+
+        return np.array([self._code_rows[code] for code in map(str, codes) if code in self._code_rows], dtype=np.intp)
+
+    def select(self, codes: list[str]) -> "TrackerSeries":
+        """
+        This function gets the series of some codes.
+        :param codes: The codes. Codes that are not in the tracker are skipped
+        :return: The TrackerSeries of the codes
+        """
+
+        rows = self.rows(codes)
+
+        return TrackerSeries(self.code_col, self.codes[rows], self.months,
+                             {metric: array[rows] for metric, array in self.arrays.items()})
+
+    def latest(self, metric: str = "Total Subscribers") -> pd.Series:
+        """
+        This function finds the value of the most recent month of every code, which is the last month the code has
+        data for.
+        :param metric: The data column
+        :return: The values, with the codes as the index. Codes without any data are NaN
+        """
+
+        array = self.metric(metric)
+
+        values = np.full(len(array), np.nan)
+        if array.shape[1]:
+            # The last column with data of every row. A row without data gets its last column, which is NaN
+            last = array.shape[1] - 1 - np.argmax(~np.isnan(array[:, ::-1]), axis=1)
+            values = array[np.arange(len(array)), last]
+
+        return pd.Series(values, index=pd.Index(self.codes, name=self.code_col), name=metric)
+
+    def rolling(self, metric: str, window: int, how: str = "mean") -> np.ndarray:
+        """
+        This function computes a rolling aggregate over the months of every code, with cumulative sums, so every window
+        is computed at once.
+        :param metric: The data column
+        :param window: The number of months of the window, which ends at every month
+        :param how: "sum" or "mean"
+        :return: The array, with the shape of the series. A window with a month without data, or that starts before
+        the first month, is NaN
+        """
+
+        if how not in ["sum", "mean"]:
+            raise ValueError(f"{how} is not a rolling aggregate, use sum or mean")
+        if window < 1:
+            raise ValueError("The window must be at least 1 month")
+
+        array = self.metric(metric)
+
+        # The cumulative sums of the values and of the months with data, with a 0 column first
+        padding = np.zeros((len(array), 1))
+        sums = np.concatenate([padding, np.cumsum(np.nan_to_num(array), axis=1)], axis=1)
+        counts = np.concatenate([padding, np.cumsum(~np.isnan(array), axis=1)], axis=1)
+
+        result = np.full(array.shape, np.nan)
+        if window <= array.shape[1]:
+            window_sums = sums[:, window:] - sums[:, :-window]
+            full = (counts[:, window:] - counts[:, :-window]) == window
+            result[:, window - 1:] = np.where(full, window_sums / (window if how == "mean" else 1), np.nan)
+
+        return result
+
+    def growth(self, metric: str = "Total Subscribers", periods: int = 1) -> np.ndarray:
+        """
+        This function computes the growth of every code from one month to another, month over month by default.
+        :param metric: The data column
+        :param periods: The number of months to compare with
+        :return: The growth as a percentage, rounded to two decimals, with the shape of the series. The first months,
+        the months without data, and the months that follow a 0 are NaN
+        """
+
+        array = self.metric(metric)
+
+        result = np.full(array.shape, np.nan)
+        if 0 < periods < array.shape[1]:
+            previous = array[:, :-periods]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                change = (array[:, periods:] - previous) / previous * 100
+            result[:, periods:] = np.where(previous != 0, change, np.nan).round(2)
+
+        return result
+
+    def alignCodes(self, values: pd.Series) -> np.ndarray:
+        """
+        This function joins the values of some codes, such as the eligibility counts, to the codes of the series.
+        :param values: The values, with the codes as the index
+        :return: The values, in the order of the codes of the series. Codes without a value are NaN
+        """
+
+        values = pd.Series(values.to_numpy(dtype=np.float64), index=values.index.astype(str))
+
+        return values[~values.index.duplicated(keep="last")].reindex(self.codes).to_numpy()
+
+    def participationRate(self, eligible: pd.Series, metric: str = "Total Subscribers") -> np.ndarray:
+        """
+        This function computes the participation rate of every code and month, like the Current Participation Rate of
+        the combined files, by dividing a data column by the number of eligible households.
+        :param eligible: The number of eligible households, with the codes as the index, such as the Current Num
+        Eligible column of a combined file
+        :param metric: The data column
+        :return: The participation rate as a percentage, rounded to two decimals, with the shape of the series
+        """
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.metric(metric) / self.alignCodes(eligible)[:, None] * 100).round(2)
+
+
+def trackerFile(data_dir: str, geography: str) -> str:
+    """
+    This function finds the crosswalked tracker file of a geography, in any output format.
+    :param data_dir: Path to the data directory
+    :param geography: The code column of the geography, such as "county"
+    :return: The path to the file
+    """
+
+    return findOutputFile(os.path.join(data_dir, "ACP_Households", "Final_Files", "Total-ACP-Households-by-" +
+                                       geography))
+
+
+def loadTrackerSeries(data_dir: str, geography: str) -> TrackerSeries:
+    """
+    This function loads the crosswalked tracker of a geography as a TrackerSeries. A file is only read once, and every
+    later call returns the same TrackerSeries, until the file changes.
+    :param data_dir: Path to the data directory
+    :param geography: The code column of the geography, such as "county"
+    :return: The TrackerSeries
+    """
+
+    file_path = os.path.abspath(trackerFile(data_dir, geography))
+    stamp = (os.path.getmtime(file_path), os.path.getsize(file_path))
+
+    with _loaded_lock:
+        if file_path in _loaded_series and _loaded_series[file_path][0] == stamp:
+            return _loaded_series[file_path][1]
+
+        df = readFrame(file_path, [geography])
+
+        with traceStage("index") as stage:
+            series = TrackerSeries.fromFrame(df, geography)
+            stage.addRows(rows_in=len(df), rows_out=len(series))
+
+        _loaded_series[file_path] = (stamp, series)
+
+        return series
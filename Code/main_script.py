@@ -1,117 +1,515 @@
-from ACS_PUMS.acs_pums import (downloadPUMSFiles, everyStateEligibility, determine_eligibility, createDeliverableFiles,
-                               aggregateSavings)
-from Geocorr.Geocorr_Applications_Downloads import downloadCrossWalkFile, getMostRecentGeoCorrApplication
-from USAC.collect_acp_data import ZCTAtoTargetGeography
-
-
-def main():
-    data_dir = "../Data/"
-
-    # downloadPUMSFiles(data_dir)
-
-    # everyStateEligibility(data_dir)
-
-    # The different target geographies
-    county = "County"
-    congressional_district = "118th Congress (2023-2024)"
-    metro = "Metropolitan division"
-    zcta = "ZIP/ZCTA"
-    state = "State"
-    puma = "Public-use microdata area (PUMA)"
-    #
-    # # Download the crosswalk files
-    # link = getMostRecentGeoCorrApplication(data_dir)
-    #
-    # source_geography = "Public-use microdata area (PUMA)"
-    #
-    # county_cw_file, source_col_1 = downloadCrossWalkFile(link, data_dir, source_geography, county)
-    # congressional_dist_cw_file, source_col_2 = downloadCrossWalkFile(link, data_dir, source_geography,
-    #                                                                  congressional_district)
-    # metro_cw_file, source_col_3 = downloadCrossWalkFile(link, data_dir, source_geography, metro)
-    #
-    # zcta_cw_file, source_col_4 = downloadCrossWalkFile(link, data_dir, source_geography, zcta)
-    # state_cw_file, source_col_5 = downloadCrossWalkFile(link, data_dir, source_geography, state)
-    #
-    # determine_eligibility(data_dir)
-    # determine_eligibility(data_dir, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1, disability=1,
-    #                       elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=county)
-    # determine_eligibility(data_dir, geography=county, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=congressional_district)
-    # determine_eligibility(data_dir, geography=congressional_district, aian=1, asian=1, black=1, hispanic=1, white=1,
-    #                       nhpi=1, veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=metro)
-    # determine_eligibility(data_dir, geography=metro, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=zcta)
-    # determine_eligibility(data_dir, geography=zcta, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=state)
-    # determine_eligibility(data_dir, geography=state, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1)
-    #
-    # determine_eligibility(data_dir, povpip=150, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, povpip=135, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, povpip=120, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=county, povpip=150, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=county, povpip=135, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=county, povpip=120, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=congressional_district, povpip=150, aian=1, asian=1, black=1, hispanic=1,
-    #                       white=1, nhpi=1, veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=congressional_district, povpip=135, aian=1, asian=1, black=1, hispanic=1,
-    #                       white=1, nhpi=1, veteran=1,disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=congressional_district, povpip=120, aian=1, asian=1, black=1, hispanic=1,
-    #                       white=1, nhpi=1, veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=metro, povpip=150, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=metro, povpip=135, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=metro, povpip=120, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=zcta, povpip=150, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=zcta, povpip=135, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=zcta, povpip=120, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=state, povpip=150, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=state, povpip=135, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    # determine_eligibility(data_dir, geography=state, povpip=120, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1,
-    #                       veteran=1, disability=1, elderly=1, eng_very_well=1)
-    #
-    # # Download zcta crosswalk files
-    # downloadCrossWalkFile(link, data_dir, zcta, county)
-    # downloadCrossWalkFile(link, data_dir, zcta, congressional_district)
-    # downloadCrossWalkFile(link, data_dir, zcta, metro)
-    # downloadCrossWalkFile(link, data_dir, zcta, state)
-    # downloadCrossWalkFile(link, data_dir, zcta, puma)
-    #
-    # ZCTAtoTargetGeography(data_dir, county)
-    # ZCTAtoTargetGeography(data_dir, congressional_district)
-    # ZCTAtoTargetGeography(data_dir, metro)
-    # ZCTAtoTargetGeography(data_dir, state)
-    # ZCTAtoTargetGeography(data_dir, puma)
-
-    for i in range(120, 200):
-        determine_eligibility(data_dir, povpip=i, geography=state, end_folder="National_Changes/")
-
-    createDeliverableFiles(data_dir)
-    aggregateSavings(data_dir)
-
-
-
-    # # To test the eligibility function
-    # determine_eligibility(data_dir, povpip=135, aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1,
-    #                       disability=1, elderly=1, eng_very_well=1, geography=state)
+import argparse
+import os
+import sys
+import time
+
+# Make the Code package importable when the script is run directly, such as python Code/main_script.py
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The modules of the workflow are imported by the commands that use them, so the commands that only compute do not
+# load requests, bs4, or selenium, and run on machines without Chrome
+
+# The different target geographies
+county = "County"
+congressional_district = "118th Congress (2023-2024)"
+metro = "Metropolitan division"
+zcta = "ZIP/ZCTA"
+state = "State"
+puma = "Public-use microdata area (PUMA)"
+
+# The covered populations used in the report
+covered_populations = dict(aian=1, asian=1, black=1, hispanic=1, white=1, nhpi=1, veteran=1, disability=1, elderly=1,
+                           eng_very_well=1)
+
+# The geographies of the command line, by a short name
+geography_names = {"county": county, "cd": congressional_district, "metro": metro, "zcta": zcta, "state": state,
+                   "puma": puma}
+
+# The default data directory, next to the Code folder
+default_data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data") + "/"
+
+
+def buildPipeline(data_dir: str) -> list:
+    """
+    This function creates the stages of the pipeline, from downloading the PUMS files to the deliverable files. The
+    order is: download PUMS -> everyStateEligibility -> crosswalk downloads -> determine_eligibility for every
+    geography -> ZCTAtoTargetGeography -> deliverables. The USAC tracker, the PUMS eligibility, and the GeoCorr
+    downloads do not depend on each other, so they can run at the same time.
+    :param data_dir: The path to the data directory
+    :return: The stages of the pipeline
+    """
+
+    from Code.pipeline import PipelineStage
+
+    def downloadPUMS():
+        from Code.ACS_PUMS.acs_pums import downloadPUMSFiles
+        downloadPUMSFiles(data_dir)
+
+    def stateEligibility():
+        from Code.ACS_PUMS.acs_pums import everyStateEligibility
+        everyStateEligibility(data_dir)
+
+    def downloadPUMACrossWalks():
+        downloadCrossWalks(data_dir, [(puma, county), (puma, congressional_district), (puma, metro), (puma, zcta),
+                                      (puma, state)])
+
+    def downloadZCTACrossWalks():
+        downloadCrossWalks(data_dir, [(zcta, county), (zcta, congressional_district), (zcta, metro), (zcta, state),
+                                      (zcta, puma)])
+
+    def currentEligibility():
+        from Code.ACS_PUMS.acs_pums import everyGeographyEligibility
+        everyGeographyEligibility(data_dir, save_aggregates=1)
+        everyGeographyEligibility(data_dir, save_aggregates=1, **covered_populations)
+
+    def changeEligibility():
+        from Code.ACS_PUMS.acs_pums import everyGeographyEligibility
+        from Code.output_writer import OutputWriter
+        with OutputWriter() as writer:
+            for povpip in [150, 135, 120]:
+                everyGeographyEligibility(data_dir, povpip=povpip, writer=writer, save_aggregates=1,
+                                          **covered_populations)
+
+    def combine():
+        from Code.ACS_PUMS.acs_pums import cleanData
+        cleanData(data_dir)
+
+    def downloadTracker():
+        from Code.USAC.collect_acp_data import combineFiles, downloadFile
+        downloadFile(data_dir)
+        combineFiles(data_dir)
+
+    def crosswalkTracker():
+        crosswalkTrackerFiles(data_dir, [county, congressional_district, metro, state, puma])
+
+    def participation():
+        from Code.ACS_PUMS.acs_pums import add_participation_rate_combined
+        add_participation_rate_combined(data_dir)
+
+        # The stage rewrites the combined files of the combine stage, so it has its own stamp file as its output
+        with open(data_dir + participation_stamp, "w") as file:
+            file.write(time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    def nationalSweep():
+        povpipSweep(data_dir, 120, 200)
+
+    def deliverables():
+        from Code.ACS_PUMS.acs_pums import aggregateSavings, createDeliverableFiles
+        savings_df = createDeliverableFiles(data_dir)
+        aggregateSavings(data_dir, savings_df)
+
+    puma_crosswalks = ["GeoCorr/Public-use microdata area (PUMA)/United_States_Public-Use-Microdata-Area-(Puma)_to_*.csv"]
+    zcta_crosswalks = ["GeoCorr/ZIP_ZCTA/United_States_Zip-Zcta_to_*.csv"]
+    state_files = ["ACS_PUMS/state_data/*/*-eligibility.csv"]
+    tracker_file = ["ACP_Households/Final_Files/Total-ACP-Households-by-zcta.csv"]
+    combined_files = ["ACS_PUMS/Change_Eligibility/combined-*.csv"]
+    participation_stamp = "ACS_PUMS/Change_Eligibility/.participation_rate"
+
+    return [
+        PipelineStage("download_pums", downloadPUMS,
+                      outputs=["ACS_PUMS/state_data/*/*.zip"]),
+        PipelineStage("state_eligibility", stateEligibility,
+                      inputs=["ACS_PUMS/state_data/*/*.zip"], outputs=state_files,
+                      depends_on=["download_pums"]),
+        PipelineStage("puma_crosswalks", downloadPUMACrossWalks, outputs=puma_crosswalks),
+        PipelineStage("zcta_crosswalks", downloadZCTACrossWalks, outputs=zcta_crosswalks),
+        PipelineStage("current_eligibility", currentEligibility,
+                      inputs=state_files + puma_crosswalks,
+                      outputs=["ACS_PUMS/Current_Eligibility/eligibility-by-*.csv"],
+                      depends_on=["state_eligibility", "puma_crosswalks"]),
+        PipelineStage("change_eligibility", changeEligibility,
+                      inputs=["ACS_PUMS/Current_Eligibility/eligibility-by-*.csv"],
+                      outputs=["ACS_PUMS/Change_Eligibility/percentage_eligible_*.csv"],
+                      depends_on=["current_eligibility"]),
+        PipelineStage("combine", combine,
+                      inputs=["ACS_PUMS/Change_Eligibility/percentage_eligible_*.csv"], outputs=combined_files,
+                      depends_on=["change_eligibility"]),
+        PipelineStage("usac_tracker", downloadTracker, outputs=tracker_file),
+        PipelineStage("tracker_crosswalk", crosswalkTracker, inputs=tracker_file + zcta_crosswalks,
+                      outputs=["ACP_Households/Final_Files/Total-ACP-Households-by-" + geography + ".csv"
+                               for geography in ["county", "cd118", "metdiv20", "state", "puma22"]],
+                      depends_on=["usac_tracker", "zcta_crosswalks"]),
+        PipelineStage("participation", participation,
+                      inputs=["ACP_Households/Final_Files/Total-ACP-Households-by-*.csv"] + combined_files,
+                      outputs=[participation_stamp], depends_on=["combine", "tracker_crosswalk"]),
+        PipelineStage("national_sweep", nationalSweep, inputs=state_files + puma_crosswalks,
+                      outputs=["ACS_PUMS/National_Changes/percentage_eligible_*-state.csv"],
+                      depends_on=["state_eligibility", "puma_crosswalks"]),
+        PipelineStage("deliverables", deliverables,
+                      inputs=["ACS_PUMS/deliverable_file/State_135_v2.xlsx"],
+                      outputs=["ACS_PUMS/deliverable_file/national_savings.csv"],
+                      depends_on=["national_sweep"]),
+    ]
+
+
+def downloadCrossWalks(data_dir: str, geography_pairs: list[tuple[str, str]]):
+    """
+    This function downloads crosswalk files from the most recent GeoCorr Application.
+    :param data_dir: The path to the data directory
+    :param geography_pairs: The source and target geographies of every file
+    :return: None
+    """
+
+    from Code.Geocorr.Geocorr_Applications_Downloads import fetchCrossWalkFiles, getMostRecentGeoCorrApplication
+
+    link = getMostRecentGeoCorrApplication(data_dir)
+    fetchCrossWalkFiles(link, data_dir, geography_pairs)
+
+
+def crosswalkTrackerFiles(data_dir: str, geographies: list[str], exact_allocation: int = 0,
+                          output_format: str = "csv", processes: int = None):
+    """
+    This function crosswalks the USAC tracker from the ZCTAs to every geography. The tracker is read once into shared
+    memory, and the geographies are crosswalked in parallel processes.
+    :param data_dir: The path to the data directory
+    :param geographies: The target geographies
+    :param exact_allocation: Whether to crosswalk with the largest remainder method of allocateTotals 0|1
+    :param output_format: The format of the files, such as "csv.zst" or "parquet"
+    :param processes: The number of processes. By default, one per geography
+    :return: None
+    """
+
+    from Code.USAC.collect_acp_data import crosswalkTrackerGeographies
+
+    crosswalkTrackerGeographies(data_dir, geographies, exact_allocation=exact_allocation, output_format=output_format,
+                                processes=processes)
+
+
+def povpipSweep(data_dir: str, start: int, stop: int, geographies: list[str] = None,
+                end_folder: str = "National_Changes/", output_format: str = "csv", **criteria):
+    """
+    This function determines the eligibility for every povpip from start to stop, not including stop. The household
+    arrays are loaded once and shared by every povpip, and the files are written in the background by an OutputWriter
+    while the next povpip is computed.
+    :param data_dir: The path to the data directory
+    :param start: The first povpip
+    :param stop: The povpip after the last one
+    :param geographies: The geographies to aggregate the data by. By default, the state
+    :param end_folder: The folder the files are saved in
+    :param output_format: The format of the files, such as "csv.zst" or "parquet"
+    :param criteria: The other criteria and covered populations, as in everyGeographyEligibility
+    :return: None
+    """
+
+    from Code.ACS_PUMS.acs_pums import everyGeographyEligibility
+    from Code.ACS_PUMS.household_array import loadHouseholdArray
+    from Code.output_writer import OutputWriter
+
+    households = loadHouseholdArray(data_dir)
+
+    with OutputWriter() as writer:
+        for povpip in range(start, stop):
+            everyGeographyEligibility(data_dir, povpip=povpip, geographies=geographies or [state],
+                                      end_folder=end_folder, households=households, writer=writer,
+                                      output_format=output_format, **criteria)
+
+
+def runDownload(args: argparse.Namespace):
+    """
+    This function runs the download command, which downloads the PUMS files, the crosswalk files, and the USAC tracker.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    if "pums" in args.what:
+        from Code.ACS_PUMS.acs_pums import downloadPUMSFiles
+        downloadPUMSFiles(args.data_dir)
+
+    if "crosswalks" in args.what:
+        downloadCrossWalks(args.data_dir, [(puma, geography) for geography in [county, congressional_district, metro,
+                                                                               zcta, state]] +
+                           [(zcta, geography) for geography in [county, congressional_district, metro, state, puma]])
+
+    if "tracker" in args.what:
+        from Code.USAC.collect_acp_data import combineFiles, downloadFile
+        downloadFile(args.data_dir)
+        combineFiles(args.data_dir)
+
+
+def runBuildState(args: argparse.Namespace):
+    """
+    This function runs the build-state command, which creates the eligibility file of every state.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    from Code.ACS_PUMS.acs_pums import everyStateEligibility
+
+    everyStateEligibility(args.data_dir, vintage=args.vintage, memory_budget_mb=args.memory_budget_mb,
+                          states=args.state_folders)
+
+
+def runUpdateStates(args: argparse.Namespace):
+    """
+    This function runs the update-states command, which updates every saved scenario after the PUMS files of some
+    states were published again, without computing the other states.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    from Code.ACS_PUMS.acs_pums import everyStateEligibility, updateStateEligibility
+
+    # Create the eligibility files of the states from their new PUMS files first
+    if args.rebuild == 1:
+        everyStateEligibility(args.data_dir, vintage=args.vintage, memory_budget_mb=args.memory_budget_mb,
+                              states=args.state_folders)
+
+    geographies = [geography_names[name] for name in args.geography] if args.geography else None
+    updated = updateStateEligibility(args.data_dir, args.state_folders, geographies, args.vintage)
+
+    for file_name, paths in updated.items():
+        print(f"{file_name}: {len(paths)} files updated")
+
+
+def scenarioCriteria(args: argparse.Namespace) -> dict:
+    """
+    This function gets the criteria and covered populations of a scenario from the arguments of a command.
+    :param args: The arguments of the command
+    :return: The criteria, as keyword arguments of everyGeographyEligibility
+    """
+
+    criteria = dict(has_pap=args.has_pap, has_ssip=args.has_ssip, has_hins4=args.has_hins4, has_snap=args.has_snap)
+
+    if args.covered_populations:
+        criteria.update(covered_populations)
+
+    return criteria
+
+
+def runEligibility(args: argparse.Namespace):
+    """
+    This function runs the eligibility command, which determines the eligibility of one scenario for the geographies.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    from Code.ACS_PUMS.acs_pums import all_geographies, areaEligibility, everyGeographyEligibility
+
+    geographies = [geography_names[name] for name in args.geography] if args.geography else None
+
+    # Only print the eligibility of some areas, without writing the files
+    if args.state_fips or args.areas:
+        criteria = scenarioCriteria(args)
+        population_names = [population_var for population_var in covered_populations if criteria.get(population_var)]
+        for geography in geographies or all_geographies:
+            df = areaEligibility(args.data_dir, geography, args.state_fips, args.areas, args.povpip, args.has_pap,
+                                 args.has_ssip, args.has_hins4, args.has_snap, population_names,
+                                 vintage=args.vintage, exact_allocation=args.exact_allocation)
+            print(df.to_csv(index=False))
+        return
+
+    paths = everyGeographyEligibility(args.data_dir, povpip=args.povpip, geographies=geographies,
+                                      end_folder=args.end_folder, standard_errors=args.standard_errors,
+                                      vintage=args.vintage, exact_allocation=args.exact_allocation,
+                                      output_format=args.output_format, save_aggregates=args.save_aggregates,
+                                      **scenarioCriteria(args))
+
+    for geography, path in paths.items():
+        print(f"{geography}: {path}")
+
+
+def runSweep(args: argparse.Namespace):
+    """
+    This function runs the sweep command, which determines the eligibility for a range of povpip values.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    povpipSweep(args.data_dir, args.start, args.stop, [geography_names[name] for name in args.geography],
+                args.end_folder, args.output_format, **scenarioCriteria(args))
+
+
+def runGrid(args: argparse.Namespace):
+    """
+    This function runs the grid command, which determines the eligibility for a grid of povpips and program criteria
+    with a pool of processes.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    from Code.ACS_PUMS.scenario_grid import runScenarioGrid
+
+    runScenarioGrid(args.data_dir, list(range(args.start, args.stop)),
+                    geographies=[geography_names[name] for name in args.geography],
+                    population_names=list(covered_populations) if args.covered_populations else None,
+                    output_folder=args.output_folder, processes=args.processes,
+                    exact_allocation=args.exact_allocation)
+
+
+def runTracker(args: argparse.Namespace):
+    """
+    This function runs the tracker command, which crosswalks the USAC tracker to the geographies.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    if args.download == 1:
+        from Code.USAC.collect_acp_data import combineFiles, downloadFile
+        downloadFile(args.data_dir)
+        combineFiles(args.data_dir)
+
+    crosswalkTrackerFiles(args.data_dir, [geography_names[name] for name in args.geography], args.exact_allocation,
+                          args.output_format, args.processes)
+
+
+def runDeliverables(args: argparse.Namespace):
+    """
+    This function runs the deliverables command, which creates the deliverable files and the national savings.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    from Code.ACS_PUMS.acs_pums import aggregateSavings, createDeliverableFiles
+
+    savings_df = createDeliverableFiles(args.data_dir)
+    aggregateSavings(args.data_dir, savings_df)
+
+
+def runWholePipeline(args: argparse.Namespace):
+    """
+    This function runs the pipeline command, which runs the stages of the pipeline that are out of date.
+    :param args: The arguments of the command
+    :return: None
+    """
+
+    from Code.pipeline import runPipeline
+
+    results = runPipeline(buildPipeline(args.data_dir), args.data_dir, targets=args.targets, force=args.force)
+
+    for name, status in results.items():
+        print(f"{name}: {status}")
+
+
+def addCriteriaArguments(parser: argparse.ArgumentParser):
+    """
+    This function adds the criteria of a scenario to the arguments of a command.
+    :param parser: The parser of the command
+    :return: None
+    """
+
+    for flag in ["has_pap", "has_ssip", "has_hins4", "has_snap"]:
+        parser.add_argument("--" + flag.replace("_", "-"), dest=flag, type=int, choices=[0, 1], default=1,
+                            help=f"1 to include {flag[4:].upper()} in the criteria, 0 to leave it out")
+    parser.add_argument("--covered-populations", type=int, choices=[0, 1], default=0,
+                        help="1 to add the covered populations used in the report")
+
+
+def buildParser() -> argparse.ArgumentParser:
+    """
+    This function creates the parser of the command line, with one command for every step of the workflow.
+    :return: The parser
+    """
+
+    parser = argparse.ArgumentParser(description="Determine the eligibility for ACP and its participation.")
+    parser.add_argument("--data-dir", default=default_data_dir, help="The path to the data directory")
+    commands = parser.add_subparsers(dest="command")
+
+    download = commands.add_parser("download", help="Download the PUMS files, the crosswalks, and the USAC tracker")
+    download.add_argument("what", nargs="*", choices=["pums", "crosswalks", "tracker"],
+                          default=["pums", "crosswalks", "tracker"])
+    download.set_defaults(function=runDownload)
+
+    build_state = commands.add_parser("build-state", help="Create the eligibility file of every state")
+    build_state.add_argument("--vintage", default=None, help="The PUMS vintage, such as 2022-1Year")
+    build_state.add_argument("--memory-budget-mb", type=int, default=None,
+                             help="Read the PUMS files in chunks that fit in this many megabytes")
+    build_state.add_argument("--state-folders", nargs="+", default=None,
+                             help="Only create the files of these states, by their folder, such as al")
+    build_state.set_defaults(function=runBuildState)
+
+    update_states = commands.add_parser("update-states", help="Update the saved scenarios after the PUMS files of "
+                                                              "some states were published again")
+    update_states.add_argument("--state-folders", nargs="+", default=None,
+                               help="The states, by their folder, such as al. By default, the states whose "
+                                    "eligibility file changed")
+    update_states.add_argument("--rebuild", type=int, choices=[0, 1], default=0,
+                               help="1 to create the eligibility files of the states from their PUMS files first")
+    update_states.add_argument("--geography", nargs="+", choices=sorted(geography_names), default=None,
+                               help="The geographies. By default, every geography")
+    update_states.add_argument("--vintage", default=None, help="The PUMS vintage, such as 2022-1Year")
+    update_states.add_argument("--memory-budget-mb", type=int, default=None,
+                               help="Read the PUMS files in chunks that fit in this many megabytes")
+    update_states.set_defaults(function=runUpdateStates)
+
+    eligibility = commands.add_parser("eligibility", help="Determine the eligibility of one scenario")
+    eligibility.add_argument("--povpip", type=int, default=200)
+    addCriteriaArguments(eligibility)
+    eligibility.add_argument("--geography", nargs="+", choices=sorted(geography_names), default=None,
+                             help="The geographies. By default, every geography")
+    eligibility.add_argument("--standard-errors", type=int, choices=[0, 1], default=0)
+    eligibility.add_argument("--end-folder", default="Change_Eligibility/")
+    eligibility.add_argument("--vintage", default=None, help="The PUMS vintage, such as 2022-1Year")
+    eligibility.add_argument("--exact-allocation", type=int, choices=[0, 1], default=0,
+                             help="1 to round once per source with the largest remainder method, so the totals add up")
+    eligibility.add_argument("--state-fips", nargs="+", default=None,
+                             help="Only print the areas of these states, by FIPS code, such as 06")
+    eligibility.add_argument("--areas", nargs="+", default=None,
+                             help="Only print these areas, by the code of the geography, such as 06037")
+    eligibility.add_argument("--output-format", default="csv",
+                             help="The format of the files: csv, csv.gz, csv.zst or parquet")
+    eligibility.add_argument("--save-aggregates", type=int, choices=[0, 1], default=0,
+                             help="1 to save the PUMAs of every state, so the files can be updated with update-states")
+    eligibility.set_defaults(function=runEligibility)
+
+    sweep = commands.add_parser("sweep", help="Determine the eligibility for a range of povpip values")
+    sweep.add_argument("--start", type=int, default=120)
+    sweep.add_argument("--stop", type=int, default=200, help="The povpip after the last one")
+    addCriteriaArguments(sweep)
+    sweep.add_argument("--geography", nargs="+", choices=sorted(geography_names), default=["state"])
+    sweep.add_argument("--end-folder", default="National_Changes/")
+    sweep.add_argument("--output-format", default="csv",
+                       help="The format of the files: csv, csv.gz, csv.zst or parquet")
+    sweep.set_defaults(function=runSweep)
+
+    grid = commands.add_parser("grid", help="Determine the eligibility for every povpip and program criteria "
+                                            "combination with a pool of processes")
+    grid.add_argument("--start", type=int, default=100)
+    grid.add_argument("--stop", type=int, default=251, help="The povpip after the last one")
+    grid.add_argument("--geography", nargs="+", choices=sorted(geography_names),
+                      default=["county", "cd", "metro", "state", "puma"])
+    grid.add_argument("--covered-populations", type=int, choices=[0, 1], default=0)
+    grid.add_argument("--output-folder", default="Scenario_Grid/")
+    grid.add_argument("--processes", type=int, default=None, help="By default, the number of CPUs")
+    grid.add_argument("--exact-allocation", type=int, choices=[0, 1], default=0,
+                      help="1 to round once per source with the largest remainder method, so the totals add up")
+    grid.set_defaults(function=runGrid)
+
+    tracker = commands.add_parser("tracker", help="Crosswalk the USAC tracker to the geographies")
+    tracker.add_argument("--download", type=int, choices=[0, 1], default=0, help="1 to download the tracker first")
+    tracker.add_argument("--geography", nargs="+", choices=sorted(geography_names),
+                         default=["county", "cd", "metro", "state", "puma"])
+    tracker.add_argument("--exact-allocation", type=int, choices=[0, 1], default=0,
+                         help="1 to round once per source with the largest remainder method, so the totals add up")
+    tracker.add_argument("--output-format", default="csv",
+                         help="The format of the files: csv, csv.gz, csv.zst or parquet")
+    tracker.add_argument("--processes", type=int, default=None, help="By default, one per geography")
+    tracker.set_defaults(function=runTracker)
+
+    deliverables = commands.add_parser("deliverables", help="Create the deliverable files and the national savings")
+    deliverables.set_defaults(function=runDeliverables)
+
+    pipeline = commands.add_parser("pipeline", help="Run the stages of the pipeline that are out of date")
+    pipeline.add_argument("--targets", nargs="+", default=["deliverables"],
+                          help="The stages to run, with the stages they depend on")
+    pipeline.add_argument("--force", nargs="+", default=None, help="Stages to rerun even if they are up to date")
+    pipeline.set_defaults(function=runWholePipeline)
+
+    return parser
+
+
+def main(argv: list[str] = None):
+    parser = buildParser()
+    args = parser.parse_args(argv)
+
+    # Without a command, run the povpip sweep of the states and the deliverable files, as before. The other stages
+    # are run with their commands, or all of them with the pipeline command
+    if args.command is None:
+        povpipSweep(args.data_dir, 120, 200)
+        runDeliverables(args)
+        return
+
+    args.function(args)
 
 
 if __name__ == '__main__':
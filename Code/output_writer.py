@@ -0,0 +1,214 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+from Code.pipeline_trace import submitTraced, traceStage
+
+
+# The extension of every output format. The compressed csv files need the zstandard package, and the Parquet files
+# need pyarrow, which are only imported by pandas when a file of that format is written or read
+output_formats = {"csv": ".csv", "csv.gz": ".csv.gz", "csv.zst": ".csv.zst", "parquet": ".parquet"}
+
+# The compression pandas uses for every csv format
+_csv_compression = {"csv": None, "csv.gz": "gzip", "csv.zst": "zstd"}
+
+
+def outputFormat(file_name: str) -> str | None:
+    """
+    This function finds the output format of a file from its extension.
+    :param file_name: The name of or path to the file
+    :return: The output format, such as "csv.zst", or None if the file is not an output file
+    """
+
+    # Check the longest extensions first, so a .csv.zst file is not taken for a .zst file
+    for output_format, extension in sorted(output_formats.items(), key=lambda item: -len(item[1])):
+        if file_name.endswith(extension):
+            return output_format
+
+    return None
+
+
+def isOutputFile(file_name: str) -> bool:
+    """
+    This function checks if a file is an output file of any output format.
+    :param file_name: The name of or path to the file
+    :return: True if the file has the extension of an output format
+    """
+
+    return outputFormat(file_name) is not None
+
+
+def outputFile(file_name: str, output_format: str = "csv") -> str:
+    """
+    This function adds the extension of an output format to the path to a file.
+    :param file_name: The path to the file without the extension
+    :param output_format: The output format, one of output_formats
+    :return: The path to the file
+    """
+
+    if output_format not in output_formats:
+        raise ValueError(f"{output_format} is not an output format, use one of {', '.join(output_formats)}")
+
+    return file_name + output_formats[output_format]
+
+
+def findOutputFile(file_name: str) -> str:
+    """
+    This function finds a file that was saved in any output format, so a reader does not need to know the format.
+    :param file_name: The path to the file without the extension
+    :return: The path to the file, in the first output format of output_formats that exists
+    """
+
+    for extension in output_formats.values():
+        if os.path.exists(file_name + extension):
+            return file_name + extension
+
+    raise FileNotFoundError(f"{file_name} does not exist in any output format ({', '.join(output_formats)})")
+
+
+def readFrame(file_name: str, code_columns: list[str] = None) -> pd.DataFrame:
+    """
+    This function reads a file of any output format, found from its extension. The code columns are read as strings,
+    and the dictionary encoded columns of the Parquet files are turned back into strings.
+    :param file_name: The path to the file
+    :param code_columns: The columns to read as strings, such as the geography code column
+    :return: The dataframe
+    """
+
+    output_format = outputFormat(file_name)
+
+    with traceStage("read") as stage:
+        if output_format == "parquet":
+            df = pd.read_parquet(file_name)
+            for column in df.select_dtypes(include=["category"]).columns:
+                df[column] = df[column].astype(str)
+        else:
+            df = pd.read_csv(file_name, header=0, dtype={column: str for column in code_columns or []},
+                             compression=_csv_compression.get(output_format))
+
+        stage.addRead(file_name)
+        stage.addRows(rows_out=len(df))
+
+    return df
+
+
+def writeFrame(df: pd.DataFrame, file_name: str) -> str:
+    """
+    This function saves a dataframe in the output format of the extension of the file. The file is written to a
+    temporary file first, so a file that was not finished is never read, and the files of the same name in the other
+    output formats are removed, so only the newest one is found. In the Parquet files, the text columns, such as the
+    geography codes and names, are dictionary encoded.
+    :param df: The dataframe
+    :param file_name: The path to the file, with the extension of an output format
+    :return: The path to the file
+    """
+
+    output_format = outputFormat(file_name)
+
+    with traceStage("write") as stage:
+        if output_format == "parquet":
+            text_columns = df.select_dtypes(include=["object", "string"]).columns
+            df = df.assign(**{column: df[column].astype(str).astype("category") for column in text_columns})
+            df.to_parquet(file_name + ".part", index=False)
+        else:
+            df.to_csv(file_name + ".part", index=False, compression=_csv_compression.get(output_format))
+
+        os.replace(file_name + ".part", file_name)
+
+        # Remove the file of the same name saved in another format before, so the readers do not find the old one
+        stem = file_name[:-len(output_formats[output_format])]
+        for extension in output_formats.values():
+            if stem + extension != file_name and os.path.exists(stem + extension):
+                os.remove(stem + extension)
+
+        stage.addWrite(file_name)
+        stage.addRows(rows_in=len(df))
+
+    return file_name
+
+
+class OutputWriter:
+    """
+    A pool of threads that saves finished dataframes in the background, so the next scenario is computed while the
+    files of the last one are formatted and written. At most max_pending dataframes wait to be written, and submit
+    waits when the pool is that far behind, so a fast sweep does not keep every dataframe in memory.
+    Example:
+        with OutputWriter() as writer:
+            for povpip in range(120, 200):
+                everyGeographyEligibility(data_dir, povpip, writer=writer)
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending if max_pending is not None else 2 * max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="OutputWriter")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"OutputWriter({self.max_workers} threads, {self.pending()} pending)"
+
+    def pending(self) -> int:
+        """
+        This function counts the dataframes that are not written yet.
+        :return: The number of dataframes
+        """
+
+        with self._lock:
+            return sum(1 for future in self._futures if not future.done())
+
+    def submit(self, df: pd.DataFrame, file_name: str) -> Future:
+        """
+        This function adds a dataframe to the files that are written. The dataframe must not be changed after it is
+        submitted. If max_pending dataframes are waiting, it waits for one of them to be written first.
+        :param df: The dataframe
+        :param file_name: The path to the file
+        :return: The future of the write, which gives the path to the file
+        """
+
+        self._slots.acquire()
+        try:
+            future = submitTraced(self._executor, writeFrame, df, file_name)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+
+        with self._lock:
+            self._futures.append(future)
+
+        return future
+
+    def wait(self) -> list[str]:
+        """
+        This function waits for every dataframe that was submitted to be written. If a write failed, its error is
+        raised here.
+        :return: The paths to the files, in the order they were submitted
+        """
+
+        with self._lock:
+            futures = self._futures
+            self._futures = []
+
+        return [future.result() for future in futures]
+
+    def close(self) -> list[str]:
+        """
+        This function waits for every file to be written and stops the threads.
+        :return: The paths to the files, in the order they were submitted
+        """
+
+        try:
+            return self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,233 @@
+import glob
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+
+class PipelineStage:
+    """
+    One stage of the pipeline. A stage runs a function, and declares the files it reads, the files it writes, and the
+    stages that have to run before it. Inputs and outputs are paths relative to the data directory, and can be glob
+    patterns such as "ACS_PUMS/state_data/*/*-eligibility.csv".
+    """
+
+    def __init__(self, name: str, function: Callable[[], object], inputs: list[str] = None,
+                 outputs: list[str] = None, depends_on: list[str] = None):
+        self.name = name
+        self.function = function
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.depends_on = depends_on or []
+
+    def __repr__(self):
+        return f"PipelineStage({self.name})"
+
+
+def _matchingFiles(data_dir: str, patterns: list[str]) -> list[str]:
+    """
+    This function finds the files that match a list of paths or glob patterns.
+    :param data_dir: The path to the data directory
+    :param patterns: The paths or glob patterns, relative to the data directory
+    :return: The paths to the files
+    """
+
+    files = []
+    for pattern in patterns:
+        files += [file for file in glob.glob(data_dir + pattern) if os.path.isfile(file)]
+
+    return files
+
+
+def isStale(stage: PipelineStage, data_dir: str) -> bool:
+    """
+    This function checks if the outputs of a stage are out of date. They are out of date if one of the outputs does
+    not exist, or if an input was changed after the oldest output was written. A stage without outputs is always out
+    of date.
+    :param stage: The stage
+    :param data_dir: The path to the data directory
+    :return: True if the stage needs to run
+    """
+
+    if not stage.outputs:
+        return True
+
+    # Every output has to exist
+    output_files = []
+    for pattern in stage.outputs:
+        files = _matchingFiles(data_dir, [pattern])
+        if not files:
+            return True
+        output_files += files
+
+    input_files = _matchingFiles(data_dir, stage.inputs)
+    if not input_files:
+        return False
+
+    return max(os.path.getmtime(file) for file in input_files) > min(os.path.getmtime(file) for file in output_files)
+
+
+def failedSinceOutputs(stage: PipelineStage, data_dir: str, saved: dict) -> bool:
+    """
+    This function checks if a stage failed after its outputs were written. The outputs of a stage that failed can be
+    partly written, so they are not trusted, unless every output was written again after the failure, such as by hand
+    or by another run.
+    :param stage: The stage
+    :param data_dir: The path to the data directory
+    :param saved: The status of the stage in the state file
+    :return: True if the stage failed and an output is older than the failure
+    """
+
+    if saved.get("status") != "failed":
+        return False
+
+    output_files = _matchingFiles(data_dir, stage.outputs)
+
+    # The state files of older runs do not have the time of the failure
+    if not output_files or "time" not in saved:
+        return True
+
+    return min(os.path.getmtime(file) for file in output_files) <= saved["time"]
+
+
+def _orderStages(stages: list[PipelineStage], targets: list[str] = None) -> dict[str, PipelineStage]:
+    """
+    This function checks the dependencies of the stages, and keeps only the stages needed by the targets.
+    :param stages: Every stage of the pipeline
+    :param targets: The names of the stages to run, with the stages they depend on. If None, every stage is kept
+    :return: A dictionary with the names of the stages as keys and the stages as values
+    """
+
+    by_name = {stage.name: stage for stage in stages}
+
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on {dependency}, which is not a stage")
+
+    if targets is None:
+        needed = set(by_name)
+    else:
+        # Walk back from the targets through the dependencies
+        needed = set()
+        to_visit = list(targets)
+        while to_visit:
+            name = to_visit.pop()
+            if name not in needed:
+                needed.add(name)
+                to_visit += by_name[name].depends_on
+
+    # Check that there are no cycles
+    visited = set()
+    visiting = set()
+
+    def visit(name: str):
+        if name in visiting:
+            raise ValueError(f"The pipeline has a cycle through {name}")
+        if name not in visited:
+            visiting.add(name)
+            for dependency in by_name[name].depends_on:
+                visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+
+    for name in needed:
+        visit(name)
+
+    return {stage.name: stage for stage in stages if stage.name in needed}
+
+
+def runPipeline(stages: list[PipelineStage], data_dir: str, state_file: str = None, targets: list[str] = None,
+                force: list[str] = None, max_workers: int = 3) -> dict[str, str]:
+    """
+    This function runs the stages of the pipeline in the order of their dependencies. Stages whose outputs are up to
+    date are skipped, stages that do not depend on each other run at the same time, and a stage runs again if a stage
+    it depends on ran. The status of every stage is saved to the state file, so that after a failure the next run
+    resumes from the stages that failed or did not run. A stage that failed runs again unless its outputs were all
+    written after the failure.
+    :param stages: Every stage of the pipeline
+    :param data_dir: The path to the data directory
+    :param state_file: The path to the json file with the status of every stage. By default, it is
+    pipeline_state.json in the data directory
+    :param targets: The names of the stages to run, with the stages they depend on. By default, every stage runs
+    :param force: The names of the stages to run even if they are up to date
+    :param max_workers: The number of stages that can run at the same time
+    :return: A dictionary with the names of the stages as keys and "done", "skipped", "failed", or "blocked" as values
+    """
+
+    if state_file is None:
+        state_file = data_dir + "pipeline_state.json"
+
+    force = set(force or [])
+    stages = _orderStages(stages, targets)
+
+    # Read the status of the previous run
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file) as file:
+            state = json.load(file)
+
+    state_lock = threading.Lock()
+
+    def saveState(name: str, status: str, error: str = None):
+        with state_lock:
+            state[name] = {"status": status, "finished": time.strftime("%Y-%m-%dT%H:%M:%S"), "time": time.time()}
+            if error is not None:
+                state[name]["error"] = error
+            with open(state_file, "w") as file:
+                json.dump(state, file, indent=2)
+
+    def runStage(stage: PipelineStage):
+        print(f"Running {stage.name}")
+        stage.function()
+
+    results = {}
+    pending = dict(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start every stage whose dependencies are finished
+            for name, stage in list(pending.items()):
+                statuses = [results.get(dependency) for dependency in stage.depends_on]
+
+                if None in statuses:
+                    continue
+
+                del pending[name]
+
+                # A stage cannot run if a stage it depends on failed
+                if "failed" in statuses or "blocked" in statuses:
+                    results[name] = "blocked"
+                    print(f"Blocked {name}")
+                    continue
+
+                needs_run = (name in force or "done" in statuses
+                             or failedSinceOutputs(stage, data_dir, state.get(name, {})) or isStale(stage, data_dir))
+
+                if not needs_run:
+                    results[name] = "skipped"
+                    continue
+
+                running[executor.submit(runStage, stage)] = name
+
+            if not running:
+                continue
+
+            # Wait for a stage to finish
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    results[name] = "done"
+                    saveState(name, "done")
+                except Exception as error:
+                    results[name] = "failed"
+                    saveState(name, "failed", "".join(traceback.format_exception_only(type(error), error)).strip())
+                    print(f"Failed {name}: {error}")
+
+    return results
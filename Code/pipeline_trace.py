@@ -0,0 +1,313 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows, so the peak memory is not recorded there
+    resource = None
+
+# The environment variable that turns on tracing. Its value is the folder the trace files are saved to
+trace_env_variable = "ACP_TRACE"
+
+# The trace of the current run, or None if tracing is off
+_trace = None
+
+# The stages that are running, from the top-level stage to the innermost one. It is a context variable, so a task that
+# is submitted with submitTraced runs inside the stages that were running when it was submitted
+_stack = contextvars.ContextVar("stage_stack", default=())
+
+
+class Stage:
+    """
+    One stage of the pipeline in a trace. A stage that is entered several times inside the same parent, such as
+    reading every state file, is recorded once with the totals of every call.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.process_peak_rss_mb = None
+        self.peak_rss_growth_mb = None
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def addRows(self, rows_in: int = 0, rows_out: int = 0):
+        """
+        This function adds to the number of rows that went into and came out of the stage.
+        :param rows_in: The number of rows read by the stage
+        :param rows_out: The number of rows produced by the stage
+        :return: None
+        """
+
+        with self._lock:
+            self.rows_in += int(rows_in)
+            self.rows_out += int(rows_out)
+
+    def addRead(self, path: str):
+        """
+        This function adds the size of a file that the stage read.
+        :param path: The path to the file
+        :return: None
+        """
+
+        if os.path.exists(path):
+            with self._lock:
+                self.bytes_read += os.path.getsize(path)
+
+    def addWrite(self, path: str):
+        """
+        This function adds the size of a file that the stage wrote.
+        :param path: The path to the file
+        :return: None
+        """
+
+        if os.path.exists(path):
+            with self._lock:
+                self.bytes_written += os.path.getsize(path)
+
+    def child(self, name: str) -> "Stage":
+        """
+        This function gets the sub-stage with the given name, creating it the first time.
+        :param name: The name of the sub-stage
+        :return: The sub-stage
+        """
+
+        with self._lock:
+            if name not in self.children:
+                self.children[name] = Stage(name)
+            return self.children[name]
+
+    def toDict(self) -> dict:
+        """
+        This function turns the stage and its sub-stages into a dictionary that can be saved as json.
+        :return: The dictionary
+        """
+
+        with self._lock:
+            children = list(self.children.values())
+
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "process_peak_rss_mb": self.process_peak_rss_mb,
+            "peak_rss_growth_mb": self.peak_rss_growth_mb,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "stages": [child.toDict() for child in children],
+        }
+
+
+class _NullStage:
+    """
+    The stage used when tracing is off. Every method does nothing.
+    """
+
+    def addRows(self, rows_in: int = 0, rows_out: int = 0):
+        pass
+
+    def addRead(self, path: str):
+        pass
+
+    def addWrite(self, path: str):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+def _peakRssMb() -> float | None:
+    """
+    This function gets the peak memory used by the process so far. It is the high-water mark of the whole process, so
+    it never goes down between stages.
+    :return: The peak resident set size in MB, or None if it cannot be measured
+    """
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def enableTracing(trace_folder: str = "."):
+    """
+    This function turns on tracing for the rest of the run. The trace is saved as a json file in the trace folder when
+    the run ends, or when writeTrace is called.
+    :param trace_folder: The folder to save the trace file to
+    :return: None
+    """
+
+    global _trace
+
+    if _trace is None:
+        atexit.register(writeTrace)
+
+    _trace = {
+        "run_id": time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8],
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "folder": trace_folder,
+        "stages": [],
+        "lock": threading.Lock(),
+    }
+
+
+def disableTracing():
+    """
+    This function turns off tracing, without saving the trace.
+    :return: None
+    """
+
+    global _trace
+    _trace = None
+
+
+def tracingEnabled() -> bool:
+    """
+    This function checks if tracing is on.
+    :return: True if tracing is on
+    """
+
+    return _trace is not None
+
+
+@contextmanager
+def traceStage(name: str):
+    """
+    This function records the wall time, CPU time and memory of a stage of the pipeline. Stages can be nested, and the
+    caller can add the rows and bytes the stage read and wrote to the stage it gets. If tracing is off, nothing is
+    recorded. The operating system only gives the peak memory of the whole process, so a stage records that peak when
+    it ends, as process_peak_rss_mb, and how much the stage raised it, as peak_rss_growth_mb. A stage that stays below
+    the peak of an earlier stage has a growth of 0, and a stage that runs next to other threads also counts the memory
+    they use. A stage of a task that was submitted to a pool of threads with submitTraced is added to the stage that
+    submitted it.
+    Example:
+        with traceStage("read") as stage:
+            df = pd.read_csv(file)
+            stage.addRead(file)
+            stage.addRows(rows_out=len(df))
+    :param name: The name of the stage
+    :return: The stage
+    """
+
+    trace = _trace
+
+    if trace is None:
+        yield _null_stage
+        return
+
+    stack = _stack.get()
+
+    # Every call of a top-level stage is recorded on its own, sub-stages are added to their parent
+    if stack:
+        stage = stack[-1].child(name)
+    else:
+        stage = Stage(name)
+        with trace["lock"]:
+            trace["stages"].append(stage)
+
+    token = _stack.set(stack + (stage,))
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    peak_start = _peakRssMb()
+
+    try:
+        yield stage
+    finally:
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+        process_peak_rss_mb = _peakRssMb()
+
+        # A sub-stage can run in several threads at once, so its totals are added under its lock
+        with stage._lock:
+            stage.calls += 1
+            stage.wall_seconds += wall_seconds
+            stage.cpu_seconds += cpu_seconds
+            stage.process_peak_rss_mb = process_peak_rss_mb
+            if peak_start is not None:
+                growth = round(process_peak_rss_mb - peak_start, 1)
+                stage.peak_rss_growth_mb = max(growth, stage.peak_rss_growth_mb or 0.0)
+
+        _stack.reset(token)
+
+
+def tracedStage(name: str):
+    """
+    This function is a decorator that records every call of a function as a stage of the pipeline.
+    :param name: The name of the stage
+    :return: The decorator
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with traceStage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def submitTraced(executor: Executor, function, *args, **kwargs) -> Future:
+    """
+    This function submits a task to a pool of threads, so that the stages of the task are recorded inside the stages
+    that are running when it is submitted, instead of as top-level stages of their own.
+    Example:
+        with ThreadPoolExecutor() as executor:
+            future = submitTraced(executor, writeFrame, df, file_name)
+    :param executor: The pool of threads
+    :param function: The task
+    :param args: The arguments of the task
+    :param kwargs: The keyword arguments of the task
+    :return: The future of the task
+    """
+
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+def writeTrace() -> str | None:
+    """
+    This function saves the trace of the run as a json file in the trace folder, named trace-<run id>.json.
+    :return: The path to the trace file, or None if tracing is off
+    """
+
+    trace = _trace
+
+    if trace is None:
+        return None
+
+    os.makedirs(trace["folder"], exist_ok=True)
+    trace_file = os.path.join(trace["folder"], "trace-" + trace["run_id"] + ".json")
+
+    with trace["lock"]:
+        stages = [stage.toDict() for stage in trace["stages"]]
+
+    with open(trace_file, "w") as file:
+        json.dump({"run_id": trace["run_id"], "started": trace["started"], "process_peak_rss_mb": _peakRssMb(),
+                   "stages": stages}, file, indent=2)
+
+    return trace_file
+
+
+# Turn on tracing if the environment variable is set
+if os.environ.get(trace_env_variable):
+    enableTracing(os.environ[trace_env_variable])
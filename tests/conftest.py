@@ -0,0 +1,110 @@
+import os
+import shutil
+import sys
+import threading
+from urllib.parse import urlencode, urljoin, urlparse
+
+import pytest
+
+# The tests import the code as the Code package, like main_script
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+fixtures_folder = os.path.join(root, "tests", "fixtures")
+
+
+class RecordedResponse:
+    """
+    A response of the RecordedSession, with the attributes of a requests.Response that the downloaders use.
+    """
+
+    def __init__(self, url: str, content: bytes, status_code: int = 200):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.text = content.decode("ISO-8859-1")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"{self.status_code} for {self.url}")
+
+
+class RecordedSession:
+    """
+    A local stand-in of requests.Session for the GeoCorr Application. It answers with the recorded pages of
+    tests/fixtures/geocorr: the application page, the query output page, and the crosswalk file, and keeps every
+    request it was sent, so a test can check what the downloader submitted without the network.
+    """
+
+    # The recorded file of every path of the application
+    pages = {
+        "/applications/geocorr2022.html": "geocorr2022.html",
+        "/cgi-bin/broker": "query_output.html",
+        "/temp/geocorr2022_2430512345.csv": "geocorr2022_zcta_county.csv",
+    }
+
+    requests = []
+    lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def _answer(self, method: str, url: str, params: list = None) -> RecordedResponse:
+        with self.lock:
+            self.requests.append((method, url, list(params or [])))
+
+        path = urlparse(url).path
+        if path not in self.pages:
+            return RecordedResponse(url, b"Not Found", 404)
+
+        with open(os.path.join(fixtures_folder, "geocorr", self.pages[path]), "rb") as file:
+            content = file.read()
+
+        return RecordedResponse(url + ("?" + urlencode(params) if params else ""), content)
+
+    def get(self, url: str, params: list = None) -> RecordedResponse:
+        return self._answer("GET", url, params)
+
+    def post(self, url: str, data: list = None) -> RecordedResponse:
+        return self._answer("POST", url, data)
+
+
+# The link to the recorded application
+geocorr_link = urljoin("https://mcdc.missouri.edu", "/applications/geocorr2022.html")
+
+
+@pytest.fixture
+def recorded_geocorr(monkeypatch):
+    """
+    This fixture replaces requests.Session with the RecordedSession, and clears the requests it keeps.
+    """
+
+    requests = pytest.importorskip("requests")
+    pytest.importorskip("bs4")
+
+    RecordedSession.requests = []
+    monkeypatch.setattr(requests, "Session", RecordedSession)
+
+    return RecordedSession
+
+
+
+@pytest.fixture(scope="session")
+def pums_data(tmp_path_factory):
+    """
+    This fixture copies the state files of the PUMS and the GeoCorr crosswalks to a temporary data directory once for
+    every test, so the household arrays and the compiled crosswalks are built there and not in the Data folder. The
+    tests must not change the files of the copy.
+    """
+
+    data_dir = str(tmp_path_factory.mktemp("pums") / "Data") + "/"
+    shutil.copytree(os.path.join(root, "Data", "ACS_PUMS", "state_data"), data_dir + "ACS_PUMS/state_data",
+                    ignore=shutil.ignore_patterns("*.zip"))
+    shutil.copytree(os.path.join(root, "Data", "GeoCorr"), data_dir + "GeoCorr",
+                    ignore=shutil.ignore_patterns(".compiled", ".cache"))
+
+    return data_dir
@@ -0,0 +1,53 @@
+import numpy as np
+
+from Code.Geocorr.crosswalk_registry import allocateTotals
+
+
+def test_targets_add_up_to_sources():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 5000, size=(200, 3)).astype(np.float64)
+
+    # Every source is split between 1 to 4 targets, with afacts of four decimals like the GeoCorr files
+    source_idx, target_idx, afact = [], [], []
+    for source in range(len(values)):
+        number_pieces = rng.integers(1, 5)
+        shares = rng.random(number_pieces)
+        shares = np.round(shares / shares.sum(), 4)
+        source_idx += [source] * number_pieces
+        target_idx += list(rng.integers(0, 50, size=number_pieces))
+        afact += list(shares)
+
+    totals = allocateTotals(values, source_idx, target_idx, afact, 50, exact_allocation=1)
+
+    assert totals.dtype == np.int64
+    np.testing.assert_array_equal(totals.sum(axis=0), values.sum(axis=0))
+
+    # Every target gets within one unit of its unrounded share from every source
+    shares = np.zeros((50, 3))
+    np.add.at(shares, np.array(target_idx), values[source_idx] * np.array(afact)[:, None])
+    assert (np.abs(totals - shares) < np.bincount(target_idx, minlength=50)[:, None] + 1).all()
+
+
+def test_largest_remainder():
+    # 10 units split 0.45 / 0.35 / 0.2 give 4.5 / 3.5 / 2: the whole parts are 4 + 3 + 2 = 9, and the unit that is
+    # left goes to the first of the pieces with the largest remainder
+    totals = allocateTotals(np.array([[10]]), [0, 0, 0], [0, 1, 2], [0.45, 0.35, 0.2], 3, exact_allocation=1)
+    assert totals[:, 0].tolist() == [5, 3, 2]
+
+    # 10 units split in four quarters give 2.5 each. Rounding every piece to even gives 2 + 2 + 2 + 2 = 8, which misses
+    # the total, while the largest remainder method gives the 2 units that are left to the first two pieces
+    totals = allocateTotals(np.array([[10]]), [0, 0, 0, 0], [0, 1, 2, 3], [0.25] * 4, 4)
+    assert totals[:, 0].tolist() == [2, 2, 2, 2]
+
+    totals = allocateTotals(np.array([[10]]), [0, 0, 0, 0], [0, 1, 2, 3], [0.25] * 4, 4, exact_allocation=1)
+    assert totals[:, 0].tolist() == [3, 3, 2, 2]
+
+
+def test_afacts_within_rounding():
+    # The afacts add up to 0.9999, so they are scaled to allocate the whole source
+    totals = allocateTotals(np.array([[3]]), [0, 0, 0], [0, 1, 2], [0.3333, 0.3333, 0.3333], 3, exact_allocation=1)
+    assert totals[:, 0].tolist() == [1, 1, 1]
+
+    # A source that is only half covered keeps its afacts
+    totals = allocateTotals(np.array([[10]]), [0, 0], [0, 1], [0.25, 0.25], 2, exact_allocation=1)
+    assert totals[:, 0].tolist() == [3, 2]
@@ -0,0 +1,42 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from Code.Geocorr.Geocorr_Applications_Downloads import cleanCrossWalkFile
+from conftest import fixtures_folder
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 250000])
+def test_clean_in_chunks(tmp_path, chunk_size):
+    file_name = str(tmp_path / "United_States_Zip-Zcta_to_County.csv")
+    shutil.copyfile(os.path.join(fixtures_folder, "geocorr", "geocorr2022_zcta_county.csv"), file_name)
+
+    assert cleanCrossWalkFile(file_name, "zcta", chunk_size) == (file_name, "zcta")
+
+    df = pd.read_csv(file_name, dtype=str)
+    assert df["zcta"].tolist() == ["0000 ", "35004", "35004", "35005", "99501"]
+    assert df["county"].tolist() == ["01029", "01073", "01115", "01073", "02020"]
+    assert not os.path.exists(file_name + ".part")
+
+
+@pytest.mark.parametrize("content", ["zcta,county,afact\n", "zcta,county,afact\nZIP/ZCTA,County code,factor\n"])
+def test_clean_without_rows(tmp_path, content):
+    file_name = str(tmp_path / "United_States_Zip-Zcta_to_County.csv")
+    with open(file_name, "w") as file:
+        file.write(content)
+
+    cleanCrossWalkFile(file_name, "zcta")
+
+    # The file keeps its columns
+    assert open(file_name).read() == "zcta,county,afact\n"
+
+
+def test_clean_empty_file(tmp_path):
+    file_name = str(tmp_path / "United_States_Zip-Zcta_to_County.csv")
+    open(file_name, "w").close()
+
+    cleanCrossWalkFile(file_name, "zcta")
+
+    assert os.path.getsize(file_name) == 0
@@ -0,0 +1,108 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Code.Geocorr import crosswalk_registry
+from Code.Geocorr.crosswalk_registry import CrossWalk, buildIndex, compiled_arrays, loadCrossWalkFile
+from conftest import root
+
+puma_folder = "Public-use microdata area (PUMA)"
+county_file = "United_States_Public-Use-Microdata-Area-(Puma)_to_County.csv"
+
+
+@pytest.fixture
+def crosswalk_file(tmp_path):
+    """
+    This fixture copies the PUMA to county crosswalk to a temporary GeoCorr folder, so it is compiled there.
+    """
+
+    folder = tmp_path / "GeoCorr" / puma_folder
+    os.makedirs(folder)
+    shutil.copyfile(os.path.join(root, "Data", "GeoCorr", puma_folder, county_file), folder / county_file)
+
+    return str(folder / county_file)
+
+
+def test_recompile_keeps_loaded_arrays(crosswalk_file):
+    old = loadCrossWalkFile(crosswalk_file, "puma")
+    assert loadCrossWalkFile(crosswalk_file, "puma") is old
+    old_afact = np.array(old.afact)
+
+    # Download the crosswalk again, with fewer rows
+    df = pd.read_csv(crosswalk_file, dtype=str)
+    df.iloc[:100].to_csv(crosswalk_file, index=False)
+    os.utime(crosswalk_file, (os.path.getmtime(crosswalk_file) + 10,) * 2)
+
+    new = loadCrossWalkFile(crosswalk_file, "puma")
+
+    # The crosswalk is loaded again from the new file, and the arrays of the old one are still the old arrays
+    assert new is not old
+    assert len(new) == 100
+    np.testing.assert_array_equal(np.array(old.afact), old_afact)
+
+    compiled_folder = os.path.join(os.path.dirname(os.path.dirname(crosswalk_file)), ".compiled")
+    assert not [file for _, _, files in os.walk(compiled_folder) for file in files if file.endswith(".part")]
+
+
+def test_build_index():
+    offsets, rows = buildIndex(np.array([2, 0, 2, 1, 0]), 4)
+
+    # The rows of every code, in the order of the file, and no rows for code 3
+    assert offsets.tolist() == [0, 2, 3, 5, 5]
+    assert rows.tolist() == [1, 4, 3, 0, 2]
+
+
+def maskRows(codes: np.ndarray, wanted: list[str]) -> np.ndarray:
+    # The rows of the codes found by scanning every row, grouped by code in sorted order like the index
+    return np.concatenate([np.flatnonzero(codes == code) for code in sorted(set(wanted))] + [np.zeros(0, dtype=int)])
+
+
+@pytest.mark.parametrize("with_index", [1, 0])
+def test_index_matches_scan(crosswalk_file, with_index):
+    crosswalk = loadCrossWalkFile(crosswalk_file, "puma")
+    if with_index == 0:
+        # A CrossWalk without the index builds it in memory
+        crosswalk = CrossWalk(crosswalk.file_path, crosswalk.source_col, crosswalk.target_col, crosswalk.source_codes,
+                              crosswalk.target_codes, crosswalk.source_idx, crosswalk.target_idx, crosswalk.afact)
+
+    df = pd.read_csv(crosswalk_file, dtype={"puma22": str, "county": str})
+    sources = df["puma22"].to_numpy(dtype=str)
+    targets = df["county"].to_numpy(dtype=str)
+
+    # Some codes of several states, a code twice, and codes that are not in the crosswalk
+    wanted_sources = ["0100100", "0600101", "3604103", "0600101", "9999999", ""]
+    wanted_targets = ["01033", "06037", "36061", "36061", "99999"]
+
+    assert len(maskRows(sources, wanted_sources)) > 3
+    np.testing.assert_array_equal(crosswalk.sourceRows(wanted_sources), maskRows(sources, wanted_sources))
+    np.testing.assert_array_equal(crosswalk.targetRows(wanted_targets), maskRows(targets, wanted_targets))
+
+    np.testing.assert_array_equal(crosswalk.targetsOf(wanted_sources),
+                                  np.unique(targets[np.isin(sources, wanted_sources)]))
+    np.testing.assert_array_equal(crosswalk.sourcesOf(wanted_targets),
+                                  np.unique(sources[np.isin(targets, wanted_targets)]))
+
+    # Only unknown codes give no rows, and no codes give every row
+    assert len(crosswalk.sourceRows(["9999999"])) == 0
+    assert len(crosswalk.targetsOf(["9999999"])) == 0
+    assert sorted(crosswalk.targetRows()) == list(range(len(df)))
+
+
+def test_old_compile_without_index(crosswalk_file):
+    crosswalk = loadCrossWalkFile(crosswalk_file, "puma")
+    expected = crosswalk.targetsOf(["0600101", "3604103"])
+
+    # A folder compiled before the index was saved has only the rows
+    compiled_folder = crosswalk_registry._compiledFolder(crosswalk_file)
+    for name in ["source_offsets", "source_rows", "target_offsets", "target_rows"]:
+        os.remove(os.path.join(compiled_folder, name + ".npy"))
+    crosswalk_registry._loaded_crosswalks.pop(os.path.abspath(crosswalk_file))
+
+    crosswalk = loadCrossWalkFile(crosswalk_file, "puma")
+
+    # The file is compiled again with the index
+    assert all(os.path.exists(os.path.join(compiled_folder, name + ".npy")) for name in compiled_arrays)
+    np.testing.assert_array_equal(crosswalk.targetsOf(["0600101", "3604103"]), expected)
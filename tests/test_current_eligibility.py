@@ -0,0 +1,45 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+from Code.ACS_PUMS import acs_pums
+from Code.ACS_PUMS.acs_pums import baselineEligibility, everyGeographyEligibility
+
+
+@pytest.fixture
+def data_dir(pums_data, tmp_path):
+    """
+    This fixture copies the data directory of pums_data, so the test can write the current eligibility.
+    """
+
+    data_dir = str(tmp_path / "Data") + "/"
+    shutil.copytree(pums_data, data_dir, ignore=shutil.ignore_patterns("Current_Eligibility", "Change_Eligibility",
+                                                                       ".puma_aggregates"))
+    acs_pums._baselines.clear()
+    yield data_dir
+    acs_pums._baselines.clear()
+
+
+def test_baseline_standard_errors_are_not_copied(data_dir):
+    current_file = everyGeographyEligibility(data_dir, geographies=["State"])["State"]
+
+    # The current eligibility was determined with standard errors
+    current_df = pd.read_csv(current_file, dtype={"state": str})
+    current_df.assign(**{"Num Eligible SE": 10, "Num Ineligible SE": 10}).to_csv(current_file, index=False)
+    acs_pums._baselines.clear()
+
+    change_df = pd.read_csv(everyGeographyEligibility(data_dir, povpip=150, geographies=["State"])["State"])
+
+    assert change_df.columns.tolist() == ["state", "Current Num Eligible", "Current Num Ineligible",
+                                          "Current Percentage Eligible", "Num Eligible", "Num Ineligible",
+                                          "Percentage Eligible"]
+
+
+def test_computed_baseline_by_exact_allocation(data_dir):
+    rounded = baselineEligibility(data_dir, "metdiv20", [], exact_allocation=0)
+    exact = baselineEligibility(data_dir, "metdiv20", [], exact_allocation=1)
+
+    # Without a file, the current eligibility of every mode is computed and kept on its own
+    assert exact is not rounded
+    assert baselineEligibility(data_dir, "metdiv20", [], exact_allocation=0) is rounded
@@ -0,0 +1,51 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from Code.ACS_PUMS.acs_pums import aggregateSavings, createDeliverableFiles
+from conftest import root
+
+sweep_file = "percentage_eligible_povpip_{}_has_pap_has_ssip_has_hins4_has_snap-state.csv"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    This fixture copies the deliverable folder and three files of the sweep, two of them with the same povpip but other
+    criteria.
+    """
+
+    pums_folder = tmp_path / "ACS_PUMS"
+    national_folder = pums_folder / "National_Changes"
+    os.makedirs(national_folder)
+    shutil.copytree(os.path.join(root, "Data", "ACS_PUMS", "deliverable_file"), pums_folder / "deliverable_file")
+
+    source_folder = os.path.join(root, "Data", "ACS_PUMS", "National_Changes")
+    shutil.copyfile(os.path.join(source_folder, sweep_file.format(120)), national_folder / sweep_file.format(120))
+    shutil.copyfile(os.path.join(source_folder, sweep_file.format(135)), national_folder / sweep_file.format(135))
+
+    # The same povpip without the SSIP and HINS4 criteria, with fewer eligible households
+    df = pd.read_csv(os.path.join(source_folder, sweep_file.format(135)), dtype={"state": str})
+    df["Num Eligible"] = df["Num Eligible"] // 2
+    df.to_csv(national_folder / "percentage_eligible_povpip_135_has_pap_has_snap-state.csv", index=False)
+
+    return str(tmp_path) + "/"
+
+
+def test_scenarios_with_the_same_povpip(data_dir):
+    national_folder = data_dir + "ACS_PUMS/National_Changes/"
+    sizes = {file: len(pd.read_csv(national_folder + file)) for file in os.listdir(national_folder)}
+
+    aggregateSavings(data_dir, createDeliverableFiles(data_dir))
+
+    # Every file keeps its own rows and gets its own savings
+    for file, size in sizes.items():
+        df = pd.read_csv(national_folder + file)
+        assert len(df) == size
+        assert df["Saving in $"].notna().any()
+
+    savings = pd.read_csv(data_dir + "ACS_PUMS/deliverable_file/national_savings.csv", dtype={"POVPIP": str})
+    assert savings["POVPIP"].tolist() == ["120", "135_has_pap_has_snap", "135_has_pap_has_ssip_has_hins4_has_snap"]
+    assert savings["National Saving"].nunique() == 3
@@ -0,0 +1,62 @@
+import glob
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Code.ACS_PUMS.eligibility_kernel import numba, pumaTotals
+from Code.ACS_PUMS.household_array import eligibilityCriteria, loadHouseholdArray, population_columns
+
+compiled = [0] + ([1] if numba is not None else [])
+
+
+@pytest.fixture(scope="module")
+def state_df(pums_data):
+    files = sorted(glob.glob(pums_data + "ACS_PUMS/state_data/*/*-eligibility.csv"))
+    return pd.concat([pd.read_csv(file).drop(columns=["SERIALNO"]) for file in files], ignore_index=True)
+
+
+def pandasTotals(df: pd.DataFrame, puma_codes: np.ndarray, povpip: int, has_pap: int, has_ssip: int, has_hins4: int,
+                 has_snap: int, population_names: list[str]) -> np.ndarray:
+    # The flags of the state files, as computePUMAEligibility flagged them with pandas
+    df = df.assign(acp_eligible=0)
+    df.loc[((df["POVPIP"] <= povpip) & (povpip != 0)) | ((df["has_pap"] == 1) & (has_pap == 1)) |
+           ((df["has_ssip"] == 1) & (has_ssip == 1)) | ((df["has_hins4"] == 1) & (has_hins4 == 1)) |
+           ((df["has_snap"] == 1) & (has_snap == 1)), "acp_eligible"] = 1
+
+    eligible = df.loc[df["acp_eligible"] == 1].groupby("PUMA_person")[["WGTP"] + population_names].sum()
+    total = df.groupby("PUMA_person")["WGTP"].sum()
+
+    # The totals in the order of the PUMAs of the household arrays, with the populations in the order of their bits
+    codes = pd.Index(np.asarray(puma_codes).astype(np.int64))
+    population_order = sorted(population_names, key=population_columns.index)
+    totals = np.zeros((len(codes), 2 + len(population_names)), dtype=np.int64)
+    totals[:, 0] = eligible["WGTP"].reindex(codes, fill_value=0)
+    totals[:, 1] = total.reindex(codes, fill_value=0)
+    for column, population_name in enumerate(population_order):
+        totals[:, 2 + column] = eligible[population_name].reindex(codes, fill_value=0)
+
+    return totals
+
+
+@pytest.mark.parametrize("compiled", compiled)
+@pytest.mark.parametrize("povpip, has_pap, has_ssip, has_hins4, has_snap, population_names", [
+    (200, 1, 1, 1, 1, []),
+    (135, 0, 1, 0, 1, ["Veteran", "American Indian and Alaska Native"]),
+    # If the povpip is 0, the income is not used
+    (0, 1, 0, 1, 0, population_columns),
+    (0, 0, 0, 0, 0, ["Elderly"]),
+    (501, 0, 0, 0, 0, []),
+])
+def test_kernel_matches_pandas(pums_data, state_df, compiled, povpip, has_pap, has_ssip, has_hins4, has_snap,
+                               population_names):
+    households = loadHouseholdArray(pums_data)
+
+    totals = pumaTotals(households.povpip, households.programs, households.wgtp, households.puma_idx,
+                        households.populations,
+                        eligibilityCriteria(povpip, has_pap, has_ssip, has_hins4, has_snap, population_names),
+                        len(households.puma_codes), compiled=compiled)
+
+    expected = pandasTotals(state_df, households.puma_codes, povpip, has_pap, has_ssip, has_hins4, has_snap,
+                            population_names)
+    np.testing.assert_array_equal(totals, expected)
@@ -0,0 +1,87 @@
+import os
+
+import pandas as pd
+import pytest
+
+from Code.Geocorr.Geocorr_Applications_Downloads import (crossWalkFilePath, fetchCrossWalkFile, fetchCrossWalkFiles,
+                                                        geocorr_states, parseGeoCorrForm)
+from conftest import geocorr_link
+
+
+def test_parse_form(recorded_geocorr):
+    form = parseGeoCorrForm(geocorr_link)
+
+    assert form["action"] == "https://mcdc.missouri.edu/cgi-bin/broker"
+    assert form["method"] == "get"
+
+    # The hidden fields, the checked boxes and the selected options are kept, like a browser would submit them
+    assert ("_PROGRAM", "apps.geocorr2022.sas") in form["fields"]
+    assert ("csvout", "1") in form["fields"]
+    assert ("wtvar", "pop20") in form["fields"]
+    assert "namoptf" not in [name for name, _ in form["fields"]]
+
+    assert form["state"][0] == "state"
+    assert form["state"][1]["Alabama"] == "Al01"
+    assert form["source"] == ("g1_", {"County": "county", "Public-use microdata area (PUMA)": "puma22",
+                                      "ZIP/ZCTA": "zcta"})
+    assert form["target"][0] == "g2_"
+
+
+def test_parse_form_without_target_list(recorded_geocorr, tmp_path, monkeypatch):
+    page = open(os.path.join(os.path.dirname(__file__), "fixtures", "geocorr", "geocorr2022.html")).read()
+    start = page.index('<select name="g2_"')
+    (tmp_path / "changed.html").write_text(page[:start] + page[page.index("</select>", start) + 9:])
+
+    monkeypatch.setitem(recorded_geocorr.pages, "/applications/geocorr2022.html", str(tmp_path / "changed.html"))
+
+    with pytest.raises(ValueError, match="lists of geographies"):
+        parseGeoCorrForm(geocorr_link)
+
+
+def test_fetch_crosswalk_file(recorded_geocorr, tmp_path):
+    data_dir = str(tmp_path) + "/"
+
+    file_path, source_col = fetchCrossWalkFile(geocorr_link, data_dir, "ZIP/ZCTA", "County")
+
+    assert source_col == "zcta"
+    assert file_path == crossWalkFilePath(geocorr_link, data_dir + "GeoCorr/ZIP_ZCTA", "ZIP/ZCTA", "County")
+
+    # The form was submitted with every state and the requested geographies, without the defaults of the lists
+    method, _, params = recorded_geocorr.requests[1]
+    assert method == "GET"
+    assert [value for name, value in params if name == "g1_"] == ["zcta"]
+    assert [value for name, value in params if name == "g2_"] == ["county"]
+    assert len([value for name, value in params if name == "state"]) == len(geocorr_states) + 1
+    assert ("_SERVICE", "MCDC_long") in params
+
+    # The file was cleaned: the label row is removed and the codes are padded
+    df = pd.read_csv(file_path, dtype=str)
+    assert df.columns.tolist() == ["zcta", "county", "CountyName", "ZIPName", "pop20", "afact"]
+    assert df.loc[df["zcta"] == "35005", "county"].tolist() == ["01073"]
+    assert len(df) == 5
+
+    # The second download of the same file comes from the cache
+    number_requests = len(recorded_geocorr.requests)
+    fetchCrossWalkFile(geocorr_link, data_dir, "ZIP/ZCTA", "County")
+    assert len(recorded_geocorr.requests) == number_requests
+
+
+def test_fetch_crosswalk_files_once_per_pair(recorded_geocorr, tmp_path):
+    data_dir = str(tmp_path) + "/"
+    pairs = [("ZIP/ZCTA", "County"), ("ZIP/ZCTA", "County"), ("ZIP/ZCTA", "County")]
+
+    results = fetchCrossWalkFiles(geocorr_link, data_dir, pairs, max_workers=3)
+
+    assert list(results) == [("ZIP/ZCTA", "County")]
+
+    # The form is read once, and the query and the file are requested once
+    assert [method for method, url, _ in recorded_geocorr.requests].count("GET") == 3
+
+    # No temporary file is left in the cache
+    cache_folder = data_dir + "GeoCorr/.cache/geocorr2022/"
+    assert os.listdir(cache_folder) == ["zip-zcta_county_0.csv"]
+
+
+def test_fetch_unknown_geography(recorded_geocorr, tmp_path):
+    with pytest.raises(ValueError, match="Census tract"):
+        fetchCrossWalkFile(geocorr_link, str(tmp_path) + "/", "ZIP/ZCTA", "Census tract")
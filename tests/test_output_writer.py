@@ -0,0 +1,17 @@
+import os
+
+import pandas as pd
+
+from Code.output_writer import findOutputFile, outputFile, readFrame, writeFrame
+
+
+def test_new_format_replaces_old_file(tmp_path):
+    file_name = str(tmp_path / "percentage_eligible_povpip_150-state")
+    writeFrame(pd.DataFrame({"state": ["01"], "Num Eligible": [1]}), outputFile(file_name, "csv"))
+
+    # The same scenario saved again in another format
+    writeFrame(pd.DataFrame({"state": ["01"], "Num Eligible": [2]}), outputFile(file_name, "csv.gz"))
+
+    assert os.listdir(tmp_path) == ["percentage_eligible_povpip_150-state.csv.gz"]
+    assert findOutputFile(file_name) == file_name + ".csv.gz"
+    assert readFrame(findOutputFile(file_name), ["state"])["Num Eligible"].tolist() == [2]
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+import pytest
+
+from Code import main_script
+from Code.pipeline import PipelineStage, runPipeline
+
+
+def touch(path: str, mtime: float):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write("x")
+    os.utime(path, (mtime, mtime))
+
+
+def test_failed_stage(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    state_file = data_dir + "pipeline_state.json"
+    runs = []
+
+    def fail():
+        runs.append("fail")
+        raise RuntimeError("The stage failed")
+
+    now = time.time()
+    touch(data_dir + "input.csv", now - 100)
+    touch(data_dir + "output.csv", now - 50)
+
+    # The output is newer than the input, but the stage failed after it was written, so it runs again
+    stages = [PipelineStage("stage", fail, inputs=["input.csv"], outputs=["output.csv"])]
+    assert runPipeline(stages, data_dir, state_file, force=["stage"]) == {"stage": "failed"}
+    assert runPipeline(stages, data_dir, state_file) == {"stage": "failed"}
+    assert runs == ["fail", "fail"]
+
+    # Once the output is written again after the failure, the stage is up to date
+    touch(data_dir + "output.csv", json.load(open(state_file))["stage"]["time"] + 10)
+    assert runPipeline(stages, data_dir, state_file) == {"stage": "skipped"}
+    assert runs == ["fail", "fail"]
+
+
+def test_stage_after_dependency(tmp_path):
+    data_dir = str(tmp_path) + "/"
+    runs = []
+
+    def write(name: str):
+        def function():
+            runs.append(name)
+            touch(data_dir + name + ".csv", time.time())
+        return function
+
+    stages = [PipelineStage("first", write("first"), outputs=["first.csv"]),
+              PipelineStage("second", write("second"), inputs=["first.csv"], outputs=["second.csv"],
+                            depends_on=["first"])]
+
+    assert runPipeline(stages, data_dir) == {"first": "done", "second": "done"}
+    assert runPipeline(stages, data_dir) == {"first": "skipped", "second": "skipped"}
+    assert runPipeline(stages, data_dir, force=["first"]) == {"first": "done", "second": "done"}
+    assert runs == ["first", "second", "first", "second"]
+
+
+def test_stages_have_their_own_outputs():
+    outputs = {}
+    for stage in main_script.buildPipeline("Data/"):
+        for output in stage.outputs:
+            assert output not in outputs, f"{stage.name} and {outputs[output]} both write {output}"
+            outputs[output] = stage.name
+
+
+def test_default_command(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main_script, "povpipSweep", lambda data_dir, start, stop: calls.append(("sweep", start, stop)))
+    monkeypatch.setattr(main_script, "runDeliverables", lambda args: calls.append(("deliverables", args.data_dir)))
+    monkeypatch.setattr(main_script, "runWholePipeline", lambda args: calls.append("pipeline"))
+
+    main_script.main(["--data-dir", "Data/"])
+
+    assert calls == [("sweep", 120, 200), ("deliverables", "Data/")]
+
+
+def test_command_flags():
+    parser = main_script.buildParser()
+
+    # The flags are 0 or 1, like the other flags of the commands
+    assert parser.parse_args(["tracker"]).download == 0
+    assert parser.parse_args(["tracker", "--download", "1"]).download == 1
+
+    # The states are the folders of the states for the state files, and FIPS codes for the areas
+    assert parser.parse_args(["update-states", "--state-folders", "al"]).state_folders == ["al"]
+    assert parser.parse_args(["eligibility", "--state-fips", "01"]).state_fips == ["01"]
+    with pytest.raises(SystemExit):
+        parser.parse_args(["eligibility", "--states", "01"])
@@ -0,0 +1,88 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Code import pipeline_trace
+from Code.output_writer import OutputWriter
+from Code.pipeline_trace import disableTracing, enableTracing, submitTraced, traceStage, writeTrace
+
+
+@pytest.fixture
+def trace_folder(tmp_path):
+    enableTracing(str(tmp_path))
+    yield tmp_path
+    disableTracing()
+
+
+def currentRssMb() -> float:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+@pytest.mark.skipif(pipeline_trace.resource is None or not os.path.exists("/proc/self/statm"),
+                    reason="The peak and current memory are not measured on this platform")
+def test_stage_memory(trace_folder):
+    # The tests that ran before may have left the peak of the process above the memory it uses now, so the first stage
+    # fills that gap and then raises the peak by about 200 MB
+    gap_mb = max(pipeline_trace._peakRssMb() - currentRssMb(), 0)
+    with traceStage("large"):
+        array = np.ones(int((gap_mb + 200) * 1024 * 1024) // 8)
+        del array
+
+    # The second stage stays below that peak, so it does not raise it
+    with traceStage("small"):
+        array = np.ones(1024)
+
+    with open(writeTrace()) as file:
+        large, small = json.load(file)["stages"]
+
+    assert large["peak_rss_growth_mb"] >= 150
+    assert small["peak_rss_growth_mb"] < 10
+
+    # The peak of the process never goes down
+    assert small["process_peak_rss_mb"] >= large["process_peak_rss_mb"]
+    assert "peak_rss_mb" not in small
+
+
+def test_nested_stages(trace_folder):
+    with traceStage("outer") as outer:
+        for _ in range(3):
+            with traceStage("inner") as inner:
+                inner.addRows(rows_in=2, rows_out=1)
+        outer.addRows(rows_out=1)
+
+    with open(writeTrace()) as file:
+        (stage,) = json.load(file)["stages"]
+
+    assert stage["name"] == "outer"
+    assert stage["rows_out"] == 1
+    assert [(child["name"], child["calls"], child["rows_in"]) for child in stage["stages"]] == [("inner", 3, 6)]
+
+
+def test_stages_in_threads(trace_folder):
+    def task(rows: int):
+        with traceStage("crosswalk") as stage:
+            stage.addRows(rows_in=rows)
+
+    with traceStage("outer"):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [submitTraced(executor, task, rows) for rows in range(1, 101)]
+            for future in futures:
+                future.result()
+
+        with OutputWriter(max_workers=2) as writer:
+            for number in range(3):
+                writer.submit(pd.DataFrame({"a": [number]}), str(trace_folder / f"{number}.csv"))
+
+    with open(writeTrace()) as file:
+        (stage,) = json.load(file)["stages"]
+
+    # The stages of the threads are sub-stages of the stage that submitted them
+    children = {child["name"]: child for child in stage["stages"]}
+    assert children["crosswalk"]["calls"] == 100
+    assert children["crosswalk"]["rows_in"] == sum(range(1, 101))
+    assert children["write"]["calls"] == 3
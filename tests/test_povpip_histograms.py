@@ -0,0 +1,20 @@
+import pytest
+
+from Code.ACS_PUMS.povpip_histograms import max_povpip, thresholdCurves
+
+
+def test_thresholds_above_max_povpip(pums_data):
+    df = thresholdCurves(pums_data, "State", povpips=[135, max_povpip, max_povpip + 1, 1000])
+
+    by_povpip = {povpip: group.drop(columns="povpip").reset_index(drop=True) for povpip, group in df.groupby("povpip")}
+
+    # Every household is eligible at a threshold above the largest POVPIP
+    assert (by_povpip[max_povpip]["Num Ineligible"] == 0).all()
+    assert by_povpip[max_povpip + 1].equals(by_povpip[max_povpip])
+    assert by_povpip[1000].equals(by_povpip[max_povpip])
+    assert (by_povpip[135]["Num Eligible"] < by_povpip[max_povpip]["Num Eligible"]).all()
+
+
+def test_negative_threshold(pums_data):
+    with pytest.raises(ValueError, match="0 or more"):
+        thresholdCurves(pums_data, "State", povpips=[135, -1])
@@ -0,0 +1,96 @@
+import gzip
+import os
+import shutil
+import zipfile
+
+import pandas as pd
+import pytest
+
+from Code.ACS_PUMS import acs_pums
+from Code.ACS_PUMS.acs_pums import everyStateEligibility, replicateWeightsFile
+from conftest import root
+
+
+@pytest.fixture
+def state_folder(tmp_path):
+    """
+    This fixture copies the PUMS zip files of Alaska to a temporary data directory.
+    """
+
+    state_dir = tmp_path / "ACS_PUMS" / "state_data" / "ak"
+    os.makedirs(state_dir)
+    for file in ["csv_hak.zip", "csv_pak.zip"]:
+        shutil.copyfile(os.path.join(root, "Data", "ACS_PUMS", "state_data", "ak", file), state_dir / file)
+
+    return str(tmp_path) + "/", str(state_dir / "ak-eligibility.csv")
+
+
+def readOutputs(end_file: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    eligibility_df = pd.read_csv(end_file, dtype={"SERIALNO": str, "PUMA": str}).sort_values("SERIALNO")
+    with gzip.open(replicateWeightsFile(end_file), "rt") as file:
+        weights_df = pd.read_csv(file, dtype={"SERIALNO": str}).sort_values("SERIALNO")
+
+    return eligibility_df.reset_index(drop=True), weights_df.reset_index(drop=True)
+
+
+def test_chunked_matches_full(state_folder, monkeypatch):
+    data_dir, end_file = state_folder
+
+    everyStateEligibility(data_dir, states=["ak"])
+    full = readOutputs(end_file)
+
+    # Make the chunks small, so the person records are read in many chunks
+    monkeypatch.setattr(acs_pums, "chunk_memory_factor", 2000)
+    monkeypatch.setattr(acs_pums, "chunk_min_rows", 10)
+    chunks = []
+    person_chunks = acs_pums._personChunks
+    monkeypatch.setattr(acs_pums, "_personChunks",
+                        lambda *args: (chunks.append(len(chunk)) or chunk for chunk in person_chunks(*args)))
+
+    everyStateEligibility(data_dir, states=["ak"], memory_budget_mb=200)
+    chunked = readOutputs(end_file)
+
+    assert len(chunks) > 5
+    pd.testing.assert_frame_equal(full[0], chunked[0])
+    pd.testing.assert_frame_equal(full[1], chunked[1])
+
+
+def test_budget_too_small(state_folder):
+    data_dir, end_file = state_folder
+
+    with pytest.raises(ValueError, match="budget has to be at least"):
+        everyStateEligibility(data_dir, states=["ak"], memory_budget_mb=1)
+
+
+@pytest.mark.parametrize("memory_budget_mb", [None, 500])
+def test_state_without_files(state_folder, memory_budget_mb):
+    data_dir, _ = state_folder
+    os.makedirs(data_dir + "ACS_PUMS/state_data/dc")
+
+    everyStateEligibility(data_dir, states=["dc"], memory_budget_mb=memory_budget_mb)
+
+    assert os.listdir(data_dir + "ACS_PUMS/state_data/dc") == []
+
+
+def test_households_without_replicate_weights(state_folder):
+    data_dir, end_file = state_folder
+
+    # The household file without the WGTP1 to WGTP80 replicate weights
+    zip_path = os.path.join(os.path.dirname(end_file), "csv_hak.zip")
+    with zipfile.ZipFile(zip_path) as zip_file:
+        member = [file for file in zip_file.namelist() if file.endswith(".csv")][0]
+        with zip_file.open(member) as file:
+            household_df = pd.read_csv(file, dtype=str)
+    household_df = household_df.drop(columns=[column for column in household_df.columns
+                                              if column.startswith("WGTP") and column != "WGTP"])
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        zip_file.writestr(member, household_df.to_csv(index=False))
+
+    everyStateEligibility(data_dir, states=["ak"])
+    full = pd.read_csv(end_file, dtype={"SERIALNO": str, "PUMA": str})
+    assert not os.path.exists(replicateWeightsFile(end_file))
+
+    # The chunked mode saves the same file, also without the replicate weights
+    everyStateEligibility(data_dir, states=["ak"], memory_budget_mb=200)
+    pd.testing.assert_frame_equal(pd.read_csv(end_file, dtype={"SERIALNO": str, "PUMA": str}), full)
+    assert not os.path.exists(replicateWeightsFile(end_file))
@@ -0,0 +1,97 @@
+import json
+import shutil
+
+import pandas as pd
+import pytest
+
+from Code.ACS_PUMS import acs_pums
+from Code.ACS_PUMS.acs_pums import everyGeographyEligibility, pumaAggregatesFolder, updateStateEligibility
+
+# Delaware is in the Philadelphia metropolitan division, which crosses the state line. The county files download the
+# rural counties from the Census website, so they are not used
+geographies = ["Public-use microdata area (PUMA)", "Metropolitan division", "State"]
+
+
+@pytest.fixture
+def data_dir(pums_data, tmp_path):
+    """
+    This fixture copies the data directory of pums_data, so the test can change the state files.
+    """
+
+    data_dir = str(tmp_path / "Data") + "/"
+    shutil.copytree(pums_data, data_dir, ignore=shutil.ignore_patterns("Current_Eligibility", "Change_Eligibility",
+                                                                       ".puma_aggregates"))
+    acs_pums._baselines.clear()
+    yield data_dir
+    acs_pums._baselines.clear()
+
+
+def buildScenarios(data_dir: str) -> dict[str, str]:
+    paths = everyGeographyEligibility(data_dir, geographies=geographies, save_aggregates=1)
+    paths.update({"150-" + geography: path for geography, path in
+                  everyGeographyEligibility(data_dir, povpip=150, geographies=geographies, save_aggregates=1).items()})
+    return paths
+
+
+def readFiles(paths: dict[str, str]) -> dict[str, pd.DataFrame]:
+    return {key: pd.read_csv(path, dtype=str) for key, path in paths.items()}
+
+
+def changeState(data_dir: str):
+    # Drop every other household of Delaware, as if its PUMS files were published again
+    state_file = data_dir + "ACS_PUMS/state_data/de/de-eligibility.csv"
+    df = pd.read_csv(state_file, dtype=str)
+    df.iloc[::2].to_csv(state_file, index=False)
+
+
+def test_update_matches_rebuild(data_dir):
+    paths = buildScenarios(data_dir)
+    before = readFiles(paths)
+    changeState(data_dir)
+
+    # Every geography is updated by default. The county files were never written, and there is no crosswalk from the
+    # PUMAs to the ZCTAs, so a ZIP/ZCTA file is not updated either
+    zcta_file = paths["State"].replace("-state.csv", "-zcta.csv")
+    pd.DataFrame({"zcta": ["00601"], "Num Eligible": [1]}).to_csv(zcta_file, index=False)
+    updated = updateStateEligibility(data_dir)
+
+    assert sorted(len(files) for files in updated.values()) == [3, 3]
+    patched = readFiles(paths)
+    assert not patched["150-State"].equals(before["150-State"])
+
+    # The patched files are the same as the files of every state computed again
+    acs_pums._baselines.clear()
+    assert buildScenarios(data_dir) == paths
+    for key, df in readFiles(paths).items():
+        pd.testing.assert_frame_equal(patched[key], df, obj=key)
+    assert zcta_file not in [path for files in updated.values() for path in files]
+
+    # The scenarios are up to date
+    assert updateStateEligibility(data_dir, geographies=geographies) == {}
+
+
+def test_standard_errors_are_skipped(data_dir, capsys):
+    paths = buildScenarios(data_dir)
+
+    # Give the metropolitan division file of the povpip 150 scenario a standard error column
+    metro_df = pd.read_csv(paths["150-Metropolitan division"], dtype=str).assign(**{"Num Eligible SE": "1"})
+    metro_df.to_csv(paths["150-Metropolitan division"], index=False)
+
+    before = readFiles(paths)
+    meta_file = pumaAggregatesFolder(data_dir, paths["150-State"].rsplit("-", 1)[0]) + "meta.json"
+    with open(meta_file) as file:
+        meta = json.load(file)
+
+    changeState(data_dir)
+    updated = updateStateEligibility(data_dir, geographies=geographies)
+
+    # The current eligibility is updated, and none of the files of the scenario with standard errors are written
+    assert list(updated) == [paths["State"].rsplit("-", 1)[0]]
+    assert "is not updated" in capsys.readouterr().out
+    after = readFiles(paths)
+    for geography in geographies:
+        pd.testing.assert_frame_equal(after["150-" + geography], before["150-" + geography])
+
+    # The scenario is still out of date, so it is updated again the next time
+    with open(meta_file) as file:
+        assert json.load(file) == meta